@@ -0,0 +1,545 @@
+import asyncio
+import json
+from datetime import date, timedelta
+from typing import Any, Awaitable, Callable, Optional
+
+import requests
+from aiohttp import WSMsgType, web
+from PyViCare.PyViCareAbstractOAuthManager import AbstractViCareOAuthManager
+
+
+class TrafficStats:
+    """
+    Requests handled by a fake server and the bytes of their payloads (URL + body, without the headers)
+    """
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+    def reset(self) -> None:
+        self.requests = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return {
+            "requests": self.requests,
+            "bytes_received": self.bytes_received,
+            "bytes_sent": self.bytes_sent,
+        }
+
+
+class FakeServer:
+    """
+    In-process HTTP server standing in for one of the external services
+    """
+
+    name = ""
+
+    def __init__(self, latency_seconds: float = 0) -> None:
+        # Added to every response, to mimic a real server on the network
+        self.latency_seconds = latency_seconds
+        self.stats = TrafficStats()
+
+        self._runner: Optional[web.AppRunner] = None
+        self.url = ""
+
+    def _routes(self, app: web.Application) -> None:
+        raise NotImplementedError()
+
+    @web.middleware
+    async def _count_traffic(
+        self,
+        request: web.Request,
+        handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
+    ) -> web.StreamResponse:
+        body = await request.read()
+
+        if self.latency_seconds > 0:
+            await asyncio.sleep(self.latency_seconds)
+
+        self.stats.requests += 1
+        # The body is already decompressed, while the Content-Length is what went over the wire
+        self.stats.bytes_received += len(request.raw_path) + (
+            request.content_length or len(body)
+        )
+
+        response = await handler(request)
+        if isinstance(response, web.Response) and isinstance(response.body, bytes):
+            self.stats.bytes_sent += len(response.body)
+
+        return response
+
+    async def start(self) -> None:
+        app = web.Application(middlewares=[self._count_traffic])
+        self._routes(app)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self) -> "FakeServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.stop()
+
+
+class ScriptedBoiler:
+    """
+    State of a simulated gas boiler, rendered as the Viessmann features response.
+
+    The daily values are ordered from the newest (today) to the oldest, the same way the API returns them.
+    """
+
+    def __init__(
+        self,
+        today: date,
+        daily: list[int],
+        number_of_burners: int = 1,
+        base_payload: Optional[dict] = None,
+    ) -> None:
+        self.today = today
+        self.daily = list(daily)
+        self.year_total = 4000 + sum(daily)
+        self.modulations = [30] * number_of_burners
+        self.boiler_temperature = 45.0
+
+        # Recorded response of the API - its other features are served unchanged,
+        # so that the size of the payload is realistic
+        self.base_payload = base_payload or {"data": []}
+
+    def consume(self, amount: int) -> None:
+        self.daily[0] += amount
+        self.year_total += amount
+
+    def new_day(self) -> None:
+        self.today += timedelta(days=1)
+        self.daily = [0] + self.daily[:-1]
+
+    def _read_at(self, day: date) -> dict:
+        return {"type": "string", "value": f"{day.isoformat()}T21:00:00.000Z"}
+
+    def features(self) -> dict:
+        replaced = {
+            "heating.gas.consumption.total",
+            "heating.boiler.sensors.temperature.main",
+        } | {f"heating.burners.{i}.modulation" for i in range(len(self.modulations))}
+
+        data = [
+            feature
+            for feature in self.base_payload.get("data", [])
+            if feature.get("feature") not in replaced
+        ]
+
+        data.append(
+            {
+                "feature": "heating.gas.consumption.total",
+                "timestamp": f"{self.today.isoformat()}T21:05:00.000Z",
+                "isEnabled": True,
+                "properties": {
+                    "day": {"type": "array", "value": list(self.daily)},
+                    "week": {"type": "array", "value": [sum(self.daily[:7])]},
+                    "month": {"type": "array", "value": [sum(self.daily)]},
+                    "year": {"type": "array", "value": [self.year_total]},
+                    "dayValueReadAt": self._read_at(self.today),
+                    "weekValueReadAt": self._read_at(self.today),
+                    "monthValueReadAt": self._read_at(self.today),
+                    "yearValueReadAt": self._read_at(self.today),
+                    "unit": {"type": "string", "value": "kilowattHour"},
+                },
+            }
+        )
+        data.append(
+            {
+                "feature": "heating.boiler.sensors.temperature.main",
+                "timestamp": f"{self.today.isoformat()}T21:05:00.000Z",
+                "isEnabled": True,
+                "properties": {
+                    "value": {
+                        "type": "number",
+                        "value": self.boiler_temperature,
+                        "unit": "celsius",
+                    }
+                },
+            }
+        )
+        for i, modulation in enumerate(self.modulations):
+            data.append(
+                {
+                    "feature": f"heating.burners.{i}.modulation",
+                    "timestamp": f"{self.today.isoformat()}T21:05:00.000Z",
+                    "isEnabled": True,
+                    "properties": {
+                        "value": {
+                            "type": "number",
+                            "value": modulation,
+                            "unit": "percent",
+                        }
+                    },
+                }
+            )
+
+        return {**self.base_payload, "data": data}
+
+
+class FakeViessmann(FakeServer):
+    """
+    Serves the features of the scripted boiler at the Viessmann API's features endpoint
+    """
+
+    name = "viessmann"
+
+    def __init__(self, boiler: ScriptedBoiler, latency_seconds: float = 0) -> None:
+        super().__init__(latency_seconds)
+        self.boiler = boiler
+
+    def _routes(self, app: web.Application) -> None:
+        app.router.add_get("/features/{path:.*}", self._handle_features)
+
+    async def _handle_features(self, request: web.Request) -> web.Response:
+        return web.json_response(self.boiler.features())
+
+
+class FakeViCareOAuthManager(AbstractViCareOAuthManager):
+    """
+    OAuth manager talking to the fake Viessmann server, without any authentication
+    """
+
+    def __init__(self, base_url: str) -> None:
+        super().__init__(requests.Session())  # type: ignore[arg-type]
+        self.base_url = base_url
+
+    def renewToken(self) -> None:
+        pass
+
+    def get(self, url: str) -> Any:
+        return self.oauth_session.get(f"{self.base_url}{url}", timeout=31).json()
+
+    def post(self, url: str, data: Any) -> Any:
+        return self.oauth_session.post(f"{self.base_url}{url}", data, timeout=31).json()
+
+
+class FakeDomoticz(FakeServer):
+    """
+    Minimal Domoticz `json.htm`, keeping the daily history written to the counters
+    """
+
+    name = "domoticz"
+
+    def __init__(self, latency_seconds: float = 0, divider: float = 1000) -> None:
+        super().__init__(latency_seconds)
+        self.divider = divider
+
+        # idx -> day -> (consumption on that day, counter value), as sent by the bridge
+        self.history: dict[int, dict[str, tuple[int, int]]] = {}
+        # idx -> the last svalue sent
+        self.values: dict[int, str] = {}
+
+    def _routes(self, app: web.Application) -> None:
+        app.router.add_get("/json.htm", self._handle)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        query = request.query
+        command = query.get("param") or query.get("type")
+
+        if command in ("getdevices", "devices"):
+            idx = int(query["rid"])
+            return web.json_response(
+                {
+                    "status": "OK",
+                    "result": [
+                        {
+                            "idx": str(idx),
+                            "Name": f"Device {idx}",
+                            "SwitchTypeVal": 3,
+                            "Description": "",
+                            "AddjValue": 0,
+                            "AddjValue2": 0,
+                        }
+                    ],
+                }
+            )
+
+        if command == "setused":
+            return web.json_response({"status": "OK", "title": "SetUsed"})
+
+        if command == "udevice":
+            self._update(int(query["idx"]), query["svalue"])
+            return web.json_response({"status": "OK", "title": "Update Device"})
+
+        if command == "graph":
+            return web.json_response(self._graph(int(query["idx"])))
+
+        return web.json_response(
+            {"status": "ERR", "message": f"Unknown command {command}"}
+        )
+
+    def _update(self, idx: int, svalue: str) -> None:
+        self.values[idx] = svalue
+
+        parts = svalue.split(";")
+        # counter;usage;YYYY-MM-DD is a daily history entry
+        if len(parts) == 3 and len(parts[2]) == 10:
+            self.history.setdefault(idx, {})[parts[2]] = (int(parts[1]), int(parts[0]))
+
+    def _graph(self, idx: int) -> dict:
+        return {
+            "status": "OK",
+            "result": [
+                {
+                    "d": day,
+                    "v": f"{usage / self.divider:.3f}",
+                    "c": f"{counter / self.divider:.3f}",
+                }
+                for day, (usage, counter) in sorted(self.history.get(idx, {}).items())
+            ],
+        }
+
+
+class FakeHomeAssistant(FakeServer):
+    """
+    Minimal Home Assistant REST API, keeping the states set by the bridge
+    """
+
+    name = "home_assistant"
+
+    def __init__(self, latency_seconds: float = 0) -> None:
+        super().__init__(latency_seconds)
+        self.states: dict[str, str] = {}
+        # Statistic id -> start of the bucket -> the imported bucket
+        self.statistics: dict[str, dict[str, dict]] = {}
+
+    def _routes(self, app: web.Application) -> None:
+        app.router.add_get("/api/states", self._handle_get_states)
+        app.router.add_get("/api/websocket", self._handle_websocket)
+        app.router.add_post("/api/states/{entity_id}", self._handle_set_state)
+
+    async def _handle_get_states(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            [
+                {"entity_id": entity_id, "state": state}
+                for entity_id, state in self.states.items()
+            ]
+        )
+
+    async def _handle_websocket(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        await ws.send_json({"type": "auth_required", "ha_version": "benchmark"})
+        auth = await ws.receive_json()
+        if auth.get("type") != "auth" or not auth.get("access_token"):
+            await ws.send_json({"type": "auth_invalid", "message": "Invalid access"})
+            await ws.close()
+            return ws
+        await ws.send_json({"type": "auth_ok", "ha_version": "benchmark"})
+
+        async for message in ws:
+            if message.type != WSMsgType.TEXT:
+                continue
+
+            command = message.json()
+            self.stats.requests += 1
+            self.stats.bytes_received += len(message.data)
+
+            response = self._handle_command(command)
+            self.stats.bytes_sent += len(json.dumps(response))
+            await ws.send_json(response)
+
+        return ws
+
+    def _handle_command(self, command: dict) -> dict:
+        if command.get("type") == "get_states":
+            return {
+                "id": command["id"],
+                "type": "result",
+                "success": True,
+                "result": [
+                    {"entity_id": entity_id, "state": state}
+                    for entity_id, state in self.states.items()
+                ],
+            }
+
+        if command.get("type") == "recorder/import_statistics":
+            statistics = self.statistics.setdefault(
+                command["metadata"]["statistic_id"], {}
+            )
+            for bucket in command["stats"]:
+                statistics[bucket["start"]] = bucket
+
+            return {
+                "id": command["id"],
+                "type": "result",
+                "success": True,
+                "result": None,
+            }
+
+        return {
+            "id": command["id"],
+            "type": "result",
+            "success": False,
+            "error": {"code": "unknown_command", "message": "Unknown command."},
+        }
+
+    async def _handle_set_state(self, request: web.Request) -> web.Response:
+        entity_id = request.match_info["entity_id"]
+
+        # Like Home Assistant, only JSON bodies are accepted
+        try:
+            data = json.loads(await request.text())
+        except ValueError:
+            return web.json_response({"message": "Invalid JSON specified."}, status=400)
+
+        created = entity_id not in self.states
+        self.states[entity_id] = str(data.get("state"))
+
+        return web.json_response(
+            {"entity_id": entity_id, "state": self.states[entity_id]},
+            status=201 if created else 200,
+        )
+
+
+class FakeTimeSeriesDatabase(FakeServer):
+    """
+    Minimal InfluxDB-like write endpoint, keeping the points sent by the bridge (line protocol or NDJSON)
+    """
+
+    name = "timeseries"
+
+    def __init__(self, latency_seconds: float = 0) -> None:
+        super().__init__(latency_seconds)
+        self.points: list[str] = []
+        self.batches = 0
+
+    def _routes(self, app: web.Application) -> None:
+        app.router.add_post("/write", self._handle_write)
+
+    async def _handle_write(self, request: web.Request) -> web.Response:
+        body = await request.text()
+
+        self.batches += 1
+        self.points.extend(line for line in body.splitlines() if line)
+        return web.Response(status=204)
+
+
+class FakeMqttBroker(FakeServer):
+    """
+    Minimal in-process MQTT 3.1.1 broker, keeping the messages published to it.
+    The messages aren't delivered to any subscribers
+    """
+
+    name = "mqtt"
+
+    def __init__(self, latency_seconds: float = 0) -> None:
+        super().__init__(latency_seconds)
+
+        self.messages: list[tuple[str, str]] = []
+        self.retained: dict[str, str] = {}
+
+        self.host = "127.0.0.1"
+        self.port = 0
+        self._server: Optional[asyncio.Server] = None
+
+    async def start(self, port: int = 0) -> None:
+        # A stopped broker can be started again on its port, so that the clients reconnect
+        self._server = await asyncio.start_server(self._handle_client, self.host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.url = f"mqtt://{self.host}:{self.port}"
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    @staticmethod
+    async def _read_packet(reader: asyncio.StreamReader) -> tuple[int, bytes]:
+        (header,) = await reader.readexactly(1)
+
+        # The remaining length is encoded in 7 bits per byte
+        length, multiplier = 0, 1
+        while True:
+            (byte,) = await reader.readexactly(1)
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+
+        return header, await reader.readexactly(length)
+
+    async def _handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                header, body = await self._read_packet(reader)
+                packet_type = header >> 4
+
+                if packet_type == 1:  # CONNECT
+                    writer.write(bytes([0x20, 2, 0, 0]))
+                elif packet_type == 3:  # PUBLISH
+                    self._publish(header, body, writer)
+                elif packet_type == 6:  # PUBREL
+                    writer.write(bytes([0x70, 2]) + body[:2])
+                elif packet_type == 8:  # SUBSCRIBE - nothing is ever delivered
+                    writer.write(bytes([0x90, 3]) + body[:2] + bytes([0]))
+                elif packet_type == 12:  # PINGREQ
+                    writer.write(bytes([0xD0, 0]))
+                elif packet_type == 14:  # DISCONNECT
+                    break
+
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def _publish(self, header: int, body: bytes, writer: asyncio.StreamWriter) -> None:
+        qos = (header >> 1) & 0x03
+        retain = bool(header & 0x01)
+
+        topic_length = int.from_bytes(body[:2], "big")
+        topic = body[2 : 2 + topic_length].decode()
+        position = 2 + topic_length
+
+        packet_id = b""
+        if qos > 0:
+            packet_id = body[position : position + 2]
+            position += 2
+
+        payload = body[position:].decode()
+
+        self.stats.requests += 1
+        self.stats.bytes_received += len(body)
+
+        self.messages.append((topic, payload))
+        if retain:
+            self.retained[topic] = payload
+
+        if qos == 1:  # PUBACK
+            writer.write(bytes([0x40, 2]) + packet_id)
+        elif qos == 2:  # PUBREC
+            writer.write(bytes([0x50, 2]) + packet_id)
+
+
+def load_recorded_payload(path: str) -> dict:
+    """
+    Load a features response recorded from the Viessmann API
+    (e.g. the JSON returned by /features/installations/.../features)
+    """
+    with open(path, "r") as f:
+        return json.load(f)
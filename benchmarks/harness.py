@@ -0,0 +1,337 @@
+import asyncio
+import os
+import tempfile
+import time
+from datetime import date
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from PyViCare.PyViCareGazBoiler import GazBoiler
+from PyViCare.PyViCareService import ViCareDeviceAccessor, ViCareService
+from pydantic import BaseModel
+
+from benchmarks.fake_servers import (
+    FakeDomoticz,
+    FakeHomeAssistant,
+    FakeMqttBroker,
+    FakeServer,
+    FakeTimeSeriesDatabase,
+    FakeViCareOAuthManager,
+    FakeViessmann,
+    ScriptedBoiler,
+)
+from viessmann_bridge import config as bridge_config
+from viessmann_bridge import domoticz
+from viessmann_bridge.action import (
+    Action,
+    DomoticzActionConfig,
+    HomeAssistantActionConfig,
+    MqttActionConfig,
+    MqttDomoticzConfig,
+    OutboxConfig,
+    RateLimitConfig,
+    TimeSeriesActionConfig,
+)
+from viessmann_bridge.config import (
+    ActionConfigs,
+    ChangeSuppressionConfig,
+    Config,
+    DeviceConfig,
+    ViessmannCreds,
+)
+from viessmann_bridge.device import Device
+from viessmann_bridge.local_api import SNAPSHOTS
+from viessmann_bridge.plugins import create_action
+from viessmann_bridge.timeseries import TimeSeriesExport
+from viessmann_bridge.work import ViessmannBridge
+
+# Consumption of the last days in kWh, from today to the oldest day
+DEFAULT_DAILY = [12, 31, 28, 35, 40, 22, 19, 26]
+
+
+class BenchmarkOptions(BaseModel):
+    # Latency added to every response of the fake servers
+    latency_seconds: float = 0
+    # Pacing of the Domoticz requests, None keeps the bridge's default
+    domoticz_rate_per_second: Optional[float] = None
+    # How many Domoticz devices are backfilled at the same time, None keeps the bridge's default
+    domoticz_backfill_concurrency: Optional[int] = None
+    number_of_burners: int = 1
+    change_suppression: bool = True
+    # Whether the writes go through the durable outbox (stored in a temporary file)
+    outbox: bool = True
+    # Whether the values are also published to an in-process MQTT broker (with the Domoticz messages)
+    mqtt: bool = False
+    # Whether the readings are also exported in batches to an in-process time series database
+    timeseries: bool = False
+    # Features response recorded from the Viessmann API, used as the base of the served payload
+    recorded_payload: Optional[dict] = None
+
+
+class BenchmarkRun:
+    """
+    A bridge for a single device wired to the fake Viessmann, Domoticz and Home Assistant servers.
+
+    The scenarios drive the bridge's handlers directly, the same way its scheduler does,
+    and the traffic of the fake servers is measured from `start_measuring` on.
+    """
+
+    def __init__(self, options: BenchmarkOptions) -> None:
+        self.options = options
+
+        self.boiler = ScriptedBoiler(
+            date.today(),
+            DEFAULT_DAILY,
+            options.number_of_burners,
+            options.recorded_payload,
+        )
+        self.viessmann = FakeViessmann(self.boiler, options.latency_seconds)
+        self.domoticz = FakeDomoticz(options.latency_seconds)
+        self.home_assistant = FakeHomeAssistant(options.latency_seconds)
+        self.mqtt = FakeMqttBroker(options.latency_seconds)
+        self.timeseries = FakeTimeSeriesDatabase(options.latency_seconds)
+        self.servers: list[FakeServer] = [
+            self.viessmann,
+            self.domoticz,
+            self.home_assistant,
+        ]
+        if options.mqtt:
+            self.servers.append(self.mqtt)
+        if options.timeseries:
+            self.servers.append(self.timeseries)
+
+        self.actions: list[Action] = []
+        self._state_dir = tempfile.TemporaryDirectory(prefix="viessmann-bridge-bench-")
+        self.polls = 0
+        self.init_seconds = 0.0
+
+        self._bridge: Optional[ViessmannBridge] = None
+        self._device: Optional[Device] = None
+        self._measuring_since = time.monotonic()
+
+    @property
+    def bridge(self) -> ViessmannBridge:
+        assert self._bridge is not None, "The run has not been started"
+        return self._bridge
+
+    def _device_config(self) -> DeviceConfig:
+        rate_limit = RateLimitConfig()
+        backfill_rate_limit = DomoticzActionConfig.model_fields[
+            "backfill_rate_limit"
+        ].default
+        if self.options.domoticz_rate_per_second is not None:
+            rate_limit = backfill_rate_limit = RateLimitConfig(
+                rate_per_second=self.options.domoticz_rate_per_second,
+                burst=max(1, int(self.options.domoticz_rate_per_second)),
+            )
+
+        backfill_concurrency = DomoticzActionConfig.model_fields[
+            "backfill_concurrency"
+        ].default
+        if self.options.domoticz_backfill_concurrency is not None:
+            backfill_concurrency = self.options.domoticz_backfill_concurrency
+
+        outbox = OutboxConfig(
+            path=os.path.join(self._state_dir.name, "outbox.db")
+            if self.options.outbox
+            else None
+        )
+
+        burners = range(self.options.number_of_burners)
+
+        actions: ActionConfigs = [
+            DomoticzActionConfig(
+                action_type="domoticz",
+                domoticz_url=self.domoticz.url,
+                rate_limit=rate_limit,
+                backfill_rate_limit=backfill_rate_limit,
+                backfill_concurrency=backfill_concurrency,
+                outbox=outbox,
+                gas_consumption_kwh_idx=2,
+                gas_consumption_m3_idx=3,
+                boiler_temperature_idx=4,
+                burner_modulation_idxs=[10 + i for i in burners],
+                gas_consumption_kwh_increasing_idx=6,
+                gas_consumption_m3_increasing_idx=7,
+            ),
+            HomeAssistantActionConfig(
+                action_type="home_assistant",
+                home_assistant_url=self.home_assistant.url,
+                token="benchmark",
+                outbox=outbox,
+                use_websocket=True,
+                gas_usage_entity_id="sensor.gas_usage_kwh",
+                burner_modulation_entities_ids=[
+                    f"sensor.modulation_burner_{i}" for i in burners
+                ],
+                boiler_temperature_entity_id="sensor.boiler_temperature",
+                statistic_id="viessmann_bridge:gas_consumption",
+            ),
+        ]
+
+        if self.options.mqtt:
+            actions.append(
+                MqttActionConfig(
+                    action_type="mqtt",
+                    host=self.mqtt.host,
+                    port=self.mqtt.port,
+                    domoticz=MqttDomoticzConfig(
+                        gas_consumption_kwh_idx=2,
+                        gas_consumption_m3_idx=3,
+                        boiler_temperature_idx=4,
+                        burner_modulation_idxs=[10 + i for i in burners],
+                        gas_consumption_kwh_increasing_idx=6,
+                        gas_consumption_m3_increasing_idx=7,
+                    ),
+                )
+            )
+
+        if self.options.timeseries:
+            actions.append(
+                TimeSeriesActionConfig(
+                    action_type="timeseries",
+                    url=f"{self.timeseries.url}/write",
+                    outbox=outbox,
+                )
+            )
+
+        return DeviceConfig(
+            name="benchmark",
+            number_of_burners=self.options.number_of_burners,
+            actions=actions,
+        )
+
+    def _create_device(self) -> Device:
+        oauth_manager = FakeViCareOAuthManager(self.viessmann.url)
+        service = ViCareService(
+            oauth_manager, ViCareDeviceAccessor(1, "benchmark", "0"), ["type:boiler"]
+        )
+        return Device(GazBoiler(service))
+
+    async def start(self) -> None:
+        for server in self.servers:
+            await server.start()
+
+        device_config = self._device_config()
+        bridge_config.GlobalConfig = Config(
+            # UTC, so that the days of the payloads are the same as the days seen by the bridge
+            timezone=ZoneInfo("UTC"),
+            viessmann_creds=ViessmannCreds(username="", password="", client_id=""),
+            state_file=None,
+            change_suppression=ChangeSuppressionConfig(
+                enabled=self.options.change_suppression
+            ),
+            devices=[device_config],
+        )
+
+        started_at = time.monotonic()
+        for action_config in device_config.actions:
+            action = create_action(action_config)
+            self.actions.append(action)
+
+        # The same way as the bridge does it - all the actions at once
+        await asyncio.gather(*[action.init() for action in self.actions])
+        self.init_seconds = time.monotonic() - started_at
+
+        self._device = self._create_device()
+        await self.restart()
+
+    async def restart(self) -> None:
+        """
+        Replace the bridge with a new one, as if the process was restarted without any saved state.
+        The actions and the data already stored by the fake servers are kept
+        """
+        assert self._device is not None
+
+        if self._bridge is not None:
+            await self._bridge.dispatcher.stop()
+
+        self._device.invalidate_snapshot()
+        self._bridge = ViessmannBridge(
+            self._device, bridge_config.get_config().get_devices()[0], self.actions
+        )
+        self._bridge.dispatcher.start()
+
+    def restore_state(self) -> None:
+        """
+        Put the bridge in the state it would restore from the journal after being synced with the boiler
+        """
+        ctx = self.bridge.consumption_context
+        ctx.total_consumption = self.boiler.year_total
+        ctx.previous_total_consumption = self.boiler.year_total
+        ctx.history.restore(self.boiler.today, list(self.boiler.daily))
+
+    async def stop(self) -> None:
+        if self._bridge is not None:
+            await self._bridge.dispatcher.stop()
+
+        for action in self.actions:
+            await action.close()
+
+        for server in self.servers:
+            await server.stop()
+
+        # The servers listen on random ports, which can be reused by the next run
+        domoticz._rate_limiters.pop(self.domoticz.url, None)
+        domoticz._backfill_rate_limiters.pop(self.domoticz.url, None)
+        bridge_config.GlobalConfig = None
+        SNAPSHOTS.clear()
+
+        self._state_dir.cleanup()
+
+    def start_measuring(self) -> None:
+        for server in self.servers:
+            server.stats.reset()
+
+        self.polls = 0
+        self._measuring_since = time.monotonic()
+
+    async def poll(
+        self, gas_usage: bool = True, burners: bool = True, boiler: bool = True
+    ) -> None:
+        """
+        Run a single poll cycle with fresh data from the boiler
+        """
+        assert self._device is not None
+
+        # The cycles are back to back, but each of them stands for a new poll interval
+        self._device.invalidate_snapshot()
+
+        if gas_usage:
+            await self.bridge.handle_gas_usage()
+        if burners:
+            await self.bridge.handle_burners()
+        if boiler:
+            await self.bridge.handle_boiler_temperature()
+        self.bridge.end_cycle()
+
+        self.polls += 1
+
+    async def settle(self) -> None:
+        """
+        Wait until the actions handle everything queued so far
+        """
+        await self.bridge.dispatcher.join()
+
+        # The exported points are only sent every flush interval otherwise
+        for action in self.actions:
+            if isinstance(action, TimeSeriesExport):
+                await action.flush()
+
+    def result(self) -> dict:
+        servers = {server.name: server.stats.as_dict() for server in self.servers}
+
+        return {
+            "wall_seconds": round(time.monotonic() - self._measuring_since, 6),
+            "action_init_seconds": round(self.init_seconds, 6),
+            # From the last (re)start of the bridge until an action handled the first value
+            "time_to_first_publish_seconds": round(self.bridge.time_to_first_publish, 6)
+            if self.bridge.time_to_first_publish is not None
+            else None,
+            "polls": self.polls,
+            "servers": servers,
+            "total": {
+                key: sum(stats[key] for stats in servers.values())
+                for key in ("requests", "bytes_received", "bytes_sent")
+            },
+        }
@@ -0,0 +1,173 @@
+"""
+Benchmark of the bridge against in-process stand-ins of Viessmann, Domoticz and Home Assistant.
+
+Usage:
+    python -m benchmarks.run [--scenario NAME ...] [--output results.json] [--baseline previous.json]
+
+The results (wall time, requests and bytes per server for every scenario) are written as JSON,
+so that they can be compared between runs.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import sys
+from datetime import datetime, timezone
+from typing import Optional
+
+from benchmarks.fake_servers import load_recorded_payload
+from benchmarks.harness import BenchmarkOptions, BenchmarkRun
+from benchmarks.scenarios import SCENARIOS
+from viessmann_bridge.logger import logger
+
+RESULTS_VERSION = 1
+
+
+async def run_scenario(name: str, options: BenchmarkOptions) -> dict:
+    run = BenchmarkRun(options)
+    await run.start()
+
+    try:
+        await SCENARIOS[name](run)
+        return run.result()
+    finally:
+        await run.stop()
+
+
+async def run_benchmarks(names: list[str], options: BenchmarkOptions) -> dict:
+    results: dict[str, dict] = {}
+
+    for name in names:
+        print(f"Running {name}...", file=sys.stderr)
+        results[name] = await run_scenario(name, options)
+        print(
+            f"  {results[name]['wall_seconds']:.3f}s, {results[name]['total']['requests']} requests",
+            file=sys.stderr,
+        )
+
+    return {
+        "version": RESULTS_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": options.model_dump(exclude={"recorded_payload"}),
+        "scenarios": results,
+    }
+
+
+def compare(results: dict, baseline: dict) -> None:
+    """
+    Print how the results differ from the baseline
+    """
+    print(
+        f"{'scenario':<22} {'wall time':>22} {'requests':>14} {'bytes to servers':>20}",
+        file=sys.stderr,
+    )
+
+    for name, result in results["scenarios"].items():
+        previous: Optional[dict] = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            print(f"{name:<22} (not in the baseline)", file=sys.stderr)
+            continue
+
+        wall, previous_wall = result["wall_seconds"], previous["wall_seconds"]
+        change = (wall - previous_wall) / previous_wall * 100 if previous_wall else 0
+
+        print(
+            f"{name:<22} {previous_wall:>8.3f}s -> {wall:>7.3f}s {change:>+5.0f}%"
+            f" {previous['total']['requests']:>5} -> {result['total']['requests']:>5}"
+            f" {previous['total']['bytes_received']:>8} -> {result['total']['bytes_received']:>8}",
+            file=sys.stderr,
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=list(SCENARIOS),
+        help="Scenario to run (can be repeated), all of them by default",
+    )
+    parser.add_argument(
+        "--output", help="Write the results to the file instead of stdout"
+    )
+    parser.add_argument("--baseline", help="Results of a previous run to compare with")
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=0,
+        help="Latency added to every response of the fake servers",
+    )
+    parser.add_argument(
+        "--rate-per-second",
+        type=float,
+        help="Pacing of the Domoticz requests (the bridge's default if not given)",
+    )
+    parser.add_argument(
+        "--backfill-concurrency",
+        type=int,
+        help="How many Domoticz devices are backfilled at the same time (the bridge's default if not given)",
+    )
+    parser.add_argument("--burners", type=int, default=1, help="Number of burners")
+    parser.add_argument(
+        "--no-change-suppression",
+        action="store_true",
+        help="Send every value, even if it didn't change",
+    )
+    parser.add_argument(
+        "--no-outbox",
+        action="store_true",
+        help="Send the writes directly instead of through the durable outbox",
+    )
+    parser.add_argument(
+        "--mqtt",
+        action="store_true",
+        help="Also publish the values to an in-process MQTT broker",
+    )
+    parser.add_argument(
+        "--timeseries",
+        action="store_true",
+        help="Also export the readings in batches to an in-process time series database",
+    )
+    parser.add_argument(
+        "--payload",
+        help="Features response recorded from the Viessmann API, served along with the scripted values",
+    )
+    parser.add_argument(
+        "--log-level", default="CRITICAL", help="Log level of the bridge"
+    )
+    args = parser.parse_args()
+
+    logger.setLevel(getattr(logging, args.log_level.upper()))
+
+    options = BenchmarkOptions(
+        latency_seconds=args.latency_ms / 1000,
+        domoticz_rate_per_second=args.rate_per_second,
+        domoticz_backfill_concurrency=args.backfill_concurrency,
+        number_of_burners=args.burners,
+        change_suppression=not args.no_change_suppression,
+        outbox=not args.no_outbox,
+        mqtt=args.mqtt,
+        timeseries=args.timeseries,
+        recorded_payload=load_recorded_payload(args.payload) if args.payload else None,
+    )
+
+    results = asyncio.run(run_benchmarks(args.scenario or list(SCENARIOS), options))
+
+    serialized = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(serialized + "\n")
+    else:
+        print(serialized)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
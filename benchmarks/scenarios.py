@@ -0,0 +1,74 @@
+from datetime import timedelta
+from typing import Awaitable, Callable
+
+from benchmarks.harness import BenchmarkRun
+
+Scenario = Callable[[BenchmarkRun], Awaitable[None]]
+
+
+async def first_run_backfill(run: BenchmarkRun) -> None:
+    """
+    The first start of the bridge: the whole daily history is written to the actions
+    """
+    run.start_measuring()
+
+    await run.poll()
+    await run.settle()
+
+
+async def restart_reconciled(run: BenchmarkRun) -> None:
+    """
+    A restart without any saved state, while the actions already hold the history
+    """
+    await run.poll()
+    await run.settle()
+    await run.restart()
+
+    run.start_measuring()
+
+    await run.poll()
+    await run.settle()
+
+
+async def steady_cycles(run: BenchmarkRun, cycles: int = 12) -> None:
+    """
+    Regular polls within a single day, with the consumption and the burner's modulation changing
+    """
+    run.restore_state()
+    run.start_measuring()
+
+    for i in range(cycles):
+        run.boiler.consume(i % 3)
+        run.boiler.modulations = [20 + (i * 7) % 60 for _ in run.boiler.modulations]
+        # Changes within the deadband every other cycle
+        run.boiler.boiler_temperature = 45.0 + (i // 2) * 0.6
+
+        await run.poll()
+
+    await run.settle()
+
+
+async def midnight_rollover(run: BenchmarkRun) -> None:
+    """
+    A new day appearing in the data, after the previous day was still updated in the meantime
+    """
+    # Start from yesterday, so that the rolled over day is today
+    run.boiler.today -= timedelta(days=1)
+    run.restore_state()
+
+    run.boiler.consume(3)
+    run.boiler.new_day()
+    run.boiler.consume(1)
+
+    run.start_measuring()
+
+    await run.poll(burners=False, boiler=False)
+    await run.settle()
+
+
+SCENARIOS: dict[str, Scenario] = {
+    "first_run_backfill": first_run_backfill,
+    "restart_reconciled": restart_reconciled,
+    "steady_cycles": steady_cycles,
+    "midnight_rollover": midnight_rollover,
+}
@@ -1,19 +1,72 @@
 import asyncio
+import time
 
-from viessmann_bridge.config import load_config
-from viessmann_bridge.logger import logger
-from viessmann_bridge.vicare_api import init_vicare_device
+from viessmann_bridge.api_budget import ApiBudget
+from viessmann_bridge.config import (
+    close_actions,
+    get_device_actions,
+    init_actions,
+    load_config,
+)
+from viessmann_bridge.device import Device
+from viessmann_bridge.local_api import start_local_api
+from viessmann_bridge.logger import logger, stop_logging
+from viessmann_bridge.metrics import start_metrics_server
+from viessmann_bridge.vicare_api import init_vicare_devices, init_vicare_oauth
 from viessmann_bridge.work import ViessmannBridge
 
 
+async def run() -> None:
+    started_at = time.monotonic()
+
+    # Everything runs inside a single event loop, so that the actions' HTTP
+    # sessions created during the init can be reused by the main loop
+    config = await load_config()
+    metrics_runner = await start_metrics_server(config.metrics)
+    local_api_runner = await start_local_api(config.local_api)
+
+    try:
+        budget = ApiBudget(config.api_budget)
+
+        def init_vicare() -> dict[str, Device]:
+            oauth_manager = init_vicare_oauth(config, budget)
+            return init_vicare_devices(oauth_manager, config)
+
+        # The Viessmann login (blocking, so in a thread) and the actions' init run at the same time
+        devices, _ = await asyncio.gather(
+            asyncio.to_thread(init_vicare), init_actions()
+        )
+        logger.info(f"Started in {time.monotonic() - started_at:.2f}s")
+
+        bridges = [
+            ViessmannBridge(
+                devices[device_config.key],
+                device_config,
+                get_device_actions(device_config),
+                budget,
+                started_at,
+            )
+            for device_config in config.get_devices()
+        ]
+
+        # All the devices are polled concurrently
+        await asyncio.gather(*[bridge.main_loop() for bridge in bridges])
+    finally:
+        await close_actions()
+
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        if local_api_runner is not None:
+            await local_api_runner.cleanup()
+
+        # Write out the records still queued
+        stop_logging()
+
+
 def main():
     logger.info("Starting viessmann_bridge")
 
-    config = asyncio.run(load_config())
-    device = init_vicare_device(config)
-
-    bridge = ViessmannBridge(device)
-    asyncio.run(bridge.main_loop())
+    asyncio.run(run())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,43 @@
+import asyncio
+import inspect
+from typing import Any, Iterator
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from viessmann_bridge import config as bridge_config
+from viessmann_bridge.config import Config, ViessmannCreds
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem: pytest.Function) -> Any:
+    """
+    Run the async tests in their own event loop
+    """
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+
+    arguments = {
+        name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames
+    }
+    asyncio.run(pyfuncitem.obj(**arguments))
+    return True
+
+
+@pytest.fixture
+def config() -> Iterator[Config]:
+    """
+    Config of a single device without any actions or saved state, in UTC
+    """
+    previous = bridge_config.GlobalConfig
+    bridge_config.GlobalConfig = Config(
+        timezone=ZoneInfo("UTC"),
+        viessmann_creds=ViessmannCreds(username="", password="", client_id=""),
+        state_file=None,
+        device_cache_file=None,
+    )
+
+    try:
+        yield bridge_config.GlobalConfig
+    finally:
+        bridge_config.GlobalConfig = previous
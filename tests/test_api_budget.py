@@ -0,0 +1,136 @@
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any
+from unittest.mock import patch
+
+import pytest
+from PyViCare.PyViCareUtils import PyViCareRateLimitError
+
+from viessmann_bridge.api_budget import (
+    WINDOW_SECONDS,
+    ApiBudget,
+    ApiBudgetConfig,
+    count_api_calls,
+)
+
+
+def budget(**config: Any) -> ApiBudget:
+    return ApiBudget(ApiBudgetConfig.model_validate({"state_file": None, **config}))
+
+
+def test_calls_are_counted_in_a_sliding_window() -> None:
+    api_budget = budget(daily_limit=3)
+    now = time.time()
+
+    with patch("viessmann_bridge.api_budget.time.time", return_value=now):
+        for _ in range(3):
+            api_budget.record_call()
+        assert api_budget.remaining == 0
+        # Until the oldest call leaves the window
+        assert api_budget.blocked_for() == pytest.approx(WINDOW_SECONDS)
+
+    with patch(
+        "viessmann_bridge.api_budget.time.time", return_value=now + WINDOW_SECONDS
+    ):
+        assert api_budget.used == 0
+        assert api_budget.blocked_for() == 0
+
+
+def test_rate_limit_blocks_until_the_reset() -> None:
+    api_budget = budget()
+    api_budget.record_rate_limit(datetime.now(timezone.utc) + timedelta(minutes=10))
+
+    assert 9 * 60 < api_budget.blocked_for() <= 10 * 60
+
+
+def test_intervals_are_stretched_to_the_target_pace() -> None:
+    api_budget = budget(daily_limit=1000, target_ratio=1)
+    now = time.time()
+    api_budget._started_at = now - 60 * 60
+
+    # 2000 calls per day at the pace of the last hour
+    with patch("viessmann_bridge.api_budget.time.time", return_value=now):
+        for _ in range(round(2000 / 24)):
+            api_budget.record_call()
+
+        assert api_budget.interval_scale(1) == pytest.approx(2, rel=0.01)
+        # The pace measured with the stretched intervals is the same once it's applied
+        assert api_budget.interval_scale(2) == pytest.approx(4, rel=0.01)
+
+
+def test_intervals_are_not_stretched_before_the_pace_is_known() -> None:
+    api_budget = budget(daily_limit=10)
+    for _ in range(10):
+        api_budget.record_call()
+
+    assert api_budget.interval_scale(1) == 1
+
+
+def test_intervals_are_stretched_at_most_max_interval_scale() -> None:
+    api_budget = budget(daily_limit=10, max_interval_scale=3)
+    api_budget._started_at = time.time() - 60 * 60
+    for _ in range(100):
+        api_budget.record_call()
+
+    assert api_budget.interval_scale(1) == 3
+
+
+def test_budget_survives_the_restart(tmp_path: Path) -> None:
+    state_file = str(tmp_path / "api_budget.json")
+
+    api_budget = budget(state_file=state_file)
+    api_budget.record_call()
+    api_budget.record_rate_limit(datetime.now(timezone.utc) + timedelta(minutes=10))
+
+    restored = budget(state_file=state_file)
+    assert restored.used == 1
+    assert restored.blocked_for() > 9 * 60
+
+
+def test_unreadable_state_is_ignored(tmp_path: Path) -> None:
+    state_file = tmp_path / "api_budget.json"
+    state_file.write_text("{")
+
+    assert budget(state_file=str(state_file)).used == 0
+
+
+class FakeOAuthManager:
+    def __init__(self, reset_at: datetime) -> None:
+        self.reset_at = reset_at
+        self.limited = False
+
+    def get(self, url: str) -> Any:
+        if self.limited:
+            raise PyViCareRateLimitError(
+                {
+                    "message": "Rate limit reached",
+                    "extendedPayload": {
+                        "name": "ViCare API",
+                        "requestCountLimit": 1450,
+                        "limitReset": int(self.reset_at.timestamp() * 1000),
+                    },
+                }
+            )
+        return {"data": []}
+
+    def post(self, url: str, data: Any) -> Any:
+        return {}
+
+
+def test_api_calls_are_counted_and_the_rate_limit_blocks_the_polling() -> None:
+    api_budget = budget()
+    oauth_manager = FakeOAuthManager(datetime.now(timezone.utc) + timedelta(hours=1))
+    count_api_calls(oauth_manager, api_budget)  # type: ignore[arg-type]
+
+    oauth_manager.get("/features")
+    oauth_manager.post("/commands", {})
+    assert api_budget.used == 2
+    assert api_budget.blocked_for() == 0
+
+    oauth_manager.limited = True
+    with pytest.raises(PyViCareRateLimitError):
+        oauth_manager.get("/features")
+
+    assert api_budget.used == 3
+    assert api_budget.blocked_for() > 59 * 60
@@ -0,0 +1,42 @@
+import pytest
+
+from benchmarks.harness import BenchmarkOptions, BenchmarkRun
+from benchmarks.scenarios import SCENARIOS
+
+
+@pytest.mark.parametrize("name", SCENARIOS)
+async def test_scenario_leaves_the_sinks_in_sync(name: str) -> None:
+    run = BenchmarkRun(BenchmarkOptions(domoticz_rate_per_second=1000))
+    await run.start()
+
+    try:
+        await SCENARIOS[name](run)
+        result = run.result()
+        total_consumption = run.bridge.consumption_context.total_consumption
+    finally:
+        await run.stop()
+
+    assert result["total"]["requests"] > 0
+    assert set(result["servers"]) == {"viessmann", "domoticz", "home_assistant"}
+
+    # The kWh counter is in Wh, its last update is the entry of the current reading
+    assert run.domoticz.values[2].split(";")[0] == str(total_consumption * 1000)
+    assert run.home_assistant.states["sensor.gas_usage_kwh"] == str(total_consumption)
+
+
+async def test_history_is_written_to_the_counters() -> None:
+    run = BenchmarkRun(BenchmarkOptions(domoticz_rate_per_second=1000))
+    await run.start()
+
+    try:
+        await SCENARIOS["first_run_backfill"](run)
+    finally:
+        await run.stop()
+
+    # Every past day is in the history, with the usage in Wh
+    history = run.domoticz.history[2]
+    days = sorted(history)
+    assert len(days) == len(run.boiler.daily) - 1
+    assert [history[day][0] for day in reversed(days)] == [
+        value * 1000 for value in run.boiler.daily[1:]
+    ]
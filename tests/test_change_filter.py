@@ -0,0 +1,126 @@
+import asyncio
+from unittest.mock import patch
+
+from viessmann_bridge.action import Action
+from viessmann_bridge.change_filter import ChangeFilter
+from viessmann_bridge.dispatcher import ActionDispatcher
+
+
+def change_filter(heartbeat_seconds: float = 600) -> ChangeFilter:
+    return ChangeFilter(
+        {"boiler_temperature": 0.5, "burners_modulations": 5}, heartbeat_seconds
+    )
+
+
+def test_values_within_the_deadband_are_suppressed() -> None:
+    values = change_filter()
+
+    assert values.should_send("domoticz", "boiler_temperature", 45.0)
+    assert not values.should_send("domoticz", "boiler_temperature", 45.3)
+    assert values.should_send("domoticz", "boiler_temperature", 45.5)
+    # Compared with the last submitted value, not the first one
+    assert not values.should_send("domoticz", "boiler_temperature", 45.1)
+    assert values.suppressed == 2
+
+    # Every action has its own last value
+    assert values.should_send("home_assistant", "boiler_temperature", 45.1)
+
+
+def test_lists_differ_if_any_of_their_values_does() -> None:
+    values = change_filter()
+
+    assert values.should_send("domoticz", "burners_modulations", [20, 30])
+    assert not values.should_send("domoticz", "burners_modulations", [22, 33])
+    assert values.should_send("domoticz", "burners_modulations", [20, 40])
+    assert values.should_send("domoticz", "burners_modulations", [20, 40, 0])
+
+
+def test_kinds_without_deadband_are_always_sent() -> None:
+    values = change_filter()
+
+    assert values.should_send("domoticz", "current_total_consumption", 1000)
+    assert values.should_send("domoticz", "current_total_consumption", 1000)
+
+
+def test_value_is_sent_again_after_the_heartbeat() -> None:
+    values = change_filter(heartbeat_seconds=60)
+
+    with patch("viessmann_bridge.change_filter.monotonic", return_value=1000):
+        assert values.should_send("domoticz", "boiler_temperature", 45.0)
+    with patch("viessmann_bridge.change_filter.monotonic", return_value=1030):
+        assert not values.should_send("domoticz", "boiler_temperature", 45.0)
+    with patch("viessmann_bridge.change_filter.monotonic", return_value=1060):
+        assert values.should_send("domoticz", "boiler_temperature", 45.0)
+
+
+def test_failed_value_is_sent_again() -> None:
+    values = change_filter()
+
+    assert values.should_send("domoticz", "boiler_temperature", 45.0)
+    values.delivered("domoticz", "boiler_temperature", 45.0, success=False)
+    assert values.should_send("domoticz", "boiler_temperature", 45.0)
+
+    values.delivered("domoticz", "boiler_temperature", 45.0, success=True)
+    assert values.sent == 1
+
+
+class BlockedAction(Action):
+    """
+    Handles the updates once it's unblocked, failing them if told so
+    """
+
+    def __init__(self) -> None:
+        self.unblocked = asyncio.Event()
+        self.fail = False
+        self.temperatures: list[float] = []
+
+    async def handle_boiler_temperature(self, temperature, timestamp=None) -> None:
+        await self.unblocked.wait()
+        if self.fail:
+            raise RuntimeError("The sink is down")
+        self.temperatures.append(temperature)
+
+
+def submit_temperature(dispatcher: ActionDispatcher, temperature: float) -> None:
+    dispatcher.submit(
+        "boiler_temperature",
+        lambda action: action.handle_boiler_temperature(temperature),
+        coalesce=True,
+        value=temperature,
+    )
+
+
+async def test_coalesced_values_are_counted_once() -> None:
+    action = BlockedAction()
+    values = change_filter()
+    dispatcher = ActionDispatcher([action], values)
+    dispatcher.start()
+
+    for temperature in (45.0, 46.0, 47.0):
+        submit_temperature(dispatcher, temperature)
+
+    action.unblocked.set()
+    await dispatcher.join()
+    await dispatcher.stop()
+
+    assert action.temperatures == [47.0]
+    assert values.sent == 1
+
+
+async def test_failed_coalesced_value_is_sent_again() -> None:
+    action = BlockedAction()
+    action.fail = True
+    values = change_filter()
+    dispatcher = ActionDispatcher([action], values)
+    dispatcher.start()
+
+    submit_temperature(dispatcher, 45.0)
+    submit_temperature(dispatcher, 46.0)
+
+    action.unblocked.set()
+    await dispatcher.join()
+    await dispatcher.stop()
+
+    # The failed value is the one which replaced the pending one
+    assert values.sent == 0
+    assert values.should_send(dispatcher.workers[0].name, "boiler_temperature", 46.0)
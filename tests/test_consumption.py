@@ -0,0 +1,107 @@
+import copy
+from datetime import date, timedelta
+from typing import Optional
+
+from viessmann_bridge.consumption import (
+    ConsumptionDiff,
+    ConsumptionHistory,
+    ConsumptionSnapshot,
+)
+
+TODAY = date(2024, 1, 10)
+# Consumption of the last days, from today to the oldest day
+DAILY = [12, 31, 28, 35, 40, 22, 19, 26]
+
+
+def history_with(day_date: date, day: list[int]) -> ConsumptionHistory:
+    history = ConsumptionHistory()
+    history.append(ConsumptionSnapshot(day_date, day))
+    return history
+
+
+def diff(day_date: date, day: list[int]) -> Optional[ConsumptionDiff]:
+    return history_with(TODAY, DAILY).diff(ConsumptionSnapshot(day_date, day))
+
+
+def test_first_snapshot_has_nothing_to_compare_with() -> None:
+    assert ConsumptionHistory().diff(ConsumptionSnapshot(TODAY, DAILY)) is None
+
+
+def test_unchanged_day() -> None:
+    result = diff(TODAY, DAILY)
+
+    assert result is not None
+    assert not result.shifted and result.consistent
+    assert result.changed_days == []
+    assert result.delta == 0
+
+
+def test_consumption_of_today() -> None:
+    result = diff(TODAY, [15, *DAILY[1:]])
+
+    assert result is not None
+    assert not result.shifted and result.consistent
+    assert result.changed_days == [0]
+    assert result.delta == 3
+
+
+def test_new_day() -> None:
+    # Yesterday grew by 3 before the midnight and 2 were consumed today
+    result = diff(TODAY + timedelta(days=1), [2, 15, *DAILY[1:-1]])
+
+    assert result is not None
+    assert result.shifted and result.consistent
+    assert result.changed_days == [0, 1]
+    assert result.previous_day_delta == 3
+    # The oldest day dropped out, it isn't counted as a decrease
+    assert result.delta == 2 + 3
+
+
+def test_changed_past_day_is_inconsistent() -> None:
+    result = diff(TODAY, [12, 31, 99, *DAILY[3:]])
+
+    assert result is not None
+    assert not result.consistent
+
+
+def test_past_days_not_matching_on_a_new_day_are_inconsistent() -> None:
+    result = diff(TODAY + timedelta(days=1), [2, 15, 99, *DAILY[2:-1]])
+
+    assert result is not None
+    assert result.shifted and not result.consistent
+
+
+def test_history_keeps_the_latest_snapshots() -> None:
+    history = ConsumptionHistory(size=3)
+    for i in range(5):
+        history.append(ConsumptionSnapshot(TODAY, [i]))
+
+    assert len(history) == 3
+    assert [snapshot.day[0] for snapshot in history] == [2, 3, 4]
+
+    # A copy doesn't change with the original
+    copied = copy.copy(history)
+    history.append(ConsumptionSnapshot(TODAY, [5]))
+    assert [snapshot.day[0] for snapshot in copied] == [2, 3, 4]
+
+
+def test_restore_starts_over_from_the_saved_values() -> None:
+    history = history_with(TODAY, DAILY)
+    history.restore(TODAY - timedelta(days=1), [1, 2])
+
+    assert len(history) == 1
+    assert history.latest is not None
+    assert history.latest.day_date == TODAY - timedelta(days=1)
+    assert history.latest.day_total == 3
+
+
+def test_missed_consumption_over_a_gap() -> None:
+    history = history_with(TODAY, DAILY)
+
+    # 3 more on the last known day, then 5 and 7 on the days after it
+    snapshot = ConsumptionSnapshot(TODAY + timedelta(days=2), [7, 5, 15, *DAILY[1:-2]])
+    assert history.missed_consumption(snapshot) == 3 + 5 + 7
+
+    # Longer than the daily values reach
+    snapshot = ConsumptionSnapshot(TODAY + timedelta(days=20), [1] * len(DAILY))
+    assert history.missed_consumption(snapshot) == len(DAILY)
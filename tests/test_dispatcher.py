@@ -0,0 +1,125 @@
+import asyncio
+from typing import Optional
+
+from viessmann_bridge.action import Action
+from viessmann_bridge.dispatcher import END_CYCLE, ActionDispatcher, ActionWorker
+
+
+class RecordingAction(Action):
+    """
+    Keeps the values it's given, taking `delay` seconds for each of them
+    """
+
+    def __init__(self, delay: float = 0, fail: bool = False) -> None:
+        self.delay = delay
+        self.fail = fail
+        self.values: list[object] = []
+        self.blocked: Optional[asyncio.Event] = None
+
+    async def write(self, value: object) -> None:
+        if self.blocked is not None:
+            await self.blocked.wait()
+        await asyncio.sleep(self.delay)
+
+        if self.fail:
+            raise RuntimeError("The sink is down")
+        self.values.append(value)
+
+
+def write(value: object):
+    async def call(action: Action) -> None:
+        assert isinstance(action, RecordingAction)
+        await action.write(value)
+
+    return call
+
+
+async def test_updates_are_handled_in_order() -> None:
+    action = RecordingAction()
+    dispatcher = ActionDispatcher([action])
+    dispatcher.start()
+
+    futures = [dispatcher.submit("value", write(i))[0] for i in range(10)]
+    assert await dispatcher.join()
+    await dispatcher.stop()
+
+    assert action.values == list(range(10))
+    assert all(future.result() for future in futures)
+
+
+async def test_slow_action_doesnt_hold_up_the_others() -> None:
+    slow, fast = RecordingAction(delay=0.5), RecordingAction()
+    dispatcher = ActionDispatcher([slow, fast])
+    dispatcher.start()
+
+    slow_future, fast_future = dispatcher.submit("value", write(1))
+    await asyncio.wait_for(fast_future, 0.2)
+    assert not slow_future.done()
+
+    # A cycle lasts until the slowest action is done
+    assert await dispatcher.join()
+    assert slow.values == fast.values == [1]
+    await dispatcher.stop()
+
+
+async def test_join_gives_up_after_the_timeout() -> None:
+    dispatcher = ActionDispatcher([RecordingAction(delay=1)])
+    dispatcher.start()
+
+    dispatcher.submit("value", write(1))
+    assert not await dispatcher.join(timeout=0.05)
+    await dispatcher.stop()
+
+
+async def test_pending_values_are_coalesced() -> None:
+    action = RecordingAction()
+    action.blocked = asyncio.Event()
+    worker = ActionWorker(action, "recording")
+    worker.start()
+
+    worker.submit("value", write(0), coalesce=False)
+    first, created = worker.submit("temperature", write(45), coalesce=True)
+    assert created
+    second, created = worker.submit("temperature", write(46), coalesce=True)
+    assert second is first and not created
+
+    action.blocked.set()
+    await worker.wait_idle()
+    await worker.stop()
+
+    assert action.values == [0, 46]
+    assert worker.coalesced == 1
+
+
+async def test_failed_update_resolves_to_false() -> None:
+    dispatcher = ActionDispatcher([RecordingAction(fail=True)])
+    dispatcher.start()
+
+    (future,) = dispatcher.submit("value", write(1))
+    assert not await future
+    await dispatcher.stop()
+
+
+async def test_only_droppable_updates_are_dropped() -> None:
+    action = RecordingAction()
+    action.blocked = asyncio.Event()
+    worker = ActionWorker(action, "recording", max_pending=3)
+    worker.start()
+
+    temperature, _ = worker.submit("temperature", write("temperature"), coalesce=True)
+    end_cycle, _ = worker.submit(END_CYCLE, write(END_CYCLE), coalesce=False)
+    increases = [
+        worker.submit("increase", write(i), coalesce=False)[0] for i in range(5)
+    ]
+
+    # The latest value and the end of the cycle made room, the increases are all kept
+    assert temperature.done() and not temperature.result()
+    assert end_cycle.done() and not end_cycle.result()
+    assert worker.dropped == 2
+
+    action.blocked.set()
+    await worker.wait_idle()
+    await worker.stop()
+
+    assert action.values == list(range(5))
+    assert all(future.result() for future in increases)
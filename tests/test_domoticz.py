@@ -0,0 +1,160 @@
+import contextlib
+import time as clock
+from datetime import date, datetime, time, timedelta
+from typing import AsyncIterator
+
+from benchmarks.fake_servers import FakeDomoticz
+from viessmann_bridge import domoticz
+from viessmann_bridge.action import DomoticzActionConfig, OutboxConfig, RateLimitConfig
+from viessmann_bridge.consumption import Consumption, ConsumptionContext
+from viessmann_bridge.domoticz import Domoticz
+
+# Consumption of the last days in kWh, from today to the oldest day
+DAILY = [12, 31, 28, 35, 40, 22, 19, 26]
+# A past day, so that the day of the readings and of the host differ
+TODAY = date(2024, 1, 10)
+
+
+@contextlib.asynccontextmanager
+async def connected(server: FakeDomoticz, **config: object) -> AsyncIterator[Domoticz]:
+    action = Domoticz(
+        DomoticzActionConfig.model_validate(
+            {
+                "action_type": "domoticz",
+                "domoticz_url": server.url,
+                "outbox": OutboxConfig(path=None),
+                "gas_consumption_kwh_idx": 2,
+                "gas_consumption_m3_idx": 3,
+                **config,
+            }
+        )
+    )
+    await action.init()
+
+    try:
+        yield action
+    finally:
+        await action.close()
+        # The server listens on a random port, which can be reused by the next test
+        domoticz._rate_limiters.pop(server.url, None)
+        domoticz._backfill_rate_limiters.pop(server.url, None)
+
+
+def daily_consumption(today: date) -> dict[date, int]:
+    return {today - timedelta(days=i): value for i, value in enumerate(DAILY)}
+
+
+def consumption_context(total_consumption: int) -> ConsumptionContext:
+    # Read just before the midnight, the host is already in another day
+    readat = datetime.combine(TODAY, time(23, 59))
+
+    ctx = ConsumptionContext()
+    ctx.total_consumption = total_consumption
+    ctx.gas_consumption = Consumption(
+        timestamp=readat,
+        day=list(DAILY),
+        week=[],
+        month=[],
+        year=[],
+        day_readat=readat,
+        week_readat=readat,
+        month_readat=readat,
+        year_readat=readat,
+    )
+    return ctx
+
+
+async def test_backfill_writes_the_history_of_every_device() -> None:
+    today = TODAY
+
+    server = FakeDomoticz()
+    async with server:
+        async with connected(server, reconcile_history=False) as action:
+            await action.update_daily_consumption_stats(
+                consumption_context(1000), daily_consumption(today)
+            )
+
+        # In Wh, without today
+        history = server.history[2]
+        assert [history[day][0] for day in sorted(history, reverse=True)] == [
+            value * 1000 for value in DAILY[1:]
+        ]
+        assert history[str(today - timedelta(days=1))][1] == (1000 - DAILY[0]) * 1000
+        assert len(server.history[3]) == len(DAILY) - 1
+
+        # The writes of each device are sent in order, ending with the latest day
+        for idx in (2, 3):
+            assert server.values[idx].endswith(f"{today:%Y-%m-%d} 00:05:00")
+
+
+async def test_backfill_has_its_own_rate() -> None:
+    server = FakeDomoticz()
+    async with server:
+        async with connected(
+            server,
+            reconcile_history=False,
+            rate_limit=RateLimitConfig(rate_per_second=1, burst=1),
+            backfill_rate_limit=RateLimitConfig(rate_per_second=1000, burst=100),
+        ) as action:
+            started_at = clock.monotonic()
+            await action.update_daily_consumption_stats(
+                consumption_context(1000), daily_consumption(TODAY)
+            )
+
+            # 56 requests, which would take about a minute at the regular rate
+            assert clock.monotonic() - started_at < 5
+            assert server.stats.requests >= 56
+
+
+async def test_reconciled_backfill_skips_the_stored_days() -> None:
+    today = TODAY
+    consumption = daily_consumption(today)
+
+    server = FakeDomoticz()
+    async with server:
+        async with connected(server) as action:
+            await action.update_daily_consumption_stats(
+                consumption_context(1000), consumption
+            )
+            written = server.stats.requests
+
+            # Only the history of both devices is read
+            await action.update_daily_consumption_stats(
+                consumption_context(1000), consumption
+            )
+            assert server.stats.requests == written + 2
+
+            # A corrected day is written again (with its points around the midnight),
+            # along with the counters of the older days which shifted because of it
+            consumption[today - timedelta(days=2)] += 1
+            before = server.stats.requests
+            await action.update_daily_consumption_stats(
+                consumption_context(1000), consumption
+            )
+
+    stored = server.history[2][str(today - timedelta(days=2))]
+    assert stored == ((DAILY[2] + 1) * 1000, (1000 - DAILY[0] - DAILY[1]) * 1000)
+    assert server.stats.requests - before == 2 + 2 * 4 * (len(DAILY) - 2)
+
+
+async def test_day_changed_in_domoticz_is_rewritten() -> None:
+    today = TODAY
+    changed_day = str(today - timedelta(days=3))
+
+    server = FakeDomoticz()
+    async with server:
+        async with connected(server) as action:
+            await action.update_daily_consumption_stats(
+                consumption_context(1000), daily_consumption(today)
+            )
+            stored = server.history[2][changed_day]
+            server.history[2][changed_day] = (0, stored[1])
+
+            before = server.stats.requests
+            await action.update_daily_consumption_stats(
+                consumption_context(1000), daily_consumption(today)
+            )
+
+    # Read both histories, then the day and its points around the midnight of one device
+    assert server.stats.requests - before == 2 + 4
+    assert server.history[2][changed_day] == stored
@@ -0,0 +1,226 @@
+import asyncio
+import contextlib
+from datetime import date, datetime, time, timedelta
+from typing import Any, AsyncIterator, Awaitable, Callable
+from zoneinfo import ZoneInfo
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from benchmarks.fake_servers import FakeHomeAssistant
+from viessmann_bridge.action import HomeAssistantActionConfig, OutboxConfig
+from viessmann_bridge.consumption import Consumption, ConsumptionContext
+from viessmann_bridge.home_assistant import HomeAssistant
+from viessmann_bridge.home_assistant_ws import HomeAssistantWebSocket
+
+# Consumption of the last days in kWh, from today to the oldest day
+DAILY = [12, 31, 28, 35]
+# A past day, so that the day of the readings and of the host differ
+TODAY = date(2024, 1, 10)
+STATISTIC_ID = "viessmann_bridge:gas_consumption"
+
+
+def home_assistant(url: str = "http://localhost", **config: Any) -> HomeAssistant:
+    return HomeAssistant(
+        HomeAssistantActionConfig.model_validate(
+            {
+                "action_type": "home_assistant",
+                "home_assistant_url": url,
+                "token": "token",
+                "outbox": OutboxConfig(path=None),
+                "use_websocket": True,
+                "statistic_id": STATISTIC_ID,
+                "timezone": ZoneInfo("Europe/Warsaw"),
+                "gas_usage_entity_id": "sensor.gas_usage_kwh",
+                "boiler_temperature_entity_id": None,
+                **config,
+            }
+        )
+    )
+
+
+def daily_consumption(today: date) -> dict[date, int]:
+    return {today - timedelta(days=i): value for i, value in enumerate(DAILY)}
+
+
+def consumption_context(total_consumption: int) -> ConsumptionContext:
+    # Read just before the midnight, the host is already in another day
+    readat = datetime.combine(TODAY, time(23, 59))
+
+    ctx = ConsumptionContext()
+    ctx.total_consumption = total_consumption
+    ctx.gas_consumption = Consumption(
+        timestamp=readat,
+        day=list(DAILY),
+        week=[],
+        month=[],
+        year=[],
+        day_readat=readat,
+        week_readat=readat,
+        month_readat=readat,
+        year_readat=readat,
+    )
+    return ctx
+
+
+def test_statistics_buckets_end_with_the_counter() -> None:
+    today = TODAY
+    action = home_assistant()
+
+    buckets = action._statistics_buckets(
+        consumption_context(1000), daily_consumption(today)
+    )
+
+    def start(days_ago: int) -> datetime:
+        return datetime.combine(
+            today - timedelta(days=days_ago), time(), ZoneInfo("Europe/Warsaw")
+        )
+
+    # Without today, the counter at the end of a day is the current one minus what came after
+    assert buckets == {
+        start(1): (31, 1000 - 12),
+        start(2): (28, 1000 - 12 - 31),
+        start(3): (35, 1000 - 12 - 31 - 28),
+    }
+
+
+async def test_only_the_changed_buckets_are_imported_again() -> None:
+    today = TODAY
+    consumption = daily_consumption(today)
+
+    server = FakeHomeAssistant()
+    async with server:
+        action = home_assistant(server.url)
+        await action.init()
+
+        try:
+            await action.update_daily_consumption_stats(
+                consumption_context(1000), consumption
+            )
+            assert len(server.statistics[STATISTIC_ID]) == len(DAILY) - 1
+
+            requests = server.stats.requests
+            await action.update_daily_consumption_stats(
+                consumption_context(1000), consumption
+            )
+            assert server.stats.requests == requests
+
+            consumption[today - timedelta(days=1)] += 1
+            await action.update_daily_consumption_stats(
+                consumption_context(1000), consumption
+            )
+        finally:
+            await action.close()
+
+    # The day and the counters before it
+    yesterday = datetime.combine(
+        today - timedelta(days=1), time(), ZoneInfo("Europe/Warsaw")
+    )
+    assert server.statistics[STATISTIC_ID][yesterday.isoformat()] == {
+        "start": yesterday.isoformat(),
+        "state": 32,
+        "sum": 1000 - 12,
+    }
+    assert server.stats.requests == requests + 1
+
+
+WebSocketHandler = Callable[[web.WebSocketResponse], Awaitable[None]]
+
+
+@contextlib.asynccontextmanager
+async def websocket_server(handle: WebSocketHandler) -> AsyncIterator[str]:
+    """
+    Home Assistant WebSocket API accepting any token, the commands are then passed to the handler
+    """
+
+    async def websocket(request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        await ws.send_json({"type": "auth_required"})
+        await ws.receive_json()
+        await ws.send_json({"type": "auth_ok", "ha_version": "test"})
+
+        await handle(ws)
+        return ws
+
+    app = web.Application()
+    app.router.add_get("/api/websocket", websocket)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+
+    port = runner.addresses[0][1]
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        await runner.cleanup()
+
+
+@contextlib.asynccontextmanager
+async def connected(
+    url: str, **options: float
+) -> AsyncIterator[HomeAssistantWebSocket]:
+    async with aiohttp.ClientSession() as session:
+        ws = HomeAssistantWebSocket(
+            url, "token", lambda: session, reconnect_delay_seconds=0, **options
+        )
+        try:
+            yield ws
+        finally:
+            await ws.close()
+
+
+async def test_malformed_message_doesnt_stop_the_results() -> None:
+    async def handle(ws: web.WebSocketResponse) -> None:
+        async for message in ws:
+            await ws.send_str("{not json")
+            await ws.send_json(
+                {"id": message.json()["id"], "success": True, "result": "ok"}
+            )
+
+    async with websocket_server(handle) as url, connected(url) as ws:
+        assert await ws.command({"type": "ping"}) == "ok"
+        assert await ws.command({"type": "ping"}) == "ok"
+
+
+async def test_commands_time_out() -> None:
+    async def handle(ws: web.WebSocketResponse) -> None:
+        async for _ in ws:
+            pass
+
+    async with websocket_server(handle) as url:
+        async with connected(url, command_timeout_seconds=0.1) as ws:
+            with pytest.raises(asyncio.TimeoutError):
+                await ws.commands([{"type": "ping"}, {"type": "ping"}])
+
+            assert ws._pending == {}
+
+
+async def test_closed_connection_is_reopened_by_the_next_command() -> None:
+    connections = 0
+
+    async def handle(ws: web.WebSocketResponse) -> None:
+        nonlocal connections
+        connections += 1
+
+        async for message in ws:
+            await ws.send_json(
+                {"id": message.json()["id"], "success": True, "result": connections}
+            )
+            # Home Assistant restarting
+            await ws.close()
+
+    async with websocket_server(handle) as url, connected(url) as ws:
+        assert await ws.command({"type": "ping"}) == 1
+
+        # The reader noticed the closed connection
+        for _ in range(100):
+            if not ws.connected:
+                break
+            await asyncio.sleep(0.01)
+        assert ws._ws is None
+
+        assert await ws.command({"type": "ping"}) == 2
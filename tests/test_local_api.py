@@ -0,0 +1,113 @@
+import asyncio
+import contextlib
+import json
+from typing import AsyncIterator
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from viessmann_bridge.local_api import SNAPSHOTS, LocalApiConfig, create_app
+
+
+@contextlib.asynccontextmanager
+async def client(
+    config: LocalApiConfig = LocalApiConfig(sse_keepalive_seconds=0.1),
+) -> AsyncIterator[TestClient]:
+    SNAPSHOTS.update("boiler", total_consumption=1000)
+
+    async with TestClient(TestServer(create_app(config))) as test_client:
+        try:
+            yield test_client
+        finally:
+            SNAPSHOTS.clear()
+
+
+async def test_devices_are_listed() -> None:
+    async with client() as api:
+        response = await api.get("/api/devices")
+        assert await response.json() == {"devices": ["boiler"]}
+
+        response = await api.get("/api/devices/heat_pump")
+        assert response.status == 404
+        assert (await response.json())["devices"] == ["boiler"]
+
+
+async def test_unchanged_snapshot_isnt_sent_again() -> None:
+    async with client() as api:
+        response = await api.get("/api/devices/boiler")
+        assert await response.json() == {"device": "boiler", "total_consumption": 1000}
+        etag = response.headers["ETag"]
+        last_modified = response.headers["Last-Modified"]
+
+        response = await api.get("/api/devices/boiler", headers={"If-None-Match": etag})
+        assert response.status == 304
+        response = await api.get(
+            "/api/devices/boiler", headers={"If-Modified-Since": last_modified}
+        )
+        assert response.status == 304
+
+        # The same values don't change the ETag
+        SNAPSHOTS.update("boiler", total_consumption=1000)
+        response = await api.get("/api/devices/boiler", headers={"If-None-Match": etag})
+        assert response.status == 304
+
+        SNAPSHOTS.update("boiler", total_consumption=1001)
+        response = await api.get("/api/devices/boiler", headers={"If-None-Match": etag})
+        assert response.status == 200
+        assert response.headers["ETag"] != etag
+
+
+async def test_long_poll_returns_the_next_snapshot() -> None:
+    async with client() as api:
+        etag = (await api.get("/api/devices/boiler")).headers["ETag"]
+
+        async def update_later() -> None:
+            await asyncio.sleep(0.1)
+            SNAPSHOTS.update("boiler", total_consumption=1001)
+
+        update = asyncio.create_task(update_later())
+        response = await api.get(
+            "/api/devices/boiler?wait=5", headers={"If-None-Match": etag}
+        )
+        await update
+
+        assert response.status == 200
+        assert (await response.json())["total_consumption"] == 1001
+
+
+async def test_long_poll_gives_up_after_the_wait() -> None:
+    async with client() as api:
+        etag = (await api.get("/api/devices/boiler")).headers["ETag"]
+
+        response = await api.get(
+            "/api/devices/boiler?wait=0.1", headers={"If-None-Match": etag}
+        )
+        assert response.status == 304
+
+        response = await api.get(
+            "/api/devices/boiler?wait=soon", headers={"If-None-Match": etag}
+        )
+        assert response.status == 400
+
+
+async def test_events_stream_the_snapshots() -> None:
+    async with client() as api:
+        response = await api.get("/api/devices/boiler/events")
+        assert response.headers["Content-Type"] == "text/event-stream"
+
+        async def next_event() -> str:
+            lines = []
+            while (line := (await response.content.readline()).decode()) != "\n":
+                lines.append(line)
+            return "".join(lines)
+
+        first = await next_event()
+        assert first.startswith("event: snapshot\n")
+
+        # Nothing changed within the keepalive
+        assert await next_event() == ": keepalive\n"
+
+        SNAPSHOTS.update("boiler", total_consumption=1001)
+        data = (await next_event()).splitlines()[-1].removeprefix("data: ")
+        assert json.loads(data)["total_consumption"] == 1001
+
+        response.close()
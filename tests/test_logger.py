@@ -0,0 +1,123 @@
+import io
+import json
+import logging
+from typing import Iterator
+
+import pytest
+
+from viessmann_bridge.logger import (
+    DebugRateLimitFilter,
+    LoggingConfig,
+    configure_logging,
+    console_handler,
+    logger,
+    stop_logging,
+)
+
+
+@pytest.fixture
+def output() -> Iterator[io.StringIO]:
+    stream = io.StringIO()
+    previous = console_handler.stream
+    console_handler.setStream(stream)
+
+    try:
+        yield stream
+    finally:
+        configure_logging(LoggingConfig())
+        stop_logging()
+        console_handler.setStream(previous)
+
+
+def debug_record(msg: str, lineno: int = 1) -> logging.LogRecord:
+    return logging.LogRecord(
+        "viessmann_bridge", logging.DEBUG, "bridge.py", lineno, msg, None, None
+    )
+
+
+def test_exception_is_logged_in_json(output: io.StringIO) -> None:
+    configure_logging(LoggingConfig(format="json"))
+
+    try:
+        1 / 0
+    except ZeroDivisionError as e:
+        logger.exception("Failed to divide %s by %s", 1, 0, extra={"device": "boiler"})
+        error = e
+
+    # Writes the queued records
+    stop_logging()
+
+    (line,) = output.getvalue().splitlines()
+    entry = json.loads(line)
+
+    assert entry["level"] == "ERROR"
+    assert entry["message"] == "Failed to divide 1 by 0"
+    assert entry["device"] == "boiler"
+    assert entry["exception"].startswith("Traceback (most recent call last):")
+    assert entry["exception"].endswith(f"ZeroDivisionError: {error}")
+
+
+def test_exception_is_logged_once_in_text(output: io.StringIO) -> None:
+    configure_logging(LoggingConfig())
+
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        logger.exception("Failed to divide")
+    stop_logging()
+
+    assert output.getvalue().count("ZeroDivisionError") == 1
+
+
+def test_debug_lines_are_rate_limited() -> None:
+    rate_limit = DebugRateLimitFilter(2)
+
+    passed = [rate_limit.filter(debug_record("Sent %s")) for _ in range(5)]
+    assert passed == [True, True, False, False, False]
+
+    # The other lines have their own limit
+    assert rate_limit.filter(debug_record("Received %s", lineno=2))
+
+
+def test_formatted_messages_of_a_line_are_rate_limited_together() -> None:
+    rate_limit = DebugRateLimitFilter(2)
+
+    passed = [rate_limit.filter(debug_record(f"Sent {i}")) for i in range(5)]
+    assert passed == [True, True, False, False, False]
+
+
+def test_dropped_records_are_counted_in_the_next_one(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    now = 1000.0
+    monkeypatch.setattr("viessmann_bridge.logger.time.monotonic", lambda: now)
+    rate_limit = DebugRateLimitFilter(1)
+
+    for _ in range(3):
+        rate_limit.filter(debug_record("Sent %s"))
+
+    now += 1
+    record = debug_record("Sent %s")
+    assert rate_limit.filter(record)
+    assert record.msg == "Sent %s (2 similar lines suppressed)"
+
+
+def test_refilled_buckets_are_forgotten(monkeypatch: pytest.MonkeyPatch) -> None:
+    now = 1000.0
+    monkeypatch.setattr("viessmann_bridge.logger.time.monotonic", lambda: now)
+    rate_limit = DebugRateLimitFilter(10)
+
+    for lineno in range(100):
+        rate_limit.filter(debug_record("Sent %s", lineno))
+    assert len(rate_limit._buckets) == 100
+
+    now += 2
+    rate_limit.filter(debug_record("Received %s", lineno=1000))
+    assert list(rate_limit._buckets) == [("bridge.py", 1000)]
+
+
+def test_rate_below_one_lets_a_line_through() -> None:
+    rate_limit = DebugRateLimitFilter(0.5)
+
+    assert rate_limit.filter(debug_record("Sent %s"))
+    assert not rate_limit.filter(debug_record("Sent %s"))
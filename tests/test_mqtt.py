@@ -0,0 +1,133 @@
+import asyncio
+import json
+from typing import Awaitable, Callable
+
+from benchmarks.fake_servers import FakeMqttBroker
+from viessmann_bridge.action import MqttActionConfig, MqttDomoticzConfig
+from viessmann_bridge.consumption import ConsumptionContext
+from viessmann_bridge.mqtt import Mqtt
+
+
+def run_with_broker(test: Callable[[FakeMqttBroker, Mqtt], Awaitable[None]]) -> None:
+    async def run() -> None:
+        broker = FakeMqttBroker()
+        await broker.start()
+
+        mqtt = Mqtt(
+            MqttActionConfig(
+                action_type="mqtt",
+                host=broker.host,
+                port=broker.port,
+                qos=1,
+                domoticz=MqttDomoticzConfig(
+                    gas_consumption_kwh_idx=2,
+                    gas_consumption_m3_idx=3,
+                    gas_consumption_kwh_increasing_idx=6,
+                    boiler_temperature_idx=4,
+                ),
+            )
+        )
+        await mqtt.init()
+
+        try:
+            await test(broker, mqtt)
+        finally:
+            await mqtt.close()
+            await broker.stop()
+
+    asyncio.run(run())
+
+
+def domoticz_messages(broker: FakeMqttBroker, idx: int) -> list[str]:
+    return [
+        message["svalue"]
+        for topic, payload in broker.messages
+        if topic == "domoticz/in" and (message := json.loads(payload))["idx"] == idx
+    ]
+
+
+def test_messages_are_published_at_the_end_of_the_cycle() -> None:
+    async def test(broker: FakeMqttBroker, mqtt: Mqtt) -> None:
+        await mqtt.handle_boiler_temperature(45.5)
+        await mqtt.handle_burners_modulations([20])
+        assert broker.messages == []
+
+        await mqtt.end_cycle()
+        assert broker.retained["viessmann_bridge/boiler_temperature"] == "45.5"
+        assert broker.retained["viessmann_bridge/burner_0_modulation"] == "20"
+        assert domoticz_messages(broker, 4) == ["45.5"]
+
+    run_with_broker(test)
+
+
+def test_only_the_latest_state_of_a_cycle_is_published() -> None:
+    async def test(broker: FakeMqttBroker, mqtt: Mqtt) -> None:
+        await mqtt.handle_boiler_temperature(45.5)
+        await mqtt.handle_boiler_temperature(46)
+        await mqtt.end_cycle()
+
+        states = [
+            payload
+            for topic, payload in broker.messages
+            if topic == "viessmann_bridge/boiler_temperature"
+        ]
+        assert states == ["46"]
+        assert domoticz_messages(broker, 4) == ["46"]
+
+    run_with_broker(test)
+
+
+def test_writes_of_a_device_are_published_in_order() -> None:
+    async def test(broker: FakeMqttBroker, mqtt: Mqtt) -> None:
+        ctx = ConsumptionContext()
+        for offset in range(1, 21):
+            await mqtt.update_current_total_consumption_increasing(ctx, offset)
+        await mqtt.update_current_total_consumption(ctx, 1234, 5)
+        await mqtt.end_cycle()
+
+        # In Wh
+        assert domoticz_messages(broker, 6) == [
+            str(offset * 1000) for offset in range(1, 21)
+        ]
+
+        # The counter is set before its history entry
+        kwh = domoticz_messages(broker, 2)
+        assert len(kwh) == 2
+        assert kwh[0] == "1234000"
+        assert kwh[1].startswith("1234000;0;")
+
+    run_with_broker(test)
+
+
+def test_discovery_is_published_once() -> None:
+    async def test(broker: FakeMqttBroker, mqtt: Mqtt) -> None:
+        for temperature in (45, 46):
+            await mqtt.handle_boiler_temperature(temperature)
+            await mqtt.end_cycle()
+
+        config_topic = "homeassistant/sensor/viessmann_bridge/boiler_temperature/config"
+        discoveries = [topic for topic, _ in broker.messages if topic == config_topic]
+        assert discoveries == [config_topic]
+
+        config = json.loads(broker.retained[config_topic])
+        assert config["state_topic"] == "viessmann_bridge/boiler_temperature"
+        assert config["unit_of_measurement"] == "°C"
+
+    run_with_broker(test)
+
+
+def test_messages_are_kept_while_the_broker_is_down() -> None:
+    async def test(broker: FakeMqttBroker, mqtt: Mqtt) -> None:
+        await mqtt._disconnect()
+        await broker.stop()
+
+        await mqtt.handle_boiler_temperature(45)
+        await mqtt.end_cycle()
+        assert broker.messages == []
+
+        # The broker is back (on the same port)
+        await broker.start(broker.port)
+        await mqtt.end_cycle()
+        assert broker.retained["viessmann_bridge/boiler_temperature"] == "45"
+
+    run_with_broker(test)
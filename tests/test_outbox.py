@@ -0,0 +1,210 @@
+import time
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from benchmarks.fake_servers import FakeDomoticz
+from viessmann_bridge import domoticz
+from viessmann_bridge.action import DomoticzActionConfig, OutboxConfig
+from viessmann_bridge.consumption import ConsumptionContext
+from viessmann_bridge.dispatcher import ActionDispatcher
+from viessmann_bridge.domoticz import Domoticz
+from viessmann_bridge.outbox import (
+    Outbox,
+    WriteRejected,
+    acquire_outbox,
+    release_outbox,
+)
+
+
+class Sink:
+    """
+    Keeps the delivered writes, failing while it's down and rejecting the writes marked so
+    """
+
+    def __init__(self) -> None:
+        self.up = True
+        self.attempts = 0
+        self.delivered: list[Any] = []
+
+    async def send(self, payload: Any) -> bool:
+        self.attempts += 1
+        if payload == "rejected":
+            raise WriteRejected("HTTP 400")
+        if not self.up:
+            return False
+
+        self.delivered.append(payload)
+        return True
+
+
+@pytest.fixture
+def outbox_config(tmp_path: Path) -> OutboxConfig:
+    return OutboxConfig(path=str(tmp_path / "outbox.db"), initial_backoff_seconds=60)
+
+
+def reset_backoff(outbox: Outbox) -> None:
+    outbox._retry_at = 0
+
+
+async def test_write_is_delivered_right_away(outbox_config: OutboxConfig) -> None:
+    sink = Sink()
+    outbox = Outbox(outbox_config, "sink", sink.send)
+
+    assert await outbox.put("stream", "value")
+    assert sink.delivered == ["value"]
+    assert outbox.pending == 0
+    await outbox.close()
+
+
+async def test_writes_are_kept_until_the_sink_is_back(
+    outbox_config: OutboxConfig,
+) -> None:
+    sink = Sink()
+    sink.up = False
+    outbox = Outbox(outbox_config, "sink", sink.send)
+
+    assert not await outbox.put("counter", 1)
+    # Only stored during the backoff
+    assert not await outbox.put("counter", 2)
+    assert sink.attempts == 1
+    assert outbox.pending == 2
+
+    sink.up = True
+    reset_backoff(outbox)
+    await outbox.flush()
+
+    assert sink.delivered == [1, 2]
+    assert outbox.pending == 0
+    await outbox.close()
+
+
+async def test_backoff_grows_with_the_failures(outbox_config: OutboxConfig) -> None:
+    sink = Sink()
+    sink.up = False
+    outbox = Outbox(outbox_config, "sink", sink.send)
+
+    await outbox.put("counter", 1)
+    first_delay = outbox._retry_at - time.monotonic()
+
+    reset_backoff(outbox)
+    await outbox.flush()
+    second_delay = outbox._retry_at - time.monotonic()
+
+    assert first_delay == pytest.approx(60, abs=1)
+    assert second_delay == pytest.approx(120, abs=1)
+    await outbox.close()
+
+
+async def test_only_the_latest_collapsing_write_is_kept(
+    outbox_config: OutboxConfig,
+) -> None:
+    sink = Sink()
+    sink.up = False
+    outbox = Outbox(outbox_config, "sink", sink.send)
+
+    await outbox.put("temperature", 45, collapse=True)
+    await outbox.put("temperature", 46, collapse=True)
+    await outbox.put("counter", 1)
+    await outbox.put("counter", 2)
+    assert outbox.pending == 3
+
+    sink.up = True
+    reset_backoff(outbox)
+    await outbox.flush()
+
+    # The streams are sent in the order they've been waiting for
+    assert sink.delivered == [46, 1, 2]
+    await outbox.close()
+
+
+async def test_rejected_write_is_dropped(outbox_config: OutboxConfig) -> None:
+    sink = Sink()
+    outbox = Outbox(outbox_config, "sink", sink.send)
+
+    assert not await outbox.put("stream", "rejected")
+    # Doesn't hold up the next writes, nor does it start the backoff
+    assert await outbox.put("stream", "value")
+    assert sink.delivered == ["value"]
+    assert outbox.pending == 0
+    await outbox.close()
+
+
+async def test_writes_survive_the_restart(outbox_config: OutboxConfig) -> None:
+    sink = Sink()
+    sink.up = False
+    outbox = Outbox(outbox_config, "sink", sink.send)
+    await outbox.put("counter", 1)
+    await outbox.close()
+
+    sink.up = True
+    outbox = Outbox(outbox_config, "sink", sink.send)
+    await outbox.flush()
+
+    assert sink.delivered == [1]
+    await outbox.close()
+
+
+async def test_shared_outbox_sends_through_an_open_action(
+    outbox_config: OutboxConfig,
+) -> None:
+    first, second = Sink(), Sink()
+    outbox = acquire_outbox(outbox_config, "sink", first.send)
+    assert acquire_outbox(outbox_config, "sink", second.send) is outbox
+
+    await release_outbox("sink", first.send)
+    await outbox.put("stream", "value")
+
+    assert first.delivered == []
+    assert second.delivered == ["value"]
+    await release_outbox("sink", second.send)
+
+
+async def test_shared_outbox_needs_the_same_settings(
+    outbox_config: OutboxConfig,
+) -> None:
+    sink = Sink()
+    acquire_outbox(outbox_config, "sink", sink.send)
+
+    with pytest.raises(ValueError):
+        acquire_outbox(
+            outbox_config.model_copy(update={"max_age_hours": 1}), "sink", sink.send
+        )
+    await release_outbox("sink", sink.send)
+
+
+async def test_queued_write_isnt_acknowledged(outbox_config: OutboxConfig) -> None:
+    server = FakeDomoticz()
+    await server.start()
+
+    action = Domoticz(
+        DomoticzActionConfig(
+            action_type="domoticz",
+            domoticz_url=server.url,
+            outbox=outbox_config,
+            gas_consumption_kwh_idx=2,
+        )
+    )
+    await action.init()
+    dispatcher = ActionDispatcher([action])
+    dispatcher.start()
+
+    try:
+        await server.stop()
+
+        (future,) = dispatcher.submit(
+            "current_total_consumption",
+            lambda action: action.update_current_total_consumption(
+                ConsumptionContext(), 1000, 10
+            ),
+        )
+
+        # Kept in the outbox, but not delivered yet
+        assert not await future
+        assert action._outbox is not None and action._outbox.pending > 0
+    finally:
+        await dispatcher.stop()
+        await action.close()
+        domoticz._rate_limiters.pop(server.url, None)
+        domoticz._backfill_rate_limiters.pop(server.url, None)
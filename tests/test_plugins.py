@@ -0,0 +1,79 @@
+from typing import Iterator, Literal
+
+import pytest
+
+from viessmann_bridge import plugins
+from viessmann_bridge.action import Action, ActionConfig, DomoticzActionConfig
+from viessmann_bridge.config import Config
+from viessmann_bridge.plugins import (
+    ActionPlugin,
+    create_action,
+    get_plugin,
+    import_times,
+    parse_action_config,
+    register_action,
+)
+
+
+class EchoActionConfig(ActionConfig):
+    action_type: Literal["echo"]
+
+    greeting: str = "Hello"
+
+
+class EchoAction(Action):
+    def __init__(self, config: EchoActionConfig) -> None:
+        self.config = config
+
+
+plugin = ActionPlugin("echo", EchoActionConfig, f"{__name__}:EchoAction")
+
+
+@pytest.fixture(autouse=True)
+def unregister_echo() -> Iterator[None]:
+    try:
+        yield
+    finally:
+        plugins._plugins.pop("echo", None)
+
+
+def test_builtin_actions_are_registered() -> None:
+    config = parse_action_config(
+        {"action_type": "domoticz", "domoticz_url": "http://domoticz"}
+    )
+
+    assert isinstance(config, DomoticzActionConfig)
+    assert get_plugin("domoticz").action_path == "viessmann_bridge.domoticz:Domoticz"
+
+
+def test_registered_action_is_created_from_its_config() -> None:
+    register_action(plugin)
+
+    config = parse_action_config({"action_type": "echo", "greeting": "Hi"})
+    assert isinstance(config, EchoActionConfig)
+
+    action = create_action(config)
+    assert isinstance(action, EchoAction)
+    assert action.config.greeting == "Hi"
+    # The module is imported once, when the first action is created
+    assert "echo" in import_times()
+
+
+def test_unknown_action_type_lists_the_available_ones() -> None:
+    with pytest.raises(ValueError, match="available: .*domoticz"):
+        parse_action_config({"action_type": "echo"})
+
+
+def test_plugins_from_the_config_are_loaded_before_the_actions() -> None:
+    config = Config.model_validate(
+        {
+            "timezone": "UTC",
+            "viessmann_creds": {"username": "", "password": "", "client_id": ""},
+            "plugins": [f"{__name__}:plugin"],
+            "actions": [{"action_type": "echo"}],
+        }
+    )
+
+    (action,) = config.actions
+    assert isinstance(action, EchoActionConfig)
+    assert action.greeting == "Hello"
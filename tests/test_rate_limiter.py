@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+from viessmann_bridge.action import RateLimitConfig
+from viessmann_bridge.rate_limiter import AdaptiveRateLimiter
+
+
+def limiter(**config: float) -> AdaptiveRateLimiter:
+    return AdaptiveRateLimiter(RateLimitConfig.model_validate(config), "test")
+
+
+async def test_burst_is_sent_at_once() -> None:
+    rate_limiter = limiter(rate_per_second=10, burst=5)
+
+    started_at = time.monotonic()
+    for _ in range(5):
+        await rate_limiter.acquire()
+    assert time.monotonic() - started_at < 0.05
+
+    # The next one waits for a token
+    await rate_limiter.acquire()
+    assert time.monotonic() - started_at >= 0.09
+
+
+async def test_default_rate_doesnt_hold_up_a_backfill() -> None:
+    rate_limiter = limiter()
+
+    started_at = time.monotonic()
+    for _ in range(20):
+        await rate_limiter.acquire()
+    assert time.monotonic() - started_at < 1
+
+
+async def test_waiters_are_served_in_order() -> None:
+    rate_limiter = limiter(rate_per_second=100, burst=1)
+    order: list[int] = []
+
+    async def request(i: int) -> None:
+        await rate_limiter.acquire()
+        order.append(i)
+
+    await asyncio.gather(*(request(i) for i in range(10)))
+    assert order == list(range(10))
+
+
+def test_rate_is_halved_on_failures_and_slow_responses() -> None:
+    rate_limiter = limiter(rate_per_second=8, min_rate_per_second=1)
+
+    rate_limiter.record(0.1, success=False)
+    assert rate_limiter.rate == 4
+    rate_limiter.record(5, success=True)
+    assert rate_limiter.rate == 2
+
+    # Never below the minimum
+    for _ in range(5):
+        rate_limiter.record(0.1, success=False)
+    assert rate_limiter.rate == 1
+
+
+def test_rate_recovers_gradually() -> None:
+    rate_limiter = limiter(rate_per_second=10, min_rate_per_second=1, recovery_step=0.5)
+    rate_limiter.record(0.1, success=False)
+    assert rate_limiter.rate == 5
+
+    rate_limiter.record(0.1, success=True)
+    assert rate_limiter.rate == 10
+
+    # Never above the configured rate
+    rate_limiter.record(0.1, success=True)
+    assert rate_limiter.rate == 10
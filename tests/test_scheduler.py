@@ -0,0 +1,87 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+from viessmann_bridge.api_budget import ApiBudget, ApiBudgetConfig
+from viessmann_bridge.scheduler import ScheduledJob, Scheduler
+
+INTERVAL = 0.1
+
+
+async def run_for(scheduler: Scheduler, seconds: float) -> None:
+    task = asyncio.create_task(scheduler.run_forever())
+    await asyncio.sleep(seconds)
+
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+async def test_jobs_run_at_the_boundaries_of_their_interval() -> None:
+    started: list[float] = []
+
+    async def run() -> None:
+        started.append(time.time())
+
+    job = ScheduledJob("poll", INTERVAL, run)
+    await run_for(Scheduler([job]), 0.55)
+
+    # Right away, then on every tick
+    assert 5 <= job.runs <= 7
+    for started_at in started[1:]:
+        assert started_at % INTERVAL < INTERVAL / 2
+    assert job.skipped_ticks == 0
+
+
+async def test_overrunning_job_skips_the_ticks() -> None:
+    async def run() -> None:
+        await asyncio.sleep(INTERVAL * 2.5)
+
+    job = ScheduledJob("slow", INTERVAL, run)
+    await run_for(Scheduler([job]), 1)
+
+    # Not run one after another to catch up
+    assert job.runs <= 4
+    assert job.skipped_ticks >= 2 * (job.runs - 1)
+
+
+async def test_failing_job_keeps_its_schedule() -> None:
+    async def run() -> None:
+        raise RuntimeError("The device can't be read")
+
+    job = ScheduledJob("failing", INTERVAL, run)
+    await run_for(Scheduler([job]), 0.35)
+
+    assert job.runs >= 3
+
+
+async def test_settle_gets_the_time_until_the_next_tick() -> None:
+    settled: list[float] = []
+
+    async def settle(seconds: float) -> None:
+        settled.append(seconds)
+
+    async def run() -> None:
+        pass
+
+    job = ScheduledJob("poll", 3, run)
+    await run_for(Scheduler([job], settle=settle), 0.1)
+
+    # Ends ahead of the tick, by the settle margin
+    assert settled and 0 <= settled[0] < 3 - 1
+
+
+async def test_ticks_are_skipped_while_the_api_is_blocked() -> None:
+    budget = ApiBudget(ApiBudgetConfig(state_file=None))
+
+    async def run() -> None:
+        budget.record_rate_limit(datetime.now(timezone.utc) + timedelta(hours=1))
+
+    job = ScheduledJob("poll", INTERVAL, run)
+    await run_for(Scheduler([job], budget), 0.35)
+
+    # Only the first run, before the limit was reached
+    assert job.runs == 1
+    assert job.skipped_ticks >= 2
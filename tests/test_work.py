@@ -0,0 +1,103 @@
+from datetime import date
+from pathlib import Path
+
+import pytest
+
+from benchmarks.harness import BenchmarkOptions, BenchmarkRun
+from viessmann_bridge.consumption import ConsumptionContext
+from viessmann_bridge.state_journal import StateJournal
+
+RESTORED_TOTAL = 1000
+
+
+async def restarted_after(days: list[int]) -> tuple[BenchmarkRun, int]:
+    """
+    Run the bridge restored from a journal, after the boiler consumed the given amounts
+    on the day of the journal and the following days it wasn't polled
+
+    Returns:
+        tuple[BenchmarkRun, int]: The stopped run and the total counter after the first poll
+    """
+    run = BenchmarkRun(BenchmarkOptions(domoticz_rate_per_second=1000))
+    await run.start()
+
+    try:
+        ctx = run.bridge.consumption_context
+        ctx.total_consumption = ctx.previous_total_consumption = RESTORED_TOTAL
+        ctx.history.restore(run.boiler.today, list(run.boiler.daily))
+
+        run.boiler.consume(days[0])
+        for amount in days[1:]:
+            run.boiler.new_day()
+            run.boiler.consume(amount)
+
+        await run.poll(burners=False, boiler=False)
+        await run.settle()
+    finally:
+        await run.stop()
+
+    return run, run.bridge.consumption_context.total_consumption
+
+
+async def test_days_missed_after_the_restart_are_added_to_the_restored_total() -> None:
+    run, total_consumption = await restarted_after([2, 5, 7, 4])
+
+    assert total_consumption == RESTORED_TOTAL + 2 + 5 + 7 + 4
+    assert run.domoticz.values[2].split(";")[0] == str(total_consumption * 1000)
+    # The increasing counter got the same increase
+    assert run.domoticz.values[6] == str((2 + 5 + 7 + 4) * 1000)
+
+
+async def test_gap_longer_than_the_daily_values_adds_their_sum() -> None:
+    run, total_consumption = await restarted_after([3] + [1] * 10)
+
+    # Only the last 8 days are known
+    assert total_consumption == RESTORED_TOTAL + sum(run.boiler.daily)
+
+
+@pytest.fixture
+def journal_path(tmp_path: Path) -> str:
+    return str(tmp_path / "state.db")
+
+
+def test_journal_restores_the_context_and_the_acknowledgements(
+    journal_path: str,
+) -> None:
+    ctx = ConsumptionContext()
+    ctx.total_consumption = 1234
+    ctx.previous_total_consumption = 1230
+    ctx.history.restore(date(2024, 1, 2), [4, 10])
+
+    journal = StateJournal(journal_path, "boiler", snapshot_every=2)
+    journal.record_context(ctx)
+    journal.acknowledge("domoticz http://domoticz", 1234)
+    journal.acknowledge("home_assistant http://ha", 1230)
+    journal.close()
+
+    restored = ConsumptionContext()
+    journal = StateJournal(journal_path, "boiler")
+    assert journal.restore_context(restored)
+    assert journal.state is not None
+    assert journal.state.acknowledged == {
+        "domoticz http://domoticz": 1234,
+        "home_assistant http://ha": 1230,
+    }
+    journal.close()
+
+    assert restored.total_consumption == 1234
+    assert restored.previous_total_consumption == 1230
+    assert restored.previous_consumption_date == date(2024, 1, 2)
+    assert restored.previous_consumption_daily == [4, 10]
+
+
+def test_journal_of_another_device_isnt_restored(journal_path: str) -> None:
+    ctx = ConsumptionContext()
+    ctx.history.restore(date(2024, 1, 2), [4])
+
+    journal = StateJournal(journal_path, "boiler")
+    journal.record_context(ctx)
+    journal.close()
+
+    journal = StateJournal(journal_path, "heat pump")
+    assert not journal.restore_context(ConsumptionContext())
+    journal.close()
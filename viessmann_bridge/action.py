@@ -1,5 +1,6 @@
-from datetime import date
+from datetime import date, datetime
 from typing import Literal, Optional
+from zoneinfo import ZoneInfo
 
 from pydantic import BaseModel
 
@@ -7,11 +8,61 @@ from viessmann_bridge.logger import logger
 from viessmann_bridge.consumption import ConsumptionContext
 
 
+class HttpPoolConfig(BaseModel):
+    # Maximum number of simultaneous connections kept by the action's session
+    connection_limit: int = 4
+    # How long an idle keep-alive connection is kept open
+    keepalive_timeout_seconds: float = 60
+    connect_timeout_seconds: float = 10
+    # Total timeout of a single request (including reading the response)
+    request_timeout_seconds: float = 30
+
+
+class RateLimitConfig(BaseModel):
+    # Steady rate of the requests and how many of them can be sent at once.
+    # A local Domoticz copes with that easily - the rate goes down by itself when it doesn't
+    rate_per_second: float = 20
+    burst: int = 10
+    # The rate is lowered (down to the minimum) when the requests fail or are slower than the threshold
+    min_rate_per_second: float = 0.5
+    latency_threshold_seconds: float = 1
+    # Part of the configured rate restored after every successful request
+    recovery_step: float = 0.1
+
+
+class OutboxConfig(BaseModel):
+    # SQLite file where the writes are kept until the sink accepts them. Set to null to disable
+    path: Optional[str] = "outbox.db"
+    # The failed writes are retried with an exponential backoff between these bounds
+    initial_backoff_seconds: float = 5
+    max_backoff_seconds: float = 300
+    # The writes pending for longer than that are dropped
+    max_age_hours: float = 72
+
+
 class ActionConfig(BaseModel):
     action_type: str
+    # Name of the action, which keeps its saved state apart from the other actions.
+    # Defaults to where it writes to (e.g. the URL) - only needed if two actions write to the same place
+    name: Optional[str] = None
+
+    http: HttpPoolConfig = HttpPoolConfig()
+    outbox: OutboxConfig = OutboxConfig()
+
+
+class DomoticzDevicesConfig(BaseModel):
+    # Domoticz devices (idxs) the values are written to
+    gas_consumption_m3_idx: Optional[int] = None
+    gas_consumption_kwh_idx: Optional[int] = None
+
+    gas_consumption_m3_increasing_idx: Optional[int] = None
+    gas_consumption_kwh_increasing_idx: Optional[int] = None
+
+    burner_modulation_idxs: list[int] = []
+    boiler_temperature_idx: Optional[int] = None
 
 
-class DomoticzActionConfig(ActionConfig):
+class DomoticzActionConfig(ActionConfig, DomoticzDevicesConfig):
     action_type: Literal["domoticz"]
 
     domoticz_url: str
@@ -20,14 +71,76 @@ class DomoticzActionConfig(ActionConfig):
     # Applies to Domoticz before 01.06.2023, please see: https://github.com/domoticz/domoticz-android/issues/692
     use_legacy_device_endpoint: bool = False
 
-    gas_consumption_m3_idx: Optional[int] = None
-    gas_consumption_kwh_idx: Optional[int] = None
+    # Pacing of the requests sent to Domoticz
+    rate_limit: RateLimitConfig = RateLimitConfig()
+    # How many devices (idxs) are backfilled with the daily history at the same time
+    backfill_concurrency: int = 2
+    # Pacing of the backfilled history - separate from the regular updates, so that
+    # the devices backfilled at the same time aren't held up by their rate
+    backfill_rate_limit: RateLimitConfig = RateLimitConfig(rate_per_second=50, burst=20)
 
-    gas_consumption_m3_increasing_idx: Optional[int] = None
-    gas_consumption_kwh_increasing_idx: Optional[int] = None
+    # If true, the counters' history is read from Domoticz first and only the days
+    # which differ from the computed values are written
+    reconcile_history: bool = True
+    # Divider of the counters, as set in Domoticz (Setup > Settings > Meters/Counters).
+    # Used to compare the stored history with the values sent (which are multiplied by 1000)
+    history_divider: float = 1000
 
-    burner_modulation_idxs: list[int] = []
-    boiler_temperature_idx: Optional[int] = None
+
+class MqttDomoticzConfig(DomoticzDevicesConfig):
+    # Topic Domoticz listens on (the MQTT Client Gateway hardware)
+    topic: str = "domoticz/in"
+
+
+class MqttActionConfig(ActionConfig):
+    action_type: Literal["mqtt"]
+
+    host: str
+    port: int = 1883
+    username: Optional[str] = None
+    password: Optional[str] = None
+    client_id: Optional[str] = None
+    keepalive_seconds: int = 60
+    timeout_seconds: float = 10
+
+    qos: Literal[0, 1, 2] = 1
+    # Whether the states are retained by the broker (the Domoticz messages never are)
+    retain: bool = True
+
+    # The states are published to base_topic/<name>, e.g. viessmann_bridge/boiler_temperature
+    base_topic: str = "viessmann_bridge"
+
+    # If true, the sensors are announced to Home Assistant with MQTT discovery
+    home_assistant_discovery: bool = True
+    discovery_prefix: str = "homeassistant"
+    device_name: str = "Viessmann boiler"
+
+    # If set, the values are also sent to Domoticz as domoticz/in messages
+    domoticz: Optional[MqttDomoticzConfig] = None
+
+
+class TimeSeriesActionConfig(ActionConfig):
+    action_type: Literal["timeseries"]
+
+    # Endpoint the batches are POSTed to, e.g. http://192.168.0.102:8086/api/v2/write?org=home&bucket=boiler&precision=s
+    # The timestamps are in seconds
+    url: str
+    # Sent with every request, e.g. Authorization: Token YOUR_INFLUXDB_TOKEN
+    headers: dict[str, str] = {}
+
+    # InfluxDB line protocol or newline-delimited JSON (one point per line)
+    format: Literal["line_protocol", "ndjson"] = "line_protocol"
+    measurement: str = "viessmann"
+    # Added to every point, e.g. the name of the device
+    tags: dict[str, str] = {}
+
+    # The points are buffered and sent when the batch is full or the flush interval passes
+    batch_size: int = 500
+    flush_interval_seconds: float = 60
+    gzip: bool = True
+
+    # Timezone the days of the daily consumption start in - defaults to the timezone of the bridge
+    timezone: Optional[ZoneInfo] = None
 
 
 class HomeAssistantActionConfig(ActionConfig):
@@ -36,6 +149,22 @@ class HomeAssistantActionConfig(ActionConfig):
     home_assistant_url: str
     token: str
 
+    # If true, a persistent WebSocket connection is kept - it's only needed to import the statistics
+    # (statistic_id below), as the states are always set with the REST API. When connecting,
+    # the configured entities are also checked
+    use_websocket: bool = False
+    # How long the WebSocket commands (e.g. a statistics import) wait for the response
+    websocket_command_timeout_seconds: float = 30
+
+    # If set, the daily consumption is imported into the long-term statistics of Home Assistant
+    # as external statistics (needs the WebSocket connection). Has to be in the "domain:object_id" format
+    statistic_id: Optional[str] = None
+    statistic_name: str = "Gas consumption"
+    # The history before the daily values is imported with that granularity, e.g. monthly totals
+    statistics_coarse_history: Optional[Literal["week", "month", "year"]] = None
+    # Timezone the days of the statistics start in - defaults to the timezone of the bridge
+    timezone: Optional[ZoneInfo] = None
+
     gas_usage_entity_id: Optional[str]
     burner_modulation_entities_ids: list[str] = []
     boiler_temperature_entity_id: Optional[str]
@@ -46,12 +175,33 @@ class Action:
     Action class serves as a base class with virtual methods that are intended to be overridden by subclasses.
     """
 
+    @property
+    def sink(self) -> str:
+        """
+        Stable name of the action, e.g. "domoticz http://192.168.0.102:8000" - unlike the
+        position of the action in the config, it doesn't change when other actions are added
+        """
+        return getattr(self, "_sink", None) or type(self).__name__
+
     async def init(self) -> None:
         """
         Initialize the action
         """
         raise NotImplementedError()
 
+    async def close(self) -> None:
+        """
+        Release the resources held by the action (e.g. HTTP sessions)
+        """
+        pass
+
+    async def end_cycle(self) -> None:
+        """
+        Called after every poll, once the action got all the updates of it - the actions
+        batching their writes per cycle send them here
+        """
+        pass
+
     async def update_current_total_consumption(
         self,
         consumption_context: ConsumptionContext,
@@ -66,7 +216,7 @@ class Action:
             total_consumption (int): Gas consumption in kWh
             today (int): Gas consumption in kWh for today
         """
-        logger.debug(f"Updating current total consumption: {total_consumption}")
+        logger.debug("Updating current total consumption: %s", total_consumption)
         raise NotImplementedError()
 
     async def update_current_total_consumption_increasing(
@@ -84,7 +234,8 @@ class Action:
             consumption_increase_offset (int): = new total consumption - previous total consumption
         """
         logger.debug(
-            f"Updating current total consumption increasing: {consumption_increase_offset}"
+            "Updating current total consumption increasing: %s",
+            consumption_increase_offset,
         )
         raise NotImplementedError()
 
@@ -98,7 +249,7 @@ class Action:
             consumption_context (ConsumptionContext): Consumption context
             consumption (dict[date, int]): Gas consumption in kWh for each day
         """
-        logger.debug(f"Updating daily consumption stats: {consumption}")
+        logger.debug("Updating daily consumption stats: %s", consumption)
         raise NotImplementedError()
 
     async def handle_consumption_midnight_case(
@@ -124,31 +275,43 @@ class Action:
             current_day_value (int): Current day value
             total_counter (int): Total counter value
         """
-        logger.debug(f"""
+        logger.debug(
+            """
 Handling midnight case with the following values:
-    previous_day_new_value: {previous_day_new_value},
-    offset_previous_day: {offset_previous_day},
-    current_day_value: {current_day_value},
-    total_counter: {total_counter}
-""")
+    previous_day_new_value: %s,
+    offset_previous_day: %s,
+    current_day_value: %s,
+    total_counter: %s
+""",
+            previous_day_new_value,
+            offset_previous_day,
+            current_day_value,
+            total_counter,
+        )
         raise NotImplementedError()
 
-    async def handle_burners_modulations(self, burners_modulations: list[int]):
+    async def handle_burners_modulations(
+        self, burners_modulations: list[int], timestamp: Optional[datetime] = None
+    ):
         """
         Handle the modulation value of the burners.
 
         Args:
             burners_modulation (int): Burners modulation values (0% - 100%)
+            timestamp (Optional[datetime]): When Viessmann read the values, if known
         """
-        logger.debug(f"Handling burners modulations: {burners_modulations}")
+        logger.debug("Handling burners modulations: %s", burners_modulations)
         raise NotImplementedError()
 
-    async def handle_boiler_temperature(self, boiler_temperature: float):
+    async def handle_boiler_temperature(
+        self, boiler_temperature: float, timestamp: Optional[datetime] = None
+    ):
         """
         Handle the boiler temperature.
 
         Args:
             boiler_temperature (float): Boiler temperature in Celsius
+            timestamp (Optional[datetime]): When Viessmann read the value, if known
         """
-        logger.debug(f"Handling boiler temperature: {boiler_temperature}")
+        logger.debug("Handling boiler temperature: %s", boiler_temperature)
         raise NotImplementedError()
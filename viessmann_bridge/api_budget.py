@@ -0,0 +1,192 @@
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+from PyViCare.PyViCareAbstractOAuthManager import AbstractViCareOAuthManager
+from PyViCare.PyViCareUtils import PyViCareRateLimitError
+from pydantic import BaseModel
+
+from viessmann_bridge.logger import logger
+from viessmann_bridge.metrics import VIESSMANN_API_CALLS_REMAINING
+
+WINDOW_SECONDS = 24 * 60 * 60
+# The pace of the calls is measured over that period
+PACE_WINDOW_SECONDS = 60 * 60
+MIN_PACE_WINDOW_SECONDS = 5 * 60
+
+
+class ApiBudgetConfig(BaseModel):
+    # How many calls to the Viessmann API can be made within 24 hours
+    daily_limit: int = 1450
+    # Part of the limit the bridge aims to use - the poll intervals are stretched to stay under it
+    target_ratio: float = 0.9
+    # The poll intervals are never stretched more than that
+    max_interval_scale: float = 10
+    # File where the calls are saved, so that the count survives restarts. Set to null to disable
+    state_file: Optional[str] = "api_budget.json"
+
+
+class ApiBudget:
+    """
+    Counts the calls made to the Viessmann API in a sliding 24 hours window.
+
+    Based on the pace of the calls, it computes how much the poll intervals
+    should be stretched to stay under the daily limit, and it blocks the polling
+    entirely when the limit is reached or the API responds with HTTP 429.
+    """
+
+    def __init__(self, config: ApiBudgetConfig) -> None:
+        self.config = config
+
+        self._calls: deque[float] = deque()
+        self._blocked_until = 0.0
+        self._started_at = time.time()
+        # The calls are made from the device threads
+        self._lock = threading.Lock()
+
+        self._load()
+
+    def _load(self) -> None:
+        if self.config.state_file is None:
+            return
+
+        try:
+            with open(self.config.state_file, "r") as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Couldn't read the API budget state: {e}")
+            return
+
+        self._calls.extend(sorted(saved.get("calls", [])))
+        self._blocked_until = saved.get("blocked_until", 0.0)
+        self._prune(time.time())
+
+        logger.info(
+            f"Restored the API budget: {len(self._calls)} calls in the last 24 hours"
+        )
+
+    def _save(self) -> None:
+        if self.config.state_file is None:
+            return
+
+        try:
+            with open(self.config.state_file, "w") as f:
+                json.dump(
+                    {"calls": list(self._calls), "blocked_until": self._blocked_until},
+                    f,
+                )
+        except OSError as e:
+            logger.warning(f"Couldn't save the API budget state: {e}")
+
+    def _prune(self, now: float) -> None:
+        while self._calls and self._calls[0] <= now - WINDOW_SECONDS:
+            self._calls.popleft()
+
+    def record_call(self) -> None:
+        with self._lock:
+            now = time.time()
+            self._calls.append(now)
+            self._prune(now)
+            self._save()
+
+            VIESSMANN_API_CALLS_REMAINING.set(
+                max(0, self.config.daily_limit - len(self._calls))
+            )
+
+    def record_rate_limit(self, reset_at: datetime) -> None:
+        """
+        Stop the polling until the API's limit is reset
+        """
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, reset_at.timestamp())
+            self._save()
+
+        logger.error(
+            f"Viessmann API rate limit reached, pausing the polling until {reset_at.isoformat()}"
+        )
+
+    @property
+    def used(self) -> int:
+        with self._lock:
+            self._prune(time.time())
+            return len(self._calls)
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.config.daily_limit - self.used)
+
+    def blocked_for(self) -> float:
+        """
+        Returns:
+            float: For how many seconds the API must not be called (0 if it can be)
+        """
+        with self._lock:
+            now = time.time()
+            self._prune(now)
+
+            blocked_for = max(0.0, self._blocked_until - now)
+
+            if len(self._calls) >= self.config.daily_limit:
+                # Wait until the oldest call leaves the window
+                blocked_for = max(blocked_for, self._calls[0] + WINDOW_SECONDS - now)
+
+            return blocked_for
+
+    def interval_scale(self, current_scale: float) -> float:
+        """
+        How much the poll intervals should be stretched to stay under the daily limit.
+
+        Args:
+            current_scale (float): The scale the intervals are stretched by right now,
+                used to compute the pace of the calls without any stretching
+        """
+        with self._lock:
+            now = time.time()
+            pace_window = min(PACE_WINDOW_SECONDS, now - self._started_at)
+            if pace_window < MIN_PACE_WINDOW_SECONDS:
+                return current_scale
+
+            recent_calls = sum(1 for call in self._calls if call > now - pace_window)
+
+        # Calls per day if the intervals weren't stretched
+        base_daily_pace = recent_calls * WINDOW_SECONDS / pace_window * current_scale
+        target = self.config.daily_limit * self.config.target_ratio
+
+        return min(self.config.max_interval_scale, max(1.0, base_daily_pace / target))
+
+
+def count_api_calls(
+    oauth_manager: AbstractViCareOAuthManager, budget: ApiBudget
+) -> None:
+    """
+    Make the OAuth manager count every call to the Viessmann API in the budget
+    """
+    original_get = oauth_manager.get
+    original_post = oauth_manager.post
+
+    def handle_rate_limit(e: PyViCareRateLimitError) -> None:
+        budget.record_rate_limit(e.limitResetDate.replace(tzinfo=timezone.utc))
+
+    def get(url: str) -> Any:
+        budget.record_call()
+        try:
+            return original_get(url)
+        except PyViCareRateLimitError as e:
+            handle_rate_limit(e)
+            raise
+
+    def post(url: str, data: Any) -> Any:
+        budget.record_call()
+        try:
+            return original_post(url, data)
+        except PyViCareRateLimitError as e:
+            handle_rate_limit(e)
+            raise
+
+    oauth_manager.get = get  # type: ignore[method-assign]
+    oauth_manager.post = post  # type: ignore[method-assign]
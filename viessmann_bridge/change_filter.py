@@ -0,0 +1,79 @@
+from time import monotonic
+from typing import Any
+
+from viessmann_bridge.logger import logger
+from viessmann_bridge.metrics import WRITES_SENT, WRITES_SUPPRESSED
+
+
+class ChangeFilter:
+    """
+    Remembers the last value submitted to each action, and drops the new values
+    which are within the deadband of it - unless it was submitted longer ago than the heartbeat.
+    Comparing with the last submitted value (not the last delivered one) keeps the values
+    queued behind a slow action from being submitted again.
+    """
+
+    def __init__(
+        self, deadbands: dict[str, float], heartbeat_seconds: float, device: str = ""
+    ) -> None:
+        """
+        Args:
+            deadbands (dict[str, float]): Kind of the update -> minimal change of the value to be sent.
+                Updates of other kinds are always sent
+            heartbeat_seconds (float): After that time, the value is sent even if it didn't change
+            device (str): Name of the device, used in the metrics
+        """
+        self.deadbands = deadbands
+        self.heartbeat_seconds = heartbeat_seconds
+        self.device = device
+
+        self.sent = 0
+        self.suppressed = 0
+
+        self._submitted: dict[tuple[str, str], tuple[Any, float]] = {}
+
+    @staticmethod
+    def _differs(previous: Any, value: Any, deadband: float) -> bool:
+        if isinstance(value, list):
+            return len(value) != len(previous) or any(
+                ChangeFilter._differs(p, v, deadband) for p, v in zip(previous, value)
+            )
+
+        difference = abs(value - previous)
+        return difference != 0 and difference >= deadband
+
+    def should_send(self, sink: str, kind: str, value: Any) -> bool:
+        deadband = self.deadbands.get(kind)
+        if deadband is None:
+            return True
+
+        last = self._submitted.get((sink, kind))
+
+        if (
+            last is None
+            or monotonic() - last[1] >= self.heartbeat_seconds
+            or self._differs(last[0], value, deadband)
+        ):
+            self._submitted[(sink, kind)] = (value, monotonic())
+            return True
+
+        logger.debug(
+            "Suppressing %s for %s: %s (last submitted: %s)", kind, sink, value, last[0]
+        )
+        self.suppressed += 1
+        WRITES_SUPPRESSED.inc(device=self.device, action=sink, kind=kind)
+        return False
+
+    def delivered(self, sink: str, kind: str, value: Any, success: bool) -> None:
+        """
+        Count the submitted value once the action handled it. If the action failed, the value
+        is forgotten, so that it's sent again with the next update
+        """
+        if success:
+            self.sent += 1
+            WRITES_SENT.inc(device=self.device, action=sink, kind=kind)
+            return
+
+        last = self._submitted.get((sink, kind))
+        if last is not None and last[0] == value:
+            del self._submitted[(sink, kind)]
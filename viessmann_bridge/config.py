@@ -1,17 +1,27 @@
-from typing import Optional, Union
+import asyncio
+from typing import Any, Optional
 from zoneinfo import ZoneInfo
 
-from pydantic import BaseModel
+from pydantic import BaseModel, SerializeAsAny, field_validator, model_validator
 from pydantic_yaml import parse_yaml_raw_as
 
 from viessmann_bridge.action import (
     Action,
-    DomoticzActionConfig,
+    ActionConfig,
     HomeAssistantActionConfig,
+    TimeSeriesActionConfig,
+)
+from viessmann_bridge.api_budget import ApiBudgetConfig
+from viessmann_bridge.dispatcher import worker_names
+from viessmann_bridge.local_api import LocalApiConfig
+from viessmann_bridge.logger import LoggingConfig, configure_logging, logger
+from viessmann_bridge.metrics import MetricsConfig, instrument_action
+from viessmann_bridge.plugins import (
+    create_action,
+    import_times,
+    load_plugins,
+    parse_action_config,
 )
-from viessmann_bridge.domoticz import Domoticz
-from viessmann_bridge.home_assistant import HomeAssistant
-from viessmann_bridge.logger import logger
 
 
 class ViessmannCreds(BaseModel):
@@ -20,18 +30,135 @@ class ViessmannCreds(BaseModel):
     client_id: str
 
 
+class ChangeSuppressionConfig(BaseModel):
+    # If enabled, the values which didn't change (more than the deadband) since
+    # they were last sent to an action are not sent again
+    enabled: bool = True
+
+    boiler_temperature_deadband: float = 0.5
+    burner_modulation_deadband: float = 1
+    total_consumption_deadband: float = 0
+
+    # The value is sent anyway if the last one was sent longer ago than that
+    heartbeat_minutes: float = 15
+
+
+class PollIntervals(BaseModel):
+    # How often each metric is polled - defaults to sleep_interval_seconds.
+    # The polls are aligned to the wall-clock (e.g. 300 = every full 5 minutes)
+    gas_usage_seconds: Optional[int] = None
+    burners_seconds: Optional[int] = None
+    boiler_temperature_seconds: Optional[int] = None
+
+
+# Every action is validated with the config model registered for its action_type
+ActionConfigs = list[SerializeAsAny[ActionConfig]]
+
+
+def _parse_actions(actions: Any) -> Any:
+    if not isinstance(actions, list):
+        return actions
+    return [parse_action_config(action) for action in actions]
+
+
+class DeviceConfig(BaseModel):
+    # Name of the device, used in the logs and to keep the saved state of the devices apart
+    name: Optional[str] = None
+    device_index: int = 0
+    number_of_burners: int = 1
+
+    actions: ActionConfigs = []
+
+    @field_validator("actions", mode="before")
+    @classmethod
+    def _parse_actions(cls, actions: Any) -> Any:
+        return _parse_actions(actions)
+
+    @property
+    def key(self) -> str:
+        return self.name or f"device_{self.device_index}"
+
+
 class Config(BaseModel):
     timezone: ZoneInfo
     sleep_interval_seconds: int = 300
+    poll_intervals: PollIntervals = PollIntervals()
     viessmann_creds: ViessmannCreds
     device_index: int = 0
     number_of_burners: int = 1
-
-    actions: list[Union[DomoticzActionConfig, HomeAssistantActionConfig]] = []
+    # How long a snapshot of the device's features is reused before it is fetched again.
+    # Should be shorter than the shortest poll interval, so that every poll gets fresh data
+    features_cache_ttl_seconds: int = 30
+    # File (SQLite) where the consumption state is saved, so that restarts don't need a full sync.
+    # Set to null to disable
+    state_file: Optional[str] = "state.db"
+    # File (JSON) where the devices found in the Viessmann account are saved, so that restarts
+    # don't need to list them again. Delete it if the devices change. Set to null to disable
+    device_cache_file: Optional[str] = "devices.json"
+    # File where every features response is recorded, to be replayed later with
+    # `python -m viessmann_bridge.replay`. Set to null to disable
+    recording_file: Optional[str] = None
+    change_suppression: ChangeSuppressionConfig = ChangeSuppressionConfig()
+    api_budget: ApiBudgetConfig = ApiBudgetConfig()
+    metrics: MetricsConfig = MetricsConfig()
+    # Local HTTP API serving the latest data of the devices
+    local_api: LocalApiConfig = LocalApiConfig()
+    logging: LoggingConfig = LoggingConfig()
+
+    # Additional actions, as "module:attribute" paths of ActionPlugins (or modules registering
+    # their actions when imported). Installed packages can also provide them with entry points
+    plugins: list[str] = []
+
+    actions: ActionConfigs = []
+
+    # Multiple heating devices, each with its own actions. If empty, a single device
+    # is configured with device_index, number_of_burners and actions above
+    devices: list[DeviceConfig] = []
+
+    @model_validator(mode="before")
+    @classmethod
+    def _load_plugins(cls, data: Any) -> Any:
+        # The plugins have to be registered before the actions using them are parsed
+        if isinstance(data, dict):
+            load_plugins(data.get("plugins") or [])
+        return data
+
+    @field_validator("actions", mode="before")
+    @classmethod
+    def _parse_actions(cls, actions: Any) -> Any:
+        return _parse_actions(actions)
+
+    @model_validator(mode="after")
+    def _default_timezones(self) -> "Config":
+        # The actions working with days get the timezone of the bridge, unless they have their own
+        for device in self.get_devices():
+            for action in device.actions:
+                if (
+                    isinstance(
+                        action, (HomeAssistantActionConfig, TimeSeriesActionConfig)
+                    )
+                    and action.timezone is None
+                ):
+                    action.timezone = self.timezone
+        return self
+
+    def get_devices(self) -> list[DeviceConfig]:
+        if self.devices:
+            return self.devices
+
+        return [
+            DeviceConfig(
+                device_index=self.device_index,
+                number_of_burners=self.number_of_burners,
+                actions=self.actions,
+            )
+        ]
 
 
 GlobalConfig: Optional[Config] = None
 GlobalActions: list[Action] = []
+# Device key -> actions of the device
+GlobalDeviceActions: dict[str, list[Action]] = {}
 
 
 def get_config() -> Config:
@@ -40,13 +167,37 @@ def get_config() -> Config:
     return GlobalConfig
 
 
-def get_actions() -> list[Action]:
-    if not GlobalActions:
-        raise ValueError("Actions not loaded")
-    return GlobalActions
+def get_device_actions(device: DeviceConfig) -> list[Action]:
+    if device.key not in GlobalDeviceActions:
+        raise ValueError(f"Actions of device {device.key} not loaded")
+    return GlobalDeviceActions[device.key]
+
+
+async def close_actions() -> None:
+    for action in GlobalActions:
+        try:
+            await action.close()
+        except Exception as e:
+            logger.error(f"Failed to close action {type(action)}: {e}")
+            logger.exception(e)
+
+
+async def init_actions() -> None:
+    """
+    Initialize all the loaded actions at once
+    """
+
+    async def init_action(action: Action) -> None:
+        await action.init()
+        logger.info(f"Action {type(action)} initialized")
+
+    await asyncio.gather(*[init_action(action) for action in GlobalActions])
 
 
 async def load_config() -> Config:
+    """
+    Load the config and create the actions - they have to be initialized with init_actions
+    """
     global GlobalConfig
 
     if GlobalConfig is not None:
@@ -56,25 +207,32 @@ async def load_config() -> Config:
         with open("config.yaml", "r") as f:
             config = parse_yaml_raw_as(Config, f.read())
             GlobalConfig = config
+            configure_logging(config.logging)
 
-            for action in GlobalConfig.actions:
-                new_action: Optional[Action] = None
+            for device in GlobalConfig.get_devices():
+                device_actions = GlobalDeviceActions.setdefault(device.key, [])
 
-                if isinstance(action, DomoticzActionConfig):
-                    new_action = Domoticz(action)
-                elif isinstance(action, HomeAssistantActionConfig):
-                    new_action = HomeAssistant(action)
+                for action in device.actions:
+                    # The action's module is only imported here, if any device uses it
+                    new_action = create_action(action)
 
-                if new_action is not None:
                     GlobalActions.append(new_action)
-                    logger.info(f"Added action: {type(new_action)}")
-
-                    await new_action.init()
-                    logger.info(f"Action {type(new_action)} initialized")
-                else:
-                    logger.warning(f"Unknown action type: {action.action_type}")
-
-            logger.info("Config loaded")
+                    device_actions.append(new_action)
+                    logger.info(f"Added action for {device.key}: {new_action.sink}")
+
+                # Named the same way as the actions' workers in the dispatcher
+                for new_action, name in zip(
+                    device_actions, worker_names(device_actions)
+                ):
+                    instrument_action(new_action, device.key, name)
+
+            logger.info(
+                "Config loaded. Actions imported in: "
+                + ", ".join(
+                    f"{action_type} {seconds * 1000:.0f}ms"
+                    for action_type, seconds in import_times().items()
+                )
+            )
             return config
     except FileNotFoundError as e:
         logger.error("Config file not found")
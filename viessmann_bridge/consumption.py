@@ -1,7 +1,13 @@
+import copy
+from array import array
+from collections import deque
 from datetime import date, datetime
 from typing import Optional
 from pydantic import BaseModel
 
+# How many of the last consumption snapshots every device keeps
+HISTORY_SIZE = 8
+
 
 class Consumption(BaseModel):
     timestamp: datetime
@@ -17,11 +23,231 @@ class Consumption(BaseModel):
     year_readat: datetime
 
 
-class ConsumptionContext:
-    gas_consumption: Optional[Consumption] = None
-    total_consumption: int = 0
-    previous_total_consumption: int = (
-        0  # TODO: Maybe fetch it from Domoticz or something?
+class ConsumptionSnapshot:
+    """
+    The consumption arrays of a single poll, stored as arrays of integers with their sums
+    computed once, so that comparing two snapshots doesn't need to sum them again.
+
+    The first value of every array is the current period (today, this week, ...),
+    the next ones are the previous periods.
+
+    Args:
+        day_date (date): Date of the first daily value
+        day, week, month, year (list[int]): Consumption in the periods
+    """
+
+    __slots__ = (
+        "day_date",
+        "day",
+        "week",
+        "month",
+        "year",
+        "day_total",
+        "year_total",
     )
-    previous_consumption_daily: list[int] = []
-    previous_consumption_date: Optional[date] = None
+
+    def __init__(
+        self,
+        day_date: date,
+        day: list[int],
+        week: Optional[list[int]] = None,
+        month: Optional[list[int]] = None,
+        year: Optional[list[int]] = None,
+    ) -> None:
+        self.day_date = day_date
+        self.day = array("q", day)
+        self.week = array("q", week or [])
+        self.month = array("q", month or [])
+        self.year = array("q", year or [])
+
+        self.day_total = sum(self.day)
+        self.year_total = sum(self.year)
+
+    @classmethod
+    def from_consumption(cls, consumption: Consumption) -> "ConsumptionSnapshot":
+        return cls(
+            consumption.day_readat.date(),
+            consumption.day,
+            consumption.week,
+            consumption.month,
+            consumption.year,
+        )
+
+
+class ConsumptionDiff:
+    """
+    What changed between two consecutive snapshots
+
+    Args:
+        shifted (bool): Whether a new day started, so the daily values moved by one place
+        consistent (bool): Whether the past days match - if not, the data is nonsense
+            (e.g. the daily values weren't updated by the device) and shouldn't be used
+        changed_days (list[int]): Indexes of the new daily values which differ from the same days before
+        delta (int): How much the counter grew - the change of the known days, plus today if it's new
+        previous_day_delta (int): How much the previous day's value grew (only if shifted)
+    """
+
+    __slots__ = (
+        "shifted",
+        "consistent",
+        "changed_days",
+        "delta",
+        "previous_day_delta",
+    )
+
+    def __init__(
+        self,
+        shifted: bool,
+        consistent: bool,
+        changed_days: list[int],
+        delta: int,
+        previous_day_delta: int = 0,
+    ) -> None:
+        self.shifted = shifted
+        self.consistent = consistent
+        self.changed_days = changed_days
+        self.delta = delta
+        self.previous_day_delta = previous_day_delta
+
+    def __repr__(self) -> str:
+        return (
+            f"ConsumptionDiff(shifted={self.shifted}, consistent={self.consistent}, "
+            f"changed_days={self.changed_days}, delta={self.delta}, "
+            f"previous_day_delta={self.previous_day_delta})"
+        )
+
+
+class ConsumptionHistory:
+    """
+    The last snapshots of the consumption, oldest first, with the older ones dropped
+
+    Args:
+        size (int): How many snapshots are kept
+    """
+
+    def __init__(self, size: int = HISTORY_SIZE) -> None:
+        self._snapshots: deque[ConsumptionSnapshot] = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._snapshots)
+
+    def __iter__(self):
+        return iter(self._snapshots)
+
+    def __copy__(self) -> "ConsumptionHistory":
+        # The snapshots are never modified, so they can be shared
+        history = ConsumptionHistory(self._snapshots.maxlen or HISTORY_SIZE)
+        history._snapshots.extend(self._snapshots)
+        return history
+
+    @property
+    def latest(self) -> Optional[ConsumptionSnapshot]:
+        return self._snapshots[-1] if self._snapshots else None
+
+    def append(self, snapshot: ConsumptionSnapshot) -> None:
+        self._snapshots.append(snapshot)
+
+    def restore(self, day_date: date, day: list[int]) -> None:
+        """
+        Start over from the daily values saved before (e.g. in the state journal)
+        """
+        self._snapshots.clear()
+        self._snapshots.append(ConsumptionSnapshot(day_date, day))
+
+    def clear(self) -> None:
+        self._snapshots.clear()
+
+    def missed_consumption(self, snapshot: ConsumptionSnapshot) -> int:
+        """
+        Consumption since the latest snapshot, when the days in between weren't polled.
+
+        The latest snapshot's day only grew since, while the days after it are all new.
+        If it's older than the daily values reach, only their sum is known.
+
+        Returns:
+            int: The consumption since the latest snapshot, 0 if there's no snapshot yet
+        """
+        previous = self.latest
+        if previous is None:
+            return 0
+
+        days = (snapshot.day_date - previous.day_date).days
+        if days >= len(snapshot.day) or not previous.day:
+            return snapshot.day_total
+
+        return max(0, snapshot.day[days] - previous.day[0]) + sum(snapshot.day[:days])
+
+    def diff(self, snapshot: ConsumptionSnapshot) -> Optional[ConsumptionDiff]:
+        """
+        Compare the snapshot with the latest one, without adding it
+
+        Returns:
+            Optional[ConsumptionDiff]: What changed, or None if there's no snapshot yet
+        """
+        previous = self.latest
+        if previous is None:
+            return None
+
+        old, new = previous.day, snapshot.day
+
+        # The last values are for days long gone, so they only move if a new day started
+        shifted = not (
+            previous.day_date == snapshot.day_date and old[-6:-1] == new[-6:-1]
+        )
+
+        # Either the past days are the same, or they moved by one place as a new day started
+        consistent = len(old) <= 1 or old[1:] == new[1:] or old[1:-1] == new[2:]
+
+        if not shifted:
+            changed_days = [
+                i for i in range(min(len(old), len(new))) if old[i] != new[i]
+            ]
+            return ConsumptionDiff(
+                shifted,
+                consistent,
+                changed_days,
+                snapshot.day_total - previous.day_total,
+            )
+
+        # Today's value is new and yesterday's is the previous "today". The oldest value dropped out
+        changed_days = [0] + [
+            i for i in range(1, min(len(old) + 1, len(new))) if old[i - 1] != new[i]
+        ]
+        dropped = sum(old[max(len(new) - 1, 0) :])
+        previous_day_delta = new[1] - old[0] if len(new) > 1 and old else 0
+
+        return ConsumptionDiff(
+            shifted,
+            consistent,
+            changed_days,
+            snapshot.day_total - (previous.day_total - dropped),
+            previous_day_delta,
+        )
+
+
+class ConsumptionContext:
+    def __init__(self) -> None:
+        # Instance attributes, so that every device has its own state
+        self.gas_consumption: Optional[Consumption] = None
+        self.total_consumption: int = 0
+        self.previous_total_consumption: int = (
+            0  # TODO: Maybe fetch it from Domoticz or something?
+        )
+        # The last handled snapshots - the latest one is the "previous" state
+        self.history = ConsumptionHistory()
+
+    def __copy__(self) -> "ConsumptionContext":
+        ctx = ConsumptionContext()
+        ctx.__dict__.update(self.__dict__)
+        ctx.history = copy.copy(self.history)
+        return ctx
+
+    @property
+    def previous_consumption_daily(self) -> list[int]:
+        latest = self.history.latest
+        return latest.day.tolist() if latest is not None else []
+
+    @property
+    def previous_consumption_date(self) -> Optional[date]:
+        latest = self.history.latest
+        return latest.day_date if latest is not None else None
@@ -1,17 +1,111 @@
+import threading
+import time
 from datetime import datetime
+from typing import Any, Optional
+
 from PyViCare.PyViCareGazBoiler import GazBoiler
-from PyViCare.PyViCareService import ViCareService
+from PyViCare.PyViCareUtils import (
+    PyViCareInvalidDataError,
+    PyViCareNotSupportedFeatureError,
+)
 
 from viessmann_bridge.consumption import Consumption
+from viessmann_bridge.logger import logger
 from viessmann_bridge.utils import parse_time
 
 
+class FeatureSnapshot:
+    """
+    All the features of the device, fetched with a single API call
+    """
+
+    def __init__(self, raw_features: dict, fetched_at: float) -> None:
+        self.fetched_at = fetched_at
+        self.features: dict[str, Any] = {
+            feature["feature"]: feature for feature in raw_features["data"]
+        }
+
+    def get_property(self, property_name: str) -> Any:
+        feature = self.features.get(property_name)
+
+        if feature is None:
+            raise PyViCareNotSupportedFeatureError(property_name)
+
+        return feature
+
+
 class Device(GazBoiler):
-    def __init__(self, boiler: GazBoiler) -> None:
+    def __init__(self, boiler: GazBoiler, snapshot_ttl_seconds: float = 30) -> None:
         super().__init__(boiler.service)
 
+        self.snapshot_ttl_seconds = snapshot_ttl_seconds
+        self._snapshot: Optional[FeatureSnapshot] = None
+        # The getters can be called from multiple threads at once, but only one of them should fetch
+        self._snapshot_lock = threading.Lock()
+
+        self.snapshot_hits = 0
+        self.snapshot_misses = 0
+
+    def get_snapshot(self) -> FeatureSnapshot:
+        """
+        Get the features snapshot, fetching all the features of the device
+        with one request if there's no snapshot yet or it is older than the TTL
+        """
+        with self._snapshot_lock:
+            return self._get_or_fetch_snapshot()
+
+    def _get_or_fetch_snapshot(self) -> FeatureSnapshot:
+        now = time.monotonic()
+
+        if (
+            self._snapshot is not None
+            and now - self._snapshot.fetched_at < self.snapshot_ttl_seconds
+        ):
+            self.snapshot_hits += 1
+            return self._snapshot
+
+        self.snapshot_misses += 1
+
+        raw_features = self.service.fetch_all_features()
+        if "data" not in raw_features:
+            raise PyViCareInvalidDataError(raw_features)
+
+        self._snapshot = FeatureSnapshot(raw_features, now)
+        logger.debug(
+            "Fetched features snapshot (%s features, hits: %s, misses: %s)",
+            len(self._snapshot.features),
+            self.snapshot_hits,
+            self.snapshot_misses,
+        )
+
+        return self._snapshot
+
+    def invalidate_snapshot(self) -> None:
+        """
+        Drop the current snapshot, so that the next getter fetches fresh data
+        """
+        self._snapshot = None
+
+    def get_property(self, property_name: str) -> Any:
+        return self.get_snapshot().get_property(property_name)
+
+    def get_feature_timestamp(self, *property_names: str) -> Optional[datetime]:
+        """
+        Get when Viessmann last updated the features - the latest of their timestamps
+
+        Returns:
+            Optional[datetime]: The timestamp, or None if none of the features has it
+        """
+        timestamps = [
+            datetime.fromisoformat(raw_timestamp.replace("Z", "+00:00"))
+            for property_name in property_names
+            if (raw_timestamp := self.get_property(property_name).get("timestamp"))
+        ]
+
+        return max(timestamps, default=None)
+
     def get_gas_usage(self):
-        raw_consumption = self.service.getProperty("heating.gas.consumption.total")
+        raw_consumption = self.get_property("heating.gas.consumption.total")
 
         consumption_parsed = Consumption(
             timestamp=datetime.fromisoformat(
@@ -41,10 +135,11 @@ class Device(GazBoiler):
         modulations: list[int] = []
 
         for i in range(number_of_burners):
-            raw_modulation = self.service.getProperty(f"heating.burners.{i}.modulation")
+            raw_modulation = self.get_property(f"heating.burners.{i}.modulation")
             modulations.append(raw_modulation["properties"]["value"]["value"])
 
         return modulations
 
     def get_boiler_temperature(self) -> float:
-        return self.getBoilerTemperature()
+        raw_temperature = self.get_property("heating.boiler.sensors.temperature.main")
+        return raw_temperature["properties"]["value"]["value"]
@@ -0,0 +1,305 @@
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+
+from viessmann_bridge.action import Action
+from viessmann_bridge.change_filter import ChangeFilter
+from viessmann_bridge.logger import logger
+from viessmann_bridge.outbox import NotDelivered
+
+ActionCall = Callable[[Action], Awaitable[None]]
+
+# How many updates can wait for a single action - the oldest droppable ones are dropped beyond that
+MAX_PENDING_UPDATES = 100
+
+# Kind of the update ending a poll cycle (see Action.end_cycle)
+END_CYCLE = "end_cycle"
+
+
+def worker_names(actions: list[Action]) -> list[str]:
+    """
+    Names of the actions' workers - the actions' sinks, numbered if the same sink is used twice
+    """
+    names: list[str] = []
+    used: dict[str, int] = {}
+    for action in actions:
+        used[action.sink] = used.get(action.sink, 0) + 1
+        names.append(
+            action.sink
+            if used[action.sink] == 1
+            else f"{action.sink} #{used[action.sink]}"
+        )
+    return names
+
+
+class ActionUpdate:
+    def __init__(
+        self, kind: str, call: ActionCall, coalesce: bool, future: asyncio.Future
+    ) -> None:
+        self.kind = kind
+        self.call = call
+        self.coalesce = coalesce
+        self.future = future
+
+    @property
+    def droppable(self) -> bool:
+        """
+        Whether the update can be dropped when the action is too far behind - the latest values
+        and the ends of the cycles can, the updates of the counters (e.g. the increases) can't
+        """
+        return self.coalesce or self.kind == END_CYCLE
+
+
+class ActionWorker:
+    """
+    Runs the updates of a single action one after another, in the order they were submitted.
+
+    Pending updates marked as coalescing (e.g. the boiler temperature) are replaced
+    by the latest value of the same kind, so that a slow action doesn't pile up stale values.
+    If the action is down, at most `max_pending` updates are kept - the oldest droppable ones
+    are dropped. The updates of the counters are never dropped, so the queue can grow beyond that.
+    """
+
+    def __init__(
+        self,
+        action: Action,
+        name: str,
+        on_success: Optional[Callable[[], None]] = None,
+        max_pending: int = MAX_PENDING_UPDATES,
+    ) -> None:
+        self.action = action
+        self.name = name
+        self.max_pending = max_pending
+        self.coalesced = 0
+        self.dropped = 0
+        # Called after every update the action handled successfully
+        self._on_success = on_success
+
+        self._pending: deque[ActionUpdate] = deque()
+        self._has_pending = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(
+                self._run(), name=f"action-worker-{type(self.action).__name__}"
+            )
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def submit(
+        self, kind: str, call: ActionCall, coalesce: bool
+    ) -> tuple[asyncio.Future, bool]:
+        """
+        Queue an update for the action
+
+        Returns:
+            tuple[asyncio.Future, bool]: Future resolving to whether the action handled the update
+                successfully, and whether the update is a new one - False if it replaced a pending one,
+                whose future is returned
+        """
+        if coalesce:
+            for update in self._pending:
+                if update.coalesce and update.kind == kind:
+                    # The action hasn't handled the previous value yet - just replace it
+                    update.call = call
+                    self.coalesced += 1
+                    return update.future, False
+
+        update = ActionUpdate(
+            kind, call, coalesce, asyncio.get_running_loop().create_future()
+        )
+        if len(self._pending) >= self.max_pending:
+            self._drop_oldest()
+
+        self._pending.append(update)
+        self._idle.clear()
+        self._has_pending.set()
+
+        return update.future, True
+
+    def _drop_oldest(self) -> None:
+        dropped = next((update for update in self._pending if update.droppable), None)
+
+        if dropped is None:
+            # Warned once for every max_pending updates, not for each of them
+            if len(self._pending) % self.max_pending == 0:
+                logger.warning(
+                    f"Action {self.name} is {len(self._pending)} updates behind, none of them can be dropped"
+                )
+            return
+
+        self._pending.remove(dropped)
+        dropped.future.set_result(False)
+        self.dropped += 1
+        logger.warning(
+            f"Action {self.name} is {self.max_pending} updates behind, dropped the oldest droppable one ({dropped.kind})"
+        )
+
+    @property
+    def is_idle(self) -> bool:
+        return self._idle.is_set()
+
+    async def wait_idle(self) -> None:
+        await self._idle.wait()
+
+    async def _run(self) -> None:
+        while True:
+            await self._has_pending.wait()
+
+            while self._pending:
+                update = self._pending.popleft()
+                success = False
+
+                try:
+                    await update.call(self.action)
+                    success = True
+
+                    if self._on_success is not None:
+                        self._on_success()
+                except NotDelivered as e:
+                    # Already logged by the action, the writes are retried by its outbox
+                    logger.warning(
+                        f"Action {self.name} didn't deliver {update.kind}: {e}"
+                    )
+                except Exception as e:
+                    logger.error(
+                        f"Action {type(self.action)} failed to handle {update.kind}: {e}"
+                    )
+                    logger.exception(e)
+                finally:
+                    if not update.future.done():
+                        update.future.set_result(success)
+
+            self._has_pending.clear()
+            self._idle.set()
+
+
+class ActionDispatcher:
+    """
+    Fans the updates out to every action concurrently, each action having its own worker queue
+    """
+
+    def __init__(
+        self,
+        actions: list[Action],
+        change_filter: Optional[ChangeFilter] = None,
+        on_first_publish: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.change_filter = change_filter
+        self.workers = [
+            ActionWorker(action, name, self._published)
+            for action, name in zip(actions, worker_names(actions))
+        ]
+
+        # Called once, when any of the actions handles its first update
+        self._on_first_publish = on_first_publish
+        self.published = False
+
+        # Future of an update passed through the change filter -> the latest value it carries
+        self._values: dict[asyncio.Future, Any] = {}
+
+    def _published(self) -> None:
+        if self.published:
+            return
+
+        self.published = True
+        if self._on_first_publish is not None:
+            self._on_first_publish()
+
+    def start(self) -> None:
+        for worker in self.workers:
+            worker.start()
+
+    async def stop(self) -> None:
+        await asyncio.gather(*[worker.stop() for worker in self.workers])
+
+    def submit(
+        self,
+        kind: str,
+        call: ActionCall,
+        coalesce: bool = False,
+        value: Any = None,
+    ) -> list[asyncio.Future]:
+        """
+        Queue an update for every action
+
+        Args:
+            kind (str): Kind of the update, e.g. "boiler_temperature"
+            call (ActionCall): Function calling the action's method
+            coalesce (bool): Whether a pending update of the same kind can be replaced by this one
+            value (Any): Value of the update - if given, the update is skipped for the actions
+                which already got a value within the deadband of it
+
+        Returns:
+            list[asyncio.Future]: Results of the update, in the same order as the workers -
+                False for the actions the change filter skipped it for
+        """
+        change_filter = self.change_filter
+        futures: list[asyncio.Future] = []
+
+        for worker in self.workers:
+            if value is None or change_filter is None:
+                future, _ = worker.submit(kind, call, coalesce)
+                futures.append(future)
+                continue
+
+            if not change_filter.should_send(worker.name, kind, value):
+                # Not handled by the action, so e.g. the journal doesn't acknowledge it
+                future = asyncio.get_running_loop().create_future()
+                future.set_result(False)
+                futures.append(future)
+                continue
+
+            def on_done(future: asyncio.Future, sink: str = worker.name) -> None:
+                change_filter.delivered(
+                    sink,
+                    kind,
+                    self._values.pop(future),
+                    not future.cancelled() and future.result(),
+                )
+
+            future, created = worker.submit(kind, call, coalesce)
+            # A coalesced update is delivered once, with the value which replaced the pending one
+            self._values[future] = value
+            if created:
+                future.add_done_callback(on_done)
+            futures.append(future)
+
+        return futures
+
+    async def join(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every action handled all of its pending updates
+
+        Returns:
+            bool: False if the timeout has been reached before all actions finished
+        """
+        if all(worker.is_idle for worker in self.workers):
+            return True
+
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*[worker.wait_idle() for worker in self.workers]),
+                timeout,
+            )
+            return True
+        except asyncio.TimeoutError:
+            pending = [
+                type(worker.action).__name__
+                for worker in self.workers
+                if not worker.is_idle
+            ]
+            logger.warning(f"Actions still busy after {timeout}s: {pending}")
+            return False
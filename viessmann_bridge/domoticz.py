@@ -1,26 +1,317 @@
 import asyncio
 import base64
+import logging
+from contextvars import ContextVar
 from datetime import date, datetime, timedelta
 from math import floor
+from time import monotonic
+from typing import Any, Callable, Optional
 from urllib.parse import unquote_plus
 
-from viessmann_bridge.action import Action, DomoticzActionConfig
+from viessmann_bridge.action import Action, DomoticzActionConfig, DomoticzDevicesConfig
 from viessmann_bridge.consumption import ConsumptionContext
 from viessmann_bridge.logger import logger
 import aiohttp
 
+from viessmann_bridge.http_session import acquire_session, release_session
+from viessmann_bridge.outbox import (
+    NotDelivered,
+    Outbox,
+    WriteRejected,
+    acquire_outbox,
+    is_permanent_failure,
+    release_outbox,
+)
+from viessmann_bridge.rate_limiter import AdaptiveRateLimiter
 from viessmann_bridge.utils import gas_consumption_kwh_to_m3
 
 
-class Domoticz(Action):
+# Domoticz URL -> rate limiter, shared by the actions of all the devices
+_rate_limiters: dict[str, AdaptiveRateLimiter] = {}
+# Same for the backfilled history, which is paced separately
+_backfill_rate_limiters: dict[str, AdaptiveRateLimiter] = {}
+
+# Set while the requests of a backfill are being sent (in their own tasks)
+_backfilling: ContextVar[bool] = ContextVar("domoticz_backfilling", default=False)
+
+
+class DomoticzWrite:
+    """
+    A single update of a Domoticz device
+
+    Args:
+        params (dict): Parameters of the request
+        collapse (bool): Whether the write only sets the current value of the device,
+            so a newer write of the device can replace it while it's pending
+    """
+
+    __slots__ = ("params", "collapse")
+
+    def __init__(self, params: dict, collapse: bool = False) -> None:
+        self.params = params
+        self.collapse = collapse
+
+
+# Device idx -> its writes, which have to be sent in order. The devices are independent
+WriteChains = dict[int, list[DomoticzWrite]]
+
+
+def merge_chains(*chains: WriteChains) -> WriteChains:
+    """
+    Join the chains of the devices, keeping the order of the writes of every device
+    """
+    merged: WriteChains = {}
+    for device_chains in chains:
+        for idx, chain in device_chains.items():
+            merged.setdefault(idx, []).extend(chain)
+    return merged
+
+
+class DomoticzCounters:
+    """
+    Builds the updates of the Domoticz devices, shared by the actions feeding Domoticz
+    """
+
+    config: DomoticzDevicesConfig
+
+    def __init__(self, config: DomoticzDevicesConfig) -> None:
+        self.config = config
+
+    def _consumption_to_m3(self, consumption: int) -> int:
+        return floor(gas_consumption_kwh_to_m3(consumption))
+
+    def _udevice_params(self, idx: int, svalue: str) -> dict:
+        return {
+            "type": "command",
+            "param": "udevice",
+            "idx": idx,
+            "nvalue": 0,
+            "svalue": svalue,
+        }
+
+    def _daily_counter_values(
+        self, consumption_context: ConsumptionContext, consumption: dict[date, int]
+    ) -> list[tuple[date, int, int]]:
+        """
+        Compute the counter value at the end of each day, in a single pass.
+
+        Returns:
+            list[tuple[date, int, int]]: (day, total counter on that day, consumption on that day),
+                sorted by date ascending, without today
+        """
+        assert consumption_context.gas_consumption is not None
+
+        counter_values: list[tuple[date, int, int]] = []
+        consumption_after_this_day = 0
+        # The day of the readings, not of the host - they differ around the midnight
+        today = consumption_context.gas_consumption.day_readat.date()
+
+        # Go from the newest day, so that the consumption after each day is a running sum
+        for day, value in sorted(consumption.items(), reverse=True):
+            if day != today:
+                counter_values.append(
+                    (
+                        day,
+                        consumption_context.total_consumption
+                        - consumption_after_this_day,
+                        value,
+                    )
+                )
+
+            consumption_after_this_day += value
+
+        counter_values.reverse()
+        return counter_values
+
+    def _plan_daily_consumption_writes(
+        self,
+        counter_values: list[tuple[date, int, int]],
+        up_to_date_days: Optional[dict[int, set[date]]] = None,
+    ) -> WriteChains:
+        """
+        Build all the requests needed to store the daily history, grouped by device idx.
+
+        For each day, the daily value is written along with three 5-minute counter points
+        around the midnight, so that the short log of Domoticz is correct too.
+        The days which already hold the right values in Domoticz are skipped.
+        """
+        writes: WriteChains = {}
+        up_to_date_days = up_to_date_days or {}
+
+        for day, total_consumption_on_that_day, value in counter_values:
+            day_str = day.strftime("%Y-%m-%d")
+            base_time = datetime.combine(day, datetime.min.time())
+            times = [
+                (base_time + offset).strftime("%Y-%m-%d %H:%M:%S")
+                for offset in (
+                    timedelta(hours=23, minutes=55),
+                    timedelta(hours=24, minutes=0),
+                    timedelta(hours=24, minutes=5),
+                )
+            ]
+
+            if self.config.gas_consumption_kwh_idx is not None and day not in (
+                up_to_date_days.get(self.config.gas_consumption_kwh_idx, set())
+            ):
+                counter = str(total_consumption_on_that_day * 1000)
+                chain = writes.setdefault(self.config.gas_consumption_kwh_idx, [])
+
+                chain.append(
+                    DomoticzWrite(
+                        self._udevice_params(
+                            self.config.gas_consumption_kwh_idx,
+                            f"{counter};{value * 1000};{day_str}",
+                        )
+                    )
+                )
+                for time_str in times:
+                    chain.append(
+                        DomoticzWrite(
+                            self._udevice_params(
+                                self.config.gas_consumption_kwh_idx,
+                                f"{counter};0;{time_str}",
+                            )
+                        )
+                    )
+
+            if self.config.gas_consumption_m3_idx is not None and day not in (
+                up_to_date_days.get(self.config.gas_consumption_m3_idx, set())
+            ):
+                counter = str(
+                    self._consumption_to_m3(total_consumption_on_that_day * 1000)
+                )
+                chain = writes.setdefault(self.config.gas_consumption_m3_idx, [])
+
+                chain.append(
+                    DomoticzWrite(
+                        self._udevice_params(
+                            self.config.gas_consumption_m3_idx,
+                            f"{counter};{self._consumption_to_m3(value * 1000)};{day_str}",
+                        )
+                    )
+                )
+                for time_str in times:
+                    chain.append(
+                        DomoticzWrite(
+                            self._udevice_params(
+                                self.config.gas_consumption_m3_idx,
+                                f"{counter};0;{time_str}",
+                            )
+                        )
+                    )
+
+        return writes
+
+    def _plan_total_consumption_writes(self, total_consumption: int) -> WriteChains:
+        """
+        Set the counters to the total consumption, and add it to their 5-minute log
+        """
+        now_floor_5min = datetime.now().replace(second=0, microsecond=0)
+        now_floor_5min = now_floor_5min - timedelta(minutes=now_floor_5min.minute % 5)
+        time_str = now_floor_5min.strftime("%Y-%m-%d %H:%M:%S")
+
+        writes: WriteChains = {}
+        for idx, counter in (
+            (self.config.gas_consumption_kwh_idx, total_consumption * 1000),
+            (
+                self.config.gas_consumption_m3_idx,
+                self._consumption_to_m3(total_consumption * 1000),
+            ),
+        ):
+            if idx is not None:
+                writes[idx] = [
+                    DomoticzWrite(
+                        self._udevice_params(idx, str(counter)), collapse=True
+                    ),
+                    DomoticzWrite(self._udevice_params(idx, f"{counter};0;{time_str}")),
+                ]
+
+        return writes
+
+    def _plan_increasing_writes(self, consumption_increase_offset: int) -> WriteChains:
+        writes: WriteChains = {}
+        for idx, value in (
+            (
+                self.config.gas_consumption_kwh_increasing_idx,
+                consumption_increase_offset * 1000,
+            ),
+            (
+                self.config.gas_consumption_m3_increasing_idx,
+                self._consumption_to_m3(consumption_increase_offset * 1000),
+            ),
+        ):
+            if idx is not None:
+                writes[idx] = [DomoticzWrite(self._udevice_params(idx, str(value)))]
+
+        return writes
+
+    def _plan_burners_writes(self, modulations: list[int]) -> WriteChains:
+        return {
+            idx: [
+                DomoticzWrite(self._udevice_params(idx, str(modulation)), collapse=True)
+            ]
+            for idx, modulation in zip(self.config.burner_modulation_idxs, modulations)
+        }
+
+    def _plan_boiler_temperature_writes(self, temperature: float) -> WriteChains:
+        idx = self.config.boiler_temperature_idx
+        if idx is None:
+            return {}
+
+        return {
+            idx: [
+                DomoticzWrite(
+                    self._udevice_params(idx, str(temperature)), collapse=True
+                )
+            ]
+        }
+
+
+class Domoticz(Action, DomoticzCounters):
     config: DomoticzActionConfig
 
     def __init__(self, config: DomoticzActionConfig) -> None:
         self.config = config
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._outbox: Optional[Outbox] = None
+        self._sink = f"domoticz {config.name or config.domoticz_url}"
+
+        if config.domoticz_url not in _rate_limiters:
+            _rate_limiters[config.domoticz_url] = AdaptiveRateLimiter(
+                config.rate_limit, f"Domoticz {config.domoticz_url}"
+            )
+        self._rate_limiter = _rate_limiters[config.domoticz_url]
+
+        if config.domoticz_url not in _backfill_rate_limiters:
+            _backfill_rate_limiters[config.domoticz_url] = AdaptiveRateLimiter(
+                config.backfill_rate_limit, f"Domoticz {config.domoticz_url} backfill"
+            )
+        self._backfill_rate_limiter = _backfill_rate_limiters[config.domoticz_url]
 
     async def init(self) -> None:
+        self._get_session()
         await self._configure_gas_entries()
 
+        if self.config.outbox.path is not None:
+            self._outbox = acquire_outbox(self.config.outbox, self._sink, self._send)
+            # Replay the writes which couldn't be sent before the restart
+            await self._outbox.flush()
+
+    async def close(self) -> None:
+        if self._outbox is not None:
+            await release_outbox(self._sink, self._send)
+            self._outbox = None
+
+        if self._session is not None:
+            await release_session(self.config.domoticz_url)
+            self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Acquired only once - the shared session stays open until every action released it
+        if self._session is None:
+            self._session = acquire_session(self.config.domoticz_url, self.config.http)
+        return self._session
+
     async def _configure_gas_entries(self) -> None:
         """
         If we want the ability for the historical values to be editable,
@@ -28,248 +319,395 @@ class Domoticz(Action):
         (see: https://wiki.domoticz.com/Domoticz_API/JSON_URL's#Note_on_counters)
 
         Note that those devices have to be 'Counter' type.
+        All the devices are configured at once.
         """
-        for device in (
-            self.config.gas_consumption_kwh_idx,
-            self.config.gas_consumption_m3_idx,
-        ):
-            if device is None:
-                continue
+        await asyncio.gather(
+            *[
+                self._configure_gas_entry(device)
+                for device in (
+                    self.config.gas_consumption_kwh_idx,
+                    self.config.gas_consumption_m3_idx,
+                )
+                if device is not None
+            ]
+        )
 
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{self.config.domoticz_url}/json.htm",
-                    params={"type": "devices", "rid": device}
-                    if self.config.use_legacy_device_endpoint
-                    else {"type": "command", "param": "getdevices", "rid": device},
-                ) as response:
-                    if response.status == 200:
-                        device_state = await response.json()
-                        logger.debug(f"Device state: {device_state}")
-                    else:
-                        logger.error(
-                            f"Failed to request Domoticz {self.config.domoticz_url} when getting device status: {response.status}"
-                        )
+    async def _configure_gas_entry(self, device: int) -> None:
+        session = self._get_session()
+
+        async with session.get(
+            f"{self.config.domoticz_url}/json.htm",
+            params={"type": "devices", "rid": device}
+            if self.config.use_legacy_device_endpoint
+            else {"type": "command", "param": "getdevices", "rid": device},
+        ) as response:
+            if response.status == 200:
+                device_state = await response.json()
+                logger.debug("Device state: %s", device_state)
+            else:
+                logger.error(
+                    f"Failed to request Domoticz {self.config.domoticz_url} when getting device status: {response.status}"
+                )
+                return
+
+        # Now let's update the device to set
+        # AddDBLogEntry to true
+
+        async with session.get(
+            f"{self.config.domoticz_url}/json.htm",
+            params={
+                "type": "setused",
+                "idx": device,
+                "name": device_state["result"][0]["Name"],
+                "switchtype": device_state["result"][0]["SwitchTypeVal"],
+                "description": device_state["result"][0]["Description"],
+                "addjvalue": device_state["result"][0]["AddjValue"],
+                "addjvalue2": device_state["result"][0]["AddjValue2"],
+                "used": "true",
+                "options": base64.b64encode("AddDBLogEntry:true".encode()).decode(),
+            },
+        ) as response:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Requested %s", unquote_plus(str(response.request_info.real_url))
+                )
+            if response.status == 200:
+                logger.info(
+                    f"Updated device {device} with AddDBLogEntry: {await response.text()}"
+                )
+            else:
+                logger.error(
+                    f"Failed to request Domoticz {self.config.domoticz_url} when updating device: {response.status}"
+                )
 
-                # Now let's update the device to set
-                # AddDBLogEntry to true
-
-                async with session.get(
-                    f"{self.config.domoticz_url}/json.htm",
-                    params={
-                        "type": "setused",
-                        "idx": device,
-                        "name": device_state["result"][0]["Name"],
-                        "switchtype": device_state["result"][0]["SwitchTypeVal"],
-                        "description": device_state["result"][0]["Description"],
-                        "addjvalue": device_state["result"][0]["AddjValue"],
-                        "addjvalue2": device_state["result"][0]["AddjValue2"],
-                        "used": "true",
-                        "options": base64.b64encode(
-                            "AddDBLogEntry:true".encode()
-                        ).decode(),
-                    },
-                ) as response:
-                    logger.debug(unquote_plus(str(response.request_info.real_url)))
-                    if response.status == 200:
-                        logger.info(
-                            f"Updated device {device} with AddDBLogEntry: {await response.text()}"
-                        )
-                    else:
-                        logger.error(
-                            f"Failed to request Domoticz {self.config.domoticz_url} when updating device: {response.status}"
-                        )
+    async def _request(self, params: dict, collapse: bool = False) -> bool:
+        """
+        Write to Domoticz through the outbox, so that the write isn't lost if Domoticz is down
+
+        Args:
+            params (dict): Parameters of the request
+            collapse (bool): Whether the write only sets the current value of the device,
+                so a newer write of the device can replace it while it's pending
+
+        Returns:
+            bool: Whether the write has been delivered right away
+        """
+        if self._outbox is None:
+            try:
+                return await self._send(params)
+            except WriteRejected:
+                return False
 
-    async def _request(self, params: dict) -> None:
+        return await self._outbox.put(str(params["idx"]), params, collapse)
+
+    async def _send(self, params: dict) -> bool:
+        """
+        Send a request to Domoticz
+
+        Returns:
+            bool: Whether the request succeeded
+
+        Raises:
+            WriteRejected: If Domoticz refused the update (status ERR or HTTP 4xx)
+        """
         logger.debug(
-            f"Requesting Domoticz {self.config.domoticz_url} with params {params}"
+            "Requesting Domoticz %s with params %s", self.config.domoticz_url, params
+        )
+
+        # Paces the requests instead of sleeping after them - the limiter is FIFO,
+        # so the updates of a device are still applied in the order they were made
+        rate_limiter = (
+            self._backfill_rate_limiter if _backfilling.get() else self._rate_limiter
         )
+        await rate_limiter.acquire()
+
+        started_at = monotonic()
+        success = False
+        rejection: Optional[str] = None
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{self.config.domoticz_url}/json.htm", params=params
-                ) as response:
-                    logger.debug(unquote_plus(str(response.request_info.real_url)))
-
-                    if response.status == 200:
-                        logger.debug(f"Response: {await response.text()}")
+            async with self._get_session().get(
+                f"{self.config.domoticz_url}/json.htm", params=params
+            ) as response:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        "Requested %s",
+                        unquote_plus(str(response.request_info.real_url)),
+                    )
+
+                if response.status == 200:
+                    # Domoticz responds with 200 even if it refused the update (e.g. unknown idx)
+                    result = await response.json(content_type=None)
+                    if result.get("status") == "ERR":
+                        rejection = f"status ERR {result.get('message', '')}".strip()
                     else:
-                        logger.error(
-                            f"Failed to request Domoticz {self.config.domoticz_url}: {response.status}"
-                        )
+                        success = True
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug("Response: %s", result)
+                elif is_permanent_failure(response.status):
+                    rejection = f"HTTP {response.status}"
+                else:
+                    logger.error(
+                        f"Failed to request Domoticz {self.config.domoticz_url}: {response.status}"
+                    )
         except Exception as e:
             logger.error(f"Failed to request Domoticz: {e}")
             logger.exception(e)
+        finally:
+            # A refused update still got a response, so it doesn't slow the requests down
+            rate_limiter.record(
+                monotonic() - started_at, success or rejection is not None
+            )
 
-    def _consumption_to_m3(self, consumption: int) -> int:
-        return floor(gas_consumption_kwh_to_m3(consumption))
+        if rejection is not None:
+            logger.error(
+                f"Domoticz {self.config.domoticz_url} refused the update {params}: {rejection}"
+            )
+            raise WriteRejected(rejection)
 
-    async def update_current_total_consumption(
-        self,
-        consumption_context: ConsumptionContext,
-        total_consumption: int,
-        today: int,
-    ) -> None:
-        logger.debug(f"Updating current total consumption: {total_consumption}")
+        return success
 
-        now_floor_5min = datetime.now().replace(second=0, microsecond=0)
-        now_floor_5min = now_floor_5min - timedelta(minutes=now_floor_5min.minute % 5)
+    async def _get_json(self, params: dict) -> Optional[Any]:
+        """
+        Read data from Domoticz, paced the same way as the updates
 
+        Returns:
+            Optional[Any]: Parsed response or None if the request failed
+        """
+        await self._rate_limiter.acquire()
+
+        started_at = monotonic()
+        success = False
+
+        try:
+            async with self._get_session().get(
+                f"{self.config.domoticz_url}/json.htm", params=params
+            ) as response:
+                if response.status != 200:
+                    logger.error(
+                        f"Failed to read from Domoticz {self.config.domoticz_url}: {response.status}"
+                    )
+                    return None
+
+                data = await response.json(content_type=None)
+                success = True
+                return data
+        except Exception as e:
+            logger.error(f"Failed to read from Domoticz: {e}")
+            logger.exception(e)
+            return None
+        finally:
+            self._rate_limiter.record(monotonic() - started_at, success)
+
+    async def _get_counter_history(
+        self, idx: int
+    ) -> Optional[dict[date, tuple[float, Optional[float]]]]:
+        """
+        Get the daily history of a counter stored in Domoticz (the last month)
+
+        Returns:
+            Optional[dict[date, tuple[float, Optional[float]]]]: Day -> (consumption on that day,
+                counter value on that day if Domoticz provides it), or None if the history couldn't be read
+        """
+        params: dict = {"sensor": "counter", "idx": idx, "range": "month"}
+        if self.config.use_legacy_device_endpoint:
+            params["type"] = "graph"
+        else:
+            params.update({"type": "command", "param": "graph"})
+
+        data = await self._get_json(params)
+        if data is None or data.get("status", "OK") != "OK":
+            return None
+
+        history: dict[date, tuple[float, Optional[float]]] = {}
+
+        try:
+            for entry in data.get("result", []):
+                history[date.fromisoformat(entry["d"][:10])] = (
+                    float(entry["v"]),
+                    float(entry["c"]) if "c" in entry else None,
+                )
+        except (KeyError, ValueError) as e:
+            logger.error(f"Unexpected counter history of device {idx}: {e}")
+            return None
+
+        return history
+
+    async def _find_up_to_date_days(
+        self, counter_values: list[tuple[date, int, int]]
+    ) -> dict[int, set[date]]:
+        """
+        Compare the history stored in Domoticz with the computed daily values.
+
+        Returns:
+            dict[int, set[date]]: Device idx -> days which already hold the right values
+        """
+        divider = self.config.history_divider
+        tolerance = 1 / divider
+
+        # Device idx -> conversion of the consumption (in kWh) to the value stored by Domoticz
+        devices: list[tuple[int, Callable[[int], float]]] = []
         if self.config.gas_consumption_kwh_idx is not None:
-            await self._request(
-                {
-                    "type": "command",
-                    "param": "udevice",
-                    "idx": self.config.gas_consumption_kwh_idx,
-                    "nvalue": 0,
-                    "svalue": f"{str(total_consumption * 1000)}",
-                }
-            )
-            await asyncio.sleep(2)
-
-            await self._request(
-                {
-                    "type": "command",
-                    "param": "udevice",
-                    "idx": self.config.gas_consumption_kwh_idx,
-                    "nvalue": 0,
-                    "svalue": f"{str(total_consumption * 1000)};0;{now_floor_5min.strftime('%Y-%m-%d %H:%M:%S')}",
-                }
+            devices.append(
+                (
+                    self.config.gas_consumption_kwh_idx,
+                    lambda value: value * 1000 / divider,
+                )
             )
-
         if self.config.gas_consumption_m3_idx is not None:
-            await self._request(
-                {
-                    "type": "command",
-                    "param": "udevice",
-                    "idx": self.config.gas_consumption_m3_idx,
-                    "nvalue": 0,
-                    "svalue": f"{str(self._consumption_to_m3(total_consumption * 1000))}",
-                }
+            devices.append(
+                (
+                    self.config.gas_consumption_m3_idx,
+                    lambda value: self._consumption_to_m3(value * 1000) / divider,
+                )
             )
-            await asyncio.sleep(2)
-
-            await self._request(
-                {
-                    "type": "command",
-                    "param": "udevice",
-                    "idx": self.config.gas_consumption_m3_idx,
-                    "nvalue": 0,
-                    "svalue": f"{str(self._consumption_to_m3(total_consumption * 1000))};0;{now_floor_5min.strftime('%Y-%m-%d %H:%M:%S')}",
-                }
+
+        histories = await asyncio.gather(
+            *[self._get_counter_history(idx) for idx, _ in devices]
+        )
+
+        up_to_date_days: dict[int, set[date]] = {}
+
+        for (idx, convert), history in zip(devices, histories):
+            if history is None:
+                logger.warning(
+                    f"Couldn't read the history of device {idx}, writing all the days"
+                )
+                continue
+
+            days: set[date] = set()
+            for day, total_consumption_on_that_day, value in counter_values:
+                stored = history.get(day)
+                if stored is None:
+                    continue
+
+                stored_value, stored_counter = stored
+                if abs(stored_value - convert(value)) > tolerance:
+                    continue
+                if (
+                    stored_counter is not None
+                    and abs(stored_counter - convert(total_consumption_on_that_day))
+                    > tolerance
+                ):
+                    continue
+
+                days.add(day)
+
+            up_to_date_days[idx] = days
+            logger.info(
+                f"Device {idx}: {len(days)} of {len(counter_values)} days are already up to date in Domoticz"
             )
 
-            await asyncio.sleep(2)
+        return up_to_date_days
+
+    async def update_current_total_consumption(
+        self,
+        consumption_context: ConsumptionContext,
+        total_consumption: int,
+        today: int,
+    ) -> None:
+        logger.debug("Updating current total consumption: %s", total_consumption)
+
+        await self._send_chains(self._plan_total_consumption_writes(total_consumption))
 
-        logger.debug(f"Updated current total consumption: {total_consumption}")
+        logger.debug("Updated current total consumption: %s", total_consumption)
 
     async def update_current_total_consumption_increasing(
         self, consumption_context: ConsumptionContext, consumption_increase_offset: int
     ) -> None:
         logger.debug(
-            f"Updating current total consumption increasing: {consumption_increase_offset}"
+            "Updating current total consumption increasing: %s",
+            consumption_increase_offset,
         )
 
-        if self.config.gas_consumption_kwh_increasing_idx is not None:
-            await self._request(
-                {
-                    "type": "command",
-                    "param": "udevice",
-                    "idx": self.config.gas_consumption_kwh_increasing_idx,
-                    "nvalue": 0,
-                    "svalue": f"{str(consumption_increase_offset * 1000)}",
-                }
-            )
+        await self._send_chains(
+            self._plan_increasing_writes(consumption_increase_offset)
+        )
 
-        if self.config.gas_consumption_m3_increasing_idx is not None:
-            await self._request(
-                {
-                    "type": "command",
-                    "param": "udevice",
-                    "idx": self.config.gas_consumption_m3_increasing_idx,
-                    "nvalue": 0,
-                    "svalue": f"{str(self._consumption_to_m3(consumption_increase_offset * 1000))}",
-                }
-            )
+    async def _send_chains(
+        self,
+        chains: WriteChains,
+        name: Optional[str] = None,
+        concurrency: Optional[int] = None,
+        backfill: bool = False,
+    ) -> None:
+        """
+        Send the requests of each device idx in order, while the devices are handled concurrently,
+        so that the writes take as long as the longest chain (the rate limiter still paces them)
 
-    async def update_daily_consumption_stats(
-        self, consumption_context: ConsumptionContext, consumption: dict[date, int]
-    ):
-        logger.debug(f"Updating daily consumption stats: {consumption}")
+        Args:
+            chains (WriteChains): Requests to send, grouped by device idx
+            name (Optional[str]): Name of the batch, to log the progress of (for the large ones)
+            concurrency (Optional[int]): How many devices are written at the same time, all by default
+            backfill (bool): Whether the requests are paced by the backfill rate limit
 
-        # Sort the consumption by date ascending
-        consumption = dict(sorted(consumption.items()))
+        Raises:
+            NotDelivered: If any of the requests wasn't delivered (e.g. it's only kept in the outbox)
+        """
+        total = sum(len(chain) for chain in chains.values())
+        if total == 0:
+            return
 
-        for day, value in consumption.items():
-            if day == date.today():
-                continue
+        sent = 0
+        undelivered = 0
+        started_at = monotonic()
+        semaphore = asyncio.Semaphore(concurrency or len(chains))
+
+        async def send_chain(chain: list[DomoticzWrite]) -> None:
+            nonlocal sent, undelivered
 
-            consumption_after_this_day = sum(
-                [v for d, v in consumption.items() if d > day]
+            # Every chain runs in its own task, so the flag doesn't leak out of the batch
+            _backfilling.set(backfill)
+
+            async with semaphore:
+                for write in chain:
+                    # The rest of the chain is still stored, so that it's sent in order
+                    if not await self._request(write.params, write.collapse):
+                        undelivered += 1
+                    sent += 1
+
+                    if name is not None and sent % 10 == 0 and sent != total:
+                        logger.info(f"{name}: {sent}/{total} requests sent")
+
+        await asyncio.gather(*[send_chain(chain) for chain in chains.values()])
+
+        if name is not None:
+            logger.info(
+                f"{name}: sent {total} requests for {len(chains)} devices in {monotonic() - started_at:.2f}s"
             )
 
-            total_consumption_on_that_day = (
-                consumption_context.total_consumption - consumption_after_this_day
+        if undelivered > 0:
+            raise NotDelivered(
+                f"{undelivered} of {total} requests to Domoticz weren't delivered"
             )
 
-            base_time = datetime.combine(day, datetime.min.time())
-            times = [
-                base_time + timedelta(hours=23, minutes=55),
-                base_time + timedelta(hours=24, minutes=0),
-                base_time + timedelta(hours=24, minutes=5),
-            ]
+    async def _plan_daily_consumption_stats(
+        self, consumption_context: ConsumptionContext, consumption: dict[date, int]
+    ) -> WriteChains:
+        counter_values = self._daily_counter_values(consumption_context, consumption)
 
-            if self.config.gas_consumption_kwh_idx is not None:
-                await self._request(
-                    {
-                        "type": "command",
-                        "param": "udevice",
-                        "idx": self.config.gas_consumption_kwh_idx,
-                        "nvalue": 0,
-                        "svalue": f"{str(total_consumption_on_that_day * 1000)};{value * 1000};{day.strftime('%Y-%m-%d')}",
-                    }
-                )
-                await asyncio.sleep(2)
-                for time in times:
-                    time_str = time.strftime("%Y-%m-%d %H:%M:%S")
-                    await self._request(
-                        {
-                            "type": "command",
-                            "param": "udevice",
-                            "idx": self.config.gas_consumption_kwh_idx,
-                            "nvalue": 0,
-                            "svalue": f"{str(total_consumption_on_that_day * 1000)};0;{time_str}",
-                        }
-                    )
-                    await asyncio.sleep(2)
-
-            if self.config.gas_consumption_m3_idx is not None:
-                await self._request(
-                    {
-                        "type": "command",
-                        "param": "udevice",
-                        "idx": self.config.gas_consumption_m3_idx,
-                        "nvalue": 0,
-                        "svalue": f"{str(self._consumption_to_m3(total_consumption_on_that_day * 1000))};{self._consumption_to_m3(value * 1000)};{day.strftime('%Y-%m-%d')}",
-                    }
-                )
-                await asyncio.sleep(2)
-
-                for time in times:
-                    time_str = time.strftime("%Y-%m-%d %H:%M:%S")
-                    await self._request(
-                        {
-                            "type": "command",
-                            "param": "udevice",
-                            "idx": self.config.gas_consumption_m3_idx,
-                            "nvalue": 0,
-                            "svalue": f"{str(self._consumption_to_m3(total_consumption_on_that_day * 1000))};0;{time_str}",
-                        }
-                    )
-                    await asyncio.sleep(2)
+        up_to_date_days: dict[int, set[date]] = {}
+        if self.config.reconcile_history:
+            up_to_date_days = await self._find_up_to_date_days(counter_values)
+
+        return self._plan_daily_consumption_writes(counter_values, up_to_date_days)
+
+    async def update_daily_consumption_stats(
+        self, consumption_context: ConsumptionContext, consumption: dict[date, int]
+    ):
+        logger.debug("Updating daily consumption stats: %s", consumption)
+
+        writes = await self._plan_daily_consumption_stats(
+            consumption_context, consumption
+        )
+        await self._send_chains(
+            writes,
+            "Daily consumption stats",
+            self.config.backfill_concurrency,
+            backfill=True,
+        )
 
-        logger.debug(f"Updated daily consumption stats: {consumption}")
+        logger.debug("Updated daily consumption stats: %s", consumption)
 
     async def handle_consumption_midnight_case(
         self,
@@ -279,13 +717,19 @@ class Domoticz(Action):
         current_day_value: int,
         total_counter: int,
     ):
-        logger.debug(f"""
+        logger.debug(
+            """
 Handling midnight case with the following values:
-    previous_day_new_value: {previous_day_new_value},
-    offset_previous_day: {offset_previous_day},
-    current_day_value: {current_day_value},
-    total_counter: {total_counter}
-""")
+    previous_day_new_value: %s,
+    offset_previous_day: %s,
+    current_day_value: %s,
+    total_counter: %s
+""",
+            previous_day_new_value,
+            offset_previous_day,
+            current_day_value,
+            total_counter,
+        )
 
         # Convert the array of daily values to a dictionary with dates
         # The day_readat is the date of the last value in the array
@@ -298,56 +742,38 @@ Handling midnight case with the following values:
             for i in range(len(consumption_context.gas_consumption.day))
         }
 
-        logger.debug(f"Daily values: {daily_values}")
-
-        await self.update_daily_consumption_stats(consumption_context, daily_values)
+        logger.debug("Daily values: %s", daily_values)
 
         assert consumption_context.previous_consumption_date is not None
 
-        await self.update_current_total_consumption(
-            consumption_context, total_counter, current_day_value
-        )
-        await self.update_current_total_consumption_increasing(
-            consumption_context,
-            total_counter - consumption_context.previous_total_consumption,
+        # The history goes first and the current counter after it, for every device.
+        # The increasing counters are separate devices, written at the same time
+        writes = merge_chains(
+            await self._plan_daily_consumption_stats(consumption_context, daily_values),
+            self._plan_total_consumption_writes(total_counter),
+            self._plan_increasing_writes(
+                total_counter - consumption_context.previous_total_consumption
+            ),
         )
+        # Mostly the rewritten history, so it's paced like the backfill
+        await self._send_chains(writes, "Midnight consumption update", backfill=True)
 
         logger.debug("Handled midnight case")
 
-    async def handle_burners_modulations(self, modulations: list[int]) -> None:
-        logger.debug(f"Handling burners modulations: {modulations}%")
-
-        if self.config.burner_modulation_idxs is not None:
-            for idx, modulation in zip(self.config.burner_modulation_idxs, modulations):
-                if idx is not None:
-                    await self._request(
-                        {
-                            "type": "command",
-                            "param": "udevice",
-                            "idx": idx,
-                            "nvalue": 0,
-                            "svalue": str(modulation),
-                        }
-                    )
-                else:
-                    logger.warning(
-                        f"Skipping burners modulation update for index {idx}"
-                    )
+    async def handle_burners_modulations(
+        self, modulations: list[int], timestamp: Optional[datetime] = None
+    ) -> None:
+        logger.debug("Handling burners modulations: %s%%", modulations)
+
+        await self._send_chains(self._plan_burners_writes(modulations))
 
         logger.debug("Handled burners modulations")
 
-    async def handle_boiler_temperature(self, temperature: float) -> None:
-        logger.debug(f"Handling boiler temperature: {temperature}°C")
-
-        if self.config.boiler_temperature_idx is not None:
-            await self._request(
-                {
-                    "type": "command",
-                    "param": "udevice",
-                    "idx": self.config.boiler_temperature_idx,
-                    "nvalue": 0,
-                    "svalue": str(temperature),
-                }
-            )
+    async def handle_boiler_temperature(
+        self, temperature: float, timestamp: Optional[datetime] = None
+    ) -> None:
+        logger.debug("Handling boiler temperature: %s°C", temperature)
+
+        await self._send_chains(self._plan_boiler_temperature_writes(temperature))
 
         logger.debug("Handled boiler temperature")
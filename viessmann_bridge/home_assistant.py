@@ -1,10 +1,26 @@
-from datetime import date
+import asyncio
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import Optional
 from urllib.parse import unquote_plus
+from zoneinfo import ZoneInfo
 import aiohttp
 from viessmann_bridge.logger import logger
-from viessmann_bridge.action import Action
-from viessmann_bridge.config import HomeAssistantActionConfig
+from viessmann_bridge.action import Action, HomeAssistantActionConfig
 from viessmann_bridge.consumption import ConsumptionContext
+from viessmann_bridge.home_assistant_ws import (
+    HomeAssistantCommandError,
+    HomeAssistantWebSocket,
+)
+from viessmann_bridge.http_session import acquire_session, release_session
+from viessmann_bridge.outbox import (
+    NotDelivered,
+    Outbox,
+    WriteRejected,
+    acquire_outbox,
+    is_permanent_failure,
+    release_outbox,
+)
 
 
 class HomeAssistant(Action):
@@ -12,44 +28,209 @@ class HomeAssistant(Action):
 
     def __init__(self, config: HomeAssistantActionConfig) -> None:
         self.config = config
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._outbox: Optional[Outbox] = None
+        self._sink = f"home_assistant {config.name or config.home_assistant_url}"
+        self._timezone = config.timezone or ZoneInfo("UTC")
+        self._ws: Optional[HomeAssistantWebSocket] = None
+
+        # Start of the statistics bucket -> (consumption in the bucket, total counter at its end),
+        # as the last import sent them
+        self._imported_statistics: dict[datetime, tuple[int, int]] = {}
+
+        # The session might be shared with other actions, so the token is sent with each request
+        self._headers = {"Authorization": f"Bearer {self.config.token}"}
 
     async def init(self) -> None:
-        pass
+        self._get_session()
+
+        if self.config.use_websocket:
+            self._ws = HomeAssistantWebSocket(
+                self.config.home_assistant_url,
+                self.config.token,
+                self._get_session,
+                command_timeout_seconds=self.config.websocket_command_timeout_seconds,
+            )
+            await self._check_entities()
+        elif self.config.statistic_id is not None:
+            logger.warning(
+                "The statistics can only be imported over WebSocket, enable use_websocket to import them"
+            )
+
+        if self.config.outbox.path is not None:
+            self._outbox = acquire_outbox(
+                self.config.outbox, self._sink, self._send_write
+            )
+            # Replay the writes which couldn't be sent before the restart
+            await self._outbox.flush()
+
+    async def close(self) -> None:
+        if self._ws is not None:
+            await self._ws.close()
+            self._ws = None
+
+        if self._outbox is not None:
+            await release_outbox(self._sink, self._send_write)
+            self._outbox = None
+
+        if self._session is not None:
+            await release_session(self.config.home_assistant_url)
+            self._session = None
+
+    def _entities(self) -> list[str]:
+        return [
+            entity
+            for entity in (
+                self.config.gas_usage_entity_id,
+                self.config.boiler_temperature_entity_id,
+                *self.config.burner_modulation_entities_ids,
+            )
+            if entity is not None
+        ]
+
+    async def _check_entities(self) -> None:
+        """
+        Check the connection and list the configured entities Home Assistant doesn't know yet
+        """
+        assert self._ws is not None
+
+        try:
+            states = await self._ws.command({"type": "get_states"})
+        except Exception as e:
+            logger.warning(
+                f"Couldn't read the states from Home Assistant over WebSocket, the REST API will be used: {e}"
+            )
+            return
+
+        known = {state["entity_id"] for state in states}
+        for entity in self._entities():
+            if entity not in known:
+                logger.info(
+                    f"Entity {entity} doesn't exist in Home Assistant yet, it will be created on the first update"
+                )
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Acquired only once - the shared session stays open until every action released it
+        if self._session is None:
+            self._session = acquire_session(
+                self.config.home_assistant_url, self.config.http
+            )
+        return self._session
+
+    async def _send_write(self, write: dict) -> bool:
+        """
+        Send a write stored in the outbox
+        """
+        if "statistics" in write:
+            return await self._send_statistics(write["statistics"])
+
+        return await self._send(write["endpoint"], write["data"])
+
+    async def _send_statistics(self, message: dict) -> bool:
+        """
+        Send a statistics import command over WebSocket
+
+        Returns:
+            bool: Whether Home Assistant accepted the import
+
+        Raises:
+            WriteRejected: If Home Assistant responded to the import with an error
+        """
+        if self._ws is None:
+            return False
+
+        try:
+            await self._ws.command(message)
+            logger.debug(
+                "Imported %s statistics buckets of %s",
+                len(message["stats"]),
+                message["metadata"]["statistic_id"],
+            )
+            return True
+        except HomeAssistantCommandError as e:
+            logger.error(f"Home Assistant refused the statistics import: {e}")
+            raise WriteRejected(str(e))
+        except Exception as e:
+            logger.error(f"Failed to import the statistics to Home Assistant: {e}")
+            return False
 
     async def _request(self, endpoint: str, data: dict) -> None:
+        """
+        Write to Home Assistant through the outbox, so that the write isn't lost if Home Assistant is down.
+        Every write sets the state of an entity, so only the latest pending write of an entity is kept
+
+        Raises:
+            NotDelivered: If the write hasn't been delivered right away
+        """
+        if self._outbox is None:
+            try:
+                delivered = await self._send(endpoint, data)
+            except WriteRejected:
+                delivered = False
+        else:
+            delivered = await self._outbox.put(
+                endpoint, {"endpoint": endpoint, "data": data}, collapse=True
+            )
+
+        if not delivered:
+            raise NotDelivered(f"The write to {endpoint} wasn't delivered")
+
+    async def _send(self, endpoint: str, data: dict) -> bool:
+        """
+        Send a request to Home Assistant
+
+        Returns:
+            bool: Whether the request succeeded
+
+        Raises:
+            WriteRejected: If Home Assistant refused the request (HTTP 4xx)
+        """
+        status: Optional[int] = None
+
         try:
             logger.debug(
-                f"Requesting Home Assistant {self.config.home_assistant_url} with data: {data}"
+                "Requesting Home Assistant %s with data: %s",
+                self.config.home_assistant_url,
+                data,
             )
 
-            headers = {
-                "Authorization": f"Bearer {self.config.token}",
-                "Content-Type": "application/json",
-            }
-
-            async with aiohttp.ClientSession(headers=headers) as session:
-                async with session.post(
-                    f"{self.config.home_assistant_url}/{endpoint}", data=data
-                ) as response:
-                    logger.debug(unquote_plus(str(response.request_info.real_url)))
-
-                    if response.status == 200:
-                        logger.debug(f"Response: {await response.text()}")
-                    else:
-                        logger.error(
-                            f"Failed to request Home Assistant {self.config.home_assistant_url}: {response.status}"
-                        )
+            async with self._get_session().post(
+                f"{self.config.home_assistant_url}/{endpoint}",
+                json=data,
+                headers=self._headers,
+            ) as response:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        "Requested %s",
+                        unquote_plus(str(response.request_info.real_url)),
+                    )
+
+                # 201 is returned when the entity's state is created
+                if response.status in (200, 201):
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("Response: %s", await response.text())
+                    return True
+
+                status = response.status
+                logger.error(
+                    f"Failed to request Home Assistant {self.config.home_assistant_url}: {response.status} {await response.text()}"
+                )
         except Exception as e:
             logger.error(f"Failed to request Home Assistant: {e}")
             logger.exception(e)
 
+        if status is not None and is_permanent_failure(status):
+            raise WriteRejected(f"HTTP {status}")
+
+        return False
+
     async def update_current_total_consumption(
         self,
         consumption_context: ConsumptionContext,
         total_consumption: int,
         today: int,
     ) -> None:
-        logger.debug(f"Updating current total consumption: {total_consumption}")
+        logger.debug("Updating current total consumption: %s", total_consumption)
 
         if self.config.gas_usage_entity_id is not None:
             await self._request(
@@ -62,18 +243,141 @@ class HomeAssistant(Action):
                 },
             )
 
-        raise NotImplementedError()
-
     async def update_current_total_consumption_increasing(
         self, consumption_context: ConsumptionContext, consumption_increase_offset: int
     ) -> None:
         pass
 
+    @staticmethod
+    def _period_start(reference: date, period: str, periods_ago: int) -> date:
+        if period == "week":
+            return reference - timedelta(days=reference.weekday() + 7 * periods_ago)
+
+        if period == "month":
+            months = reference.year * 12 + reference.month - 1 - periods_ago
+            return date(months // 12, months % 12 + 1, 1)
+
+        return date(reference.year - periods_ago, 1, 1)
+
+    def _statistics_buckets(
+        self, consumption_context: ConsumptionContext, consumption: dict[date, int]
+    ) -> dict[datetime, tuple[int, int]]:
+        """
+        Compute the statistics buckets from the daily values (and the coarse history before them).
+        The total counter at the end of each bucket is the current counter minus everything consumed after it.
+
+        Returns:
+            dict[datetime, tuple[int, int]]: Start of the bucket -> (consumption in the bucket,
+                total counter at its end), without today
+        """
+        gas_consumption = consumption_context.gas_consumption
+        assert gas_consumption is not None
+
+        timezone = self._timezone
+        total = consumption_context.total_consumption
+        # The day of the readings, not of the host - they differ around the midnight
+        today = gas_consumption.day_readat.date()
+
+        buckets: dict[datetime, tuple[int, int]] = {}
+        consumption_after = 0
+        oldest_day: Optional[date] = None
+
+        for day, value in sorted(consumption.items(), reverse=True):
+            if day != today:
+                buckets[datetime.combine(day, time(), timezone)] = (
+                    value,
+                    total - consumption_after,
+                )
+
+            consumption_after += value
+            oldest_day = day
+
+        period = self.config.statistics_coarse_history
+        if period is None or oldest_day is None:
+            return buckets
+
+        values: list[int] = getattr(gas_consumption, period)
+        reference = getattr(gas_consumption, f"{period}_readat").date()
+
+        counter_before_days = total - consumption_after
+
+        # The first value is the current (incomplete) period
+        consumption_after = 0
+        for periods_ago, value in enumerate(values):
+            start = self._period_start(reference, period, periods_ago)
+            counter_at_end = total - consumption_after
+            consumption_after += value
+
+            if start >= oldest_day:
+                continue
+
+            if (
+                periods_ago == 0
+                or self._period_start(reference, period, periods_ago - 1) > oldest_day
+            ):
+                # The period is partly covered by the daily values - only its part before them
+                buckets[datetime.combine(start, time(), timezone)] = (
+                    counter_before_days - (total - consumption_after),
+                    counter_before_days,
+                )
+            else:
+                buckets[datetime.combine(start, time(), timezone)] = (
+                    value,
+                    counter_at_end,
+                )
+
+        return buckets
+
     async def update_daily_consumption_stats(
         self, consumption_context: ConsumptionContext, consumption: dict[date, int]
     ):
-        # TODO: Research how to implement this in the future
-        pass
+        statistic_id = self.config.statistic_id
+        if statistic_id is None or self._ws is None:
+            return
+
+        buckets = self._statistics_buckets(consumption_context, consumption)
+
+        # Only the buckets which changed since the last import are sent
+        changed = {
+            start: bucket
+            for start, bucket in buckets.items()
+            if self._imported_statistics.get(start) != bucket
+        }
+        if not changed:
+            logger.debug("The statistics are up to date in Home Assistant")
+            return
+
+        message = {
+            "type": "recorder/import_statistics",
+            "metadata": {
+                "has_mean": False,
+                "has_sum": True,
+                "name": self.config.statistic_name,
+                "source": statistic_id.split(":")[0],
+                "statistic_id": statistic_id,
+                "unit_of_measurement": "kWh",
+            },
+            "stats": [
+                {"start": start.isoformat(), "state": value, "sum": counter}
+                for start, (value, counter) in sorted(changed.items())
+            ],
+        }
+
+        logger.info(
+            f"Importing {len(changed)} of {len(buckets)} statistics buckets of {statistic_id} to Home Assistant"
+        )
+
+        if self._outbox is not None:
+            # The imports of the same buckets have to be applied in order, so they're not collapsed
+            await self._outbox.put(statistic_id, {"statistics": message})
+        else:
+            try:
+                if not await self._send_statistics(message):
+                    return
+            except WriteRejected:
+                return
+
+        self._imported_statistics.update(changed)
 
     async def handle_consumption_midnight_case(
         self,
@@ -83,28 +387,47 @@ class HomeAssistant(Action):
         current_day_value: int,
         total_counter: int,
     ):
+        assert consumption_context.gas_consumption is not None
+
+        # The previous day is complete now - only the buckets which changed are re-imported
+        daily_values = {
+            consumption_context.gas_consumption.day_readat.date()
+            - timedelta(days=i): consumption_context.gas_consumption.day[i]
+            for i in range(len(consumption_context.gas_consumption.day))
+        }
+        await self.update_daily_consumption_stats(consumption_context, daily_values)
+
         await self.update_current_total_consumption(
             consumption_context, total_counter, current_day_value
         )
 
-    async def handle_burners_modulations(self, burners_modulations: list[int]):
-        logger.debug(f"Handling burners modulations: {burners_modulations}")
+    async def handle_burners_modulations(
+        self, burners_modulations: list[int], timestamp: Optional[datetime] = None
+    ):
+        logger.debug("Handling burners modulations: %s", burners_modulations)
 
-        for entity, modulation in zip(
-            self.config.burner_modulation_entities_ids, burners_modulations
-        ):
-            await self._request(
-                f"api/states/{entity}",
-                {
-                    "state": str(modulation),
-                    "attributes": {
-                        "unit_of_measurement": "%",
+        # The entities are independent, so their states are sent at once
+        await asyncio.gather(
+            *[
+                self._request(
+                    f"api/states/{entity}",
+                    {
+                        "state": str(modulation),
+                        "attributes": {
+                            "unit_of_measurement": "%",
+                        },
                     },
-                },
-            )
+                )
+                for entity, modulation in zip(
+                    self.config.burner_modulation_entities_ids, burners_modulations
+                )
+            ]
+        )
 
-    async def handle_boiler_temperature(self, boiler_temperature: float):
-        logger.debug(f"Handling boiler temperature: {boiler_temperature}")
+    async def handle_boiler_temperature(
+        self, boiler_temperature: float, timestamp: Optional[datetime] = None
+    ):
+        logger.debug("Handling boiler temperature: %s", boiler_temperature)
 
         if self.config.boiler_temperature_entity_id is not None:
             await self._request(
@@ -0,0 +1,232 @@
+import asyncio
+import time
+from typing import Any, Callable, Optional
+
+import aiohttp
+from yarl import URL
+
+from viessmann_bridge.logger import logger
+
+
+class HomeAssistantCommandError(Exception):
+    """
+    Home Assistant responded to a command with an error
+    """
+
+
+class HomeAssistantWebSocket:
+    """
+    A single, persistent connection to the WebSocket API of Home Assistant.
+
+    It authenticates once, and the commands are pipelined - they're all sent
+    right away and their results are matched by the command id, so a batch of
+    commands takes a single round trip. If the connection drops, it is
+    reopened by the next command (but not more often than the reconnect delay).
+    """
+
+    def __init__(
+        self,
+        url: str,
+        token: str,
+        get_session: Callable[[], aiohttp.ClientSession],
+        reconnect_delay_seconds: float = 10,
+        heartbeat_seconds: float = 30,
+        command_timeout_seconds: float = 30,
+    ) -> None:
+        base_url = URL(url)
+        self.url = base_url.with_scheme(
+            "wss" if base_url.scheme == "https" else "ws"
+        ).with_path(base_url.path.rstrip("/") + "/api/websocket")
+
+        self.token = token
+        self.reconnect_delay_seconds = reconnect_delay_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        # How long a batch of commands waits for its results
+        self.command_timeout_seconds = command_timeout_seconds
+        self._get_session = get_session
+
+        self._ws: Optional[aiohttp.ClientWebSocketResponse] = None
+        self._reader: Optional[asyncio.Task] = None
+        self._connect_lock = asyncio.Lock()
+        self._last_attempt = 0.0
+        self._closing = False
+
+        self._next_id = 1
+        self._pending: dict[int, asyncio.Future] = {}
+
+    @property
+    def connected(self) -> bool:
+        return self._ws is not None and not self._ws.closed
+
+    async def connect(self) -> bool:
+        """
+        Open and authenticate the connection, if it isn't open yet
+
+        Returns:
+            bool: Whether the connection is open
+        """
+        async with self._connect_lock:
+            if self.connected:
+                return True
+
+            if time.monotonic() - self._last_attempt < self.reconnect_delay_seconds:
+                return False
+            self._last_attempt = time.monotonic()
+
+            try:
+                ws = await self._get_session().ws_connect(
+                    self.url, heartbeat=self.heartbeat_seconds
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(
+                    f"Failed to connect to Home Assistant WebSocket API {self.url}: {e}"
+                )
+                return False
+
+            try:
+                # auth_required -> auth -> auth_ok / auth_invalid
+                await ws.receive_json()
+                await ws.send_json({"type": "auth", "access_token": self.token})
+                response = await ws.receive_json()
+            except (
+                aiohttp.ClientError,
+                asyncio.TimeoutError,
+                TypeError,
+                ValueError,
+            ) as e:
+                logger.error(f"Failed to authenticate to Home Assistant: {e}")
+                await ws.close()
+                return False
+
+            if response.get("type") != "auth_ok":
+                logger.error(
+                    f"Home Assistant rejected the token: {response.get('message')}"
+                )
+                await ws.close()
+                return False
+
+            logger.info(
+                f"Connected to Home Assistant WebSocket API {self.url} (version {response.get('ha_version')})"
+            )
+            self._ws = ws
+            self._reader = asyncio.create_task(
+                self._read(ws), name="home-assistant-websocket"
+            )
+            return True
+
+    async def _read(self, ws: aiohttp.ClientWebSocketResponse) -> None:
+        try:
+            async for message in ws:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    continue
+
+                # A malformed message doesn't stop the results of the other commands
+                try:
+                    data = message.json()
+                except ValueError as e:
+                    logger.warning(f"Invalid message from Home Assistant: {e}")
+                    continue
+
+                future = self._pending.pop(data.get("id"), None)
+                if future is None or future.done():
+                    continue
+
+                if data.get("success", True):
+                    future.set_result(data.get("result"))
+                else:
+                    error = data.get("error", {})
+                    future.set_exception(
+                        HomeAssistantCommandError(
+                            f"{error.get('code')}: {error.get('message')}"
+                        )
+                    )
+        finally:
+            if not self._closing:
+                logger.warning("Home Assistant WebSocket connection closed")
+
+            # The next command reconnects
+            if self._ws is ws:
+                self._ws = None
+            if not ws.closed:
+                await ws.close()
+
+            self._fail_pending(ConnectionError("The connection has been closed"))
+
+    def _fail_pending(self, error: Exception) -> None:
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    async def commands(self, messages: list[dict]) -> list[Any]:
+        """
+        Send the commands at once and wait for all of their results
+
+        Returns:
+            list[Any]: Result of each command, or the exception if the command failed
+
+        Raises:
+            ConnectionError: If the connection couldn't be opened
+            asyncio.TimeoutError: If the results didn't come within the command timeout
+        """
+        if not await self.connect():
+            raise ConnectionError("Not connected to Home Assistant")
+
+        ws = self._ws
+        assert ws is not None
+        loop = asyncio.get_running_loop()
+        command_ids: list[int] = []
+        futures: list[asyncio.Future] = []
+
+        try:
+            for message in messages:
+                command_id, self._next_id = self._next_id, self._next_id + 1
+
+                future = loop.create_future()
+                self._pending[command_id] = future
+                command_ids.append(command_id)
+                futures.append(future)
+
+                await ws.send_json({**message, "id": command_id})
+        except (aiohttp.ClientError, ConnectionError) as e:
+            self._fail_pending(ConnectionError(f"Failed to send the command: {e}"))
+
+        try:
+            return await asyncio.wait_for(
+                asyncio.gather(*futures, return_exceptions=True),
+                self.command_timeout_seconds,
+            )
+        except asyncio.TimeoutError:
+            # The late results are ignored
+            for command_id in command_ids:
+                self._pending.pop(command_id, None)
+
+            logger.error(
+                f"Home Assistant didn't respond to {len(messages)} commands within {self.command_timeout_seconds}s"
+            )
+            raise
+
+    async def command(self, message: dict) -> Any:
+        """
+        Send a single command and wait for its result
+
+        Raises:
+            ConnectionError: If the command couldn't be sent
+            HomeAssistantCommandError: If Home Assistant responded with an error
+        """
+        (result,) = await self.commands([message])
+        if isinstance(result, Exception):
+            raise result
+
+        return result
+
+    async def close(self) -> None:
+        self._closing = True
+
+        if self._ws is not None:
+            await self._ws.close()
+            self._ws = None
+
+        if self._reader is not None:
+            await self._reader
+            self._reader = None
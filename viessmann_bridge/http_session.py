@@ -0,0 +1,79 @@
+from typing import Optional
+
+import aiohttp
+from yarl import URL
+
+from viessmann_bridge.action import HttpPoolConfig
+
+
+def create_session(
+    config: HttpPoolConfig, headers: Optional[dict[str, str]] = None
+) -> aiohttp.ClientSession:
+    """
+    Create a pooled, keep-alive HTTP session.
+
+    Has to be called from inside the running event loop, and the session
+    should live for the whole lifetime of the action that owns it.
+
+    Args:
+        config (HttpPoolConfig): Connection pool settings of the action
+        headers (Optional[dict[str, str]]): Default headers sent with every request
+    """
+    connector = aiohttp.TCPConnector(
+        limit=config.connection_limit,
+        keepalive_timeout=config.keepalive_timeout_seconds,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=config.request_timeout_seconds,
+        connect=config.connect_timeout_seconds,
+    )
+
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers)
+
+
+# Server (scheme://host:port) -> (session, number of actions using it)
+_shared_sessions: dict[str, tuple[aiohttp.ClientSession, int]] = {}
+
+
+def _server_key(url: str) -> str:
+    parsed = URL(url)
+    return f"{parsed.scheme}://{parsed.host}:{parsed.port}"
+
+
+def acquire_session(url: str, config: HttpPoolConfig) -> aiohttp.ClientSession:
+    """
+    Get the pooled session for the server of the URL.
+
+    The session is shared by all the actions (of all the devices) talking to
+    the same server, so they use one connection pool. The pool settings of
+    the first action are used. Every call has to be paired with release_session.
+
+    Args:
+        url (str): URL of the server
+        config (HttpPoolConfig): Connection pool settings of the action
+    """
+    key = _server_key(url)
+    session, users = _shared_sessions.get(key, (None, 0))
+
+    if session is None or session.closed:
+        session, users = create_session(config), 0
+
+    _shared_sessions[key] = (session, users + 1)
+    return session
+
+
+async def release_session(url: str) -> None:
+    """
+    Release the session acquired for the URL, closing it once nobody uses it
+    """
+    key = _server_key(url)
+    if key not in _shared_sessions:
+        return
+
+    session, users = _shared_sessions[key]
+
+    if users <= 1:
+        del _shared_sessions[key]
+        await session.close()
+    else:
+        _shared_sessions[key] = (session, users - 1)
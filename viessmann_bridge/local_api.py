@@ -0,0 +1,225 @@
+import asyncio
+import hashlib
+import json
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import TYPE_CHECKING, Any, Optional
+
+from pydantic import BaseModel
+
+from viessmann_bridge.logger import logger
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+
+class LocalApiConfig(BaseModel):
+    # If enabled, the latest data of the devices is served at http://host:port/api/devices,
+    # so that other tools don't need to poll the Viessmann API themselves
+    enabled: bool = False
+    host: str = "127.0.0.1"
+    port: int = 9466
+    # Longest wait of a long-poll request (?wait=seconds) for the next update
+    long_poll_max_seconds: float = 300
+    # How often a comment is sent to the event streams, so that the proxies don't close them
+    sse_keepalive_seconds: float = 30
+
+
+class DeviceSnapshot:
+    """
+    The latest data of a single device, serialized once per change
+    """
+
+    def __init__(self, device: str) -> None:
+        self.device = device
+        self.values: dict[str, Any] = {"device": device}
+
+        self.body = b""
+        self.etag = ""
+        self.last_modified = datetime.now(timezone.utc)
+        # Set (and replaced) on every change, to wake up the long-polls and event streams
+        self.changed = asyncio.Event()
+
+        self._serialize()
+
+    def _serialize(self) -> None:
+        self.body = json.dumps(self.values).encode()
+        self.etag = f'"{hashlib.sha1(self.body).hexdigest()[:16]}"'
+
+    def update(self, values: dict[str, Any]) -> None:
+        new_values = {**self.values, **values}
+        if new_values == self.values:
+            return
+
+        self.values = new_values
+        self._serialize()
+        # Last-Modified has a resolution of a second
+        self.last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class SnapshotStore:
+    """
+    The latest snapshot of every device, as served by the local API
+    """
+
+    def __init__(self) -> None:
+        self._snapshots: dict[str, DeviceSnapshot] = {}
+
+    def get(self, device: str) -> Optional[DeviceSnapshot]:
+        return self._snapshots.get(device)
+
+    @property
+    def devices(self) -> list[str]:
+        return list(self._snapshots)
+
+    def update(self, device: str, **values: Any) -> None:
+        """
+        Update some of the device's values, notifying the clients waiting for a change
+
+        Has to be called from inside the running event loop.
+        """
+        if device not in self._snapshots:
+            self._snapshots[device] = DeviceSnapshot(device)
+        self._snapshots[device].update(values)
+
+    def clear(self) -> None:
+        self._snapshots.clear()
+
+
+SNAPSHOTS = SnapshotStore()
+
+
+def _is_not_modified(request: "web.Request", snapshot: DeviceSnapshot) -> bool:
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence over If-Modified-Since
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or snapshot.etag in tags or f"W/{snapshot.etag}" in tags
+
+    if_modified_since = request.headers.get("If-Modified-Since")
+    if if_modified_since is not None:
+        try:
+            return snapshot.last_modified <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+
+    return False
+
+
+def create_app(config: LocalApiConfig) -> "web.Application":
+    # Imported only when the API is served, as it's slow to import
+    from aiohttp import web
+
+    def snapshot_response(
+        request: web.Request, snapshot: DeviceSnapshot
+    ) -> web.Response:
+        headers = {
+            "ETag": snapshot.etag,
+            "Last-Modified": format_datetime(snapshot.last_modified, usegmt=True),
+            "Cache-Control": "no-cache",
+        }
+
+        if _is_not_modified(request, snapshot):
+            return web.Response(status=304, headers=headers)
+
+        return web.Response(
+            body=snapshot.body, headers=headers, content_type="application/json"
+        )
+
+    def get_snapshot(request: web.Request) -> DeviceSnapshot:
+        snapshot = SNAPSHOTS.get(request.match_info["device"])
+        if snapshot is None:
+            raise web.HTTPNotFound(
+                text=json.dumps(
+                    {"error": "Unknown device", "devices": SNAPSHOTS.devices}
+                ),
+                content_type="application/json",
+            )
+        return snapshot
+
+    async def handle_devices(request: web.Request) -> web.Response:
+        return web.json_response({"devices": SNAPSHOTS.devices})
+
+    async def handle_device(request: web.Request) -> web.Response:
+        snapshot = get_snapshot(request)
+
+        # Long-poll - if the client already has the current snapshot, wait for the next one
+        wait = request.query.get("wait")
+        if wait is not None and _is_not_modified(request, snapshot):
+            try:
+                timeout = min(float(wait), config.long_poll_max_seconds)
+            except ValueError:
+                raise web.HTTPBadRequest(text="wait has to be a number of seconds")
+
+            try:
+                await asyncio.wait_for(snapshot.changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        return snapshot_response(request, snapshot)
+
+    async def handle_events(request: web.Request) -> web.StreamResponse:
+        snapshot = get_snapshot(request)
+
+        response = web.StreamResponse(
+            headers={
+                "Content-Type": "text/event-stream",
+                "Cache-Control": "no-cache",
+            }
+        )
+        await response.prepare(request)
+
+        # A reconnecting client sends the id of the last event it got - don't repeat it
+        sent_etag = request.headers.get("Last-Event-ID")
+
+        try:
+            while True:
+                if snapshot.etag != sent_etag:
+                    sent_etag = snapshot.etag
+                    await response.write(
+                        f"event: snapshot\nid: {snapshot.etag}\ndata: ".encode()
+                        + snapshot.body
+                        + b"\n\n"
+                    )
+
+                try:
+                    await asyncio.wait_for(
+                        snapshot.changed.wait(), config.sse_keepalive_seconds
+                    )
+                except asyncio.TimeoutError:
+                    await response.write(b": keepalive\n\n")
+        except ConnectionResetError:
+            # The client has gone away
+            return response
+
+    app = web.Application()
+    app.router.add_get("/api/devices", handle_devices)
+    app.router.add_get("/api/devices/{device}", handle_device)
+    app.router.add_get("/api/devices/{device}/events", handle_events)
+    return app
+
+
+async def start_local_api(config: LocalApiConfig) -> Optional["web.AppRunner"]:
+    """
+    Start serving the latest data of the devices, if enabled
+
+    Returns:
+        Optional[web.AppRunner]: Runner of the server, to be cleaned up on shutdown
+    """
+    if not config.enabled:
+        return None
+
+    from aiohttp import web
+
+    # The event streams never finish on their own, so don't wait for them on shutdown
+    runner = web.AppRunner(create_app(config), access_log=None, shutdown_timeout=1)
+    await runner.setup()
+    await web.TCPSite(runner, config.host, config.port).start()
+
+    logger.info(
+        f"Serving the local API at http://{config.host}:{config.port}/api/devices"
+    )
+    return runner
@@ -1,13 +1,194 @@
+import copy
+import json
 import logging
+import logging.handlers
+import queue
+import time
+from typing import Any, Literal, Optional
+
+from pydantic import BaseModel
+
+
+class LoggingConfig(BaseModel):
+    level: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"] = "INFO"
+    # text - human readable lines, json - one JSON object per line (e.g. for Loki or Elasticsearch)
+    format: Literal["text", "json"] = "text"
+    # How many debug lines logged by the same line of code (e.g. "Requesting Domoticz ...") are written per second.
+    # The rest are dropped and counted. Set to null to write all of them
+    debug_lines_per_second: Optional[float] = 5
+
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Attributes every LogRecord has - anything else was passed with extra= and goes to the JSON output
+_RECORD_ATTRIBUTES = set(logging.LogRecord("", 0, "", 0, "", None, None).__dict__) | {
+    "message",
+    "asctime",
+    "suppressed",
+}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats the records as single-line JSON objects, with the fields given with extra= included
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict[str, Any] = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(
+            {
+                key: value
+                for key, value in record.__dict__.items()
+                if key not in _RECORD_ATTRIBUTES
+            }
+        )
+
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+
+        return json.dumps(entry, default=str)
+
+
+class DebugRateLimitFilter(logging.Filter):
+    """
+    Lets through at most `rate` debug records per second for every line of the code logging them.
+
+    The number of the dropped records is added to the next record of the same line which
+    gets through. The lines which haven't been logged for a while are forgotten.
+    """
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate = rate
+        # Holds at least a single record, so that a rate below 1 still lets some through
+        self.capacity = max(1.0, rate)
+        # (file, line) -> (tokens, last refill, dropped since the last written record)
+        self._buckets: dict[tuple[str, int], tuple[float, float, int]] = {}
+        self._swept_at = time.monotonic()
+
+    def _sweep(self, now: float) -> None:
+        """
+        Forget the buckets which refilled, unless they hold a count of the dropped records
+        """
+        self._buckets = {
+            key: (tokens, refilled_at, dropped)
+            for key, (tokens, refilled_at, dropped) in self._buckets.items()
+            if dropped or tokens + (now - refilled_at) * self.rate < self.capacity
+        }
+        self._swept_at = now
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+
+        now = time.monotonic()
+        if now - self._swept_at >= 1:
+            self._sweep(now)
+
+        # The line logging the record, as the messages might be formatted before logging them
+        key = (record.pathname, record.lineno)
+        tokens, refilled_at, dropped = self._buckets.get(key, (self.capacity, now, 0))
+        tokens = min(self.capacity, tokens + (now - refilled_at) * self.rate)
+
+        if tokens < 1:
+            self._buckets[key] = (tokens, now, dropped + 1)
+            return False
+
+        self._buckets[key] = (tokens - 1, now, 0)
+        if dropped:
+            record.suppressed = dropped
+            record.msg = f"{record.msg} ({dropped} similar lines suppressed)"
+
+        return True
+
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues the records for the listener thread, keeping their exception - unlike
+    QueueHandler, which formats the record here and clears it, so that the
+    formatter of the console handler (e.g. the JSON one) wouldn't get it
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        # The arguments are rendered right away, as they might change before the record is written
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
 
 logger = logging.getLogger("viessmann_bridge")
-logger.setLevel(logging.DEBUG)
+logger.setLevel(logging.INFO)
 
 # Create a console handler
 console_handler = logging.StreamHandler()
 console_handler.setLevel(logging.DEBUG)
 
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+formatter = logging.Formatter(TEXT_FORMAT)
 console_handler.setFormatter(formatter)
 
 logger.addHandler(console_handler)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_rate_limit_filter: Optional[DebugRateLimitFilter] = None
+
+
+def configure_logging(config: LoggingConfig) -> None:
+    """
+    Apply the logging config.
+
+    The records are put into a queue by the event loop, and written to stderr by a separate
+    thread, so a slow terminal or pipe never blocks the bridge.
+    """
+    global _listener, _rate_limit_filter
+
+    stop_logging()
+
+    logger.setLevel(config.level)
+    console_handler.setFormatter(
+        JsonFormatter() if config.format == "json" else logging.Formatter(TEXT_FORMAT)
+    )
+
+    if _rate_limit_filter is not None:
+        logger.removeFilter(_rate_limit_filter)
+        _rate_limit_filter = None
+    if config.debug_lines_per_second is not None:
+        _rate_limit_filter = DebugRateLimitFilter(config.debug_lines_per_second)
+        logger.addFilter(_rate_limit_filter)
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    logger.removeHandler(console_handler)
+    logger.addHandler(RecordQueueHandler(records))
+
+    _listener = logging.handlers.QueueListener(
+        records, console_handler, respect_handler_level=True
+    )
+    _listener.start()
+
+
+def stop_logging() -> None:
+    """
+    Write the queued records and go back to writing them directly
+    """
+    global _listener
+
+    if _listener is None:
+        return
+
+    _listener.stop()
+    _listener = None
+
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            logger.removeHandler(handler)
+    logger.addHandler(console_handler)
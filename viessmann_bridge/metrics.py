@@ -0,0 +1,390 @@
+import functools
+import inspect
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+from pydantic import BaseModel
+
+from viessmann_bridge.logger import logger
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class MetricsConfig(BaseModel):
+    # If enabled, the metrics are served in the Prometheus text format at http://host:port/metrics
+    enabled: bool = False
+    host: str = "0.0.0.0"
+    port: int = 9465
+
+
+def _format_labels(label_names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not label_names:
+        return ""
+
+    escaped = (
+        value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for value in values
+    )
+    return (
+        "{"
+        + ",".join(f'{name}="{value}"' for name, value in zip(label_names, escaped))
+        + "}"
+    )
+
+
+class Metric:
+    metric_type = ""
+
+    def __init__(self, name: str, description: str, label_names: list[str]) -> None:
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+
+        # Some of the metrics are updated from the device threads
+        self._lock = threading.Lock()
+
+        REGISTRY.register(self)
+
+    def _key(self, labels: dict[str, Any]) -> tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError()
+
+    def expose(self) -> str:
+        with self._lock:
+            samples = self._samples()
+
+        return "\n".join(
+            [
+                f"# HELP {self.name} {self.description}",
+                f"# TYPE {self.name} {self.metric_type}",
+                *samples,
+            ]
+        )
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def __init__(
+        self, name: str, description: str, label_names: list[str] = []
+    ) -> None:
+        super().__init__(name, description, label_names)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {value}"
+            for key, value in self._values.items()
+        ]
+
+
+class Gauge(Metric):
+    metric_type = "gauge"
+
+    def __init__(
+        self, name: str, description: str, label_names: list[str] = []
+    ) -> None:
+        super().__init__(name, description, label_names)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {value}"
+            for key, value in self._values.items()
+        ]
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label_names: list[str] = [],
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, description, label_names)
+        self.buckets = buckets
+        # Labels -> (count in each bucket, sum, count)
+        self._values: dict[tuple[str, ...], tuple[list[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            bucket_counts, total, count = self._values.get(
+                key, ([0] * len(self.buckets), 0.0, 0)
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    bucket_counts[i] += 1
+            self._values[key] = (bucket_counts, total + value, count + 1)
+
+    def _samples(self) -> list[str]:
+        samples: list[str] = []
+        label_names = self.label_names + ("le",)
+
+        for key, (bucket_counts, total, count) in self._values.items():
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                samples.append(
+                    f"{self.name}_bucket{_format_labels(label_names, key + (str(bound),))} {bucket_count}"
+                )
+            samples.append(
+                f"{self.name}_bucket{_format_labels(label_names, key + ('+Inf',))} {count}"
+            )
+            samples.append(
+                f"{self.name}_sum{_format_labels(self.label_names, key)} {total}"
+            )
+            samples.append(
+                f"{self.name}_count{_format_labels(self.label_names, key)} {count}"
+            )
+
+        return samples
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> None:
+        self.metrics.append(metric)
+
+    def expose(self) -> str:
+        return "\n".join(metric.expose() for metric in self.metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+VIESSMANN_FETCH_SECONDS = Histogram(
+    "viessmann_bridge_viessmann_fetch_seconds",
+    "Duration of fetching the device's features from the Viessmann API",
+    ["device"],
+)
+DEVICE_READ_SECONDS = Histogram(
+    "viessmann_bridge_device_read_seconds",
+    "Duration of reading a metric of the device (including the cached reads)",
+    ["device", "method"],
+)
+ACTION_WRITE_SECONDS = Histogram(
+    "viessmann_bridge_action_write_seconds",
+    "Duration of handling an update by an action",
+    ["device", "action", "method"],
+)
+CYCLE_DURATION_SECONDS = Histogram(
+    "viessmann_bridge_cycle_duration_seconds",
+    "Duration of a single poll of a metric",
+    ["device", "job"],
+)
+JOB_LATENESS_SECONDS = Gauge(
+    "viessmann_bridge_job_lateness_seconds",
+    "How late the last poll of a metric started, after its tick",
+    ["device", "job"],
+)
+JOB_SKIPPED_TICKS = Counter(
+    "viessmann_bridge_job_skipped_ticks_total",
+    "Ticks of a metric's poll skipped because of an overrun or the API budget",
+    ["device", "job"],
+)
+ACTION_REQUESTS = Counter(
+    "viessmann_bridge_action_requests_total",
+    "Requests sent by the actions",
+    ["device", "action"],
+)
+ACTION_REQUEST_ERRORS = Counter(
+    "viessmann_bridge_action_request_errors_total",
+    "Requests sent by the actions which failed",
+    ["device", "action"],
+)
+WRITES_SENT = Counter(
+    "viessmann_bridge_writes_sent_total",
+    "Updates passed by the change filter and handled by the actions",
+    ["device", "action", "kind"],
+)
+WRITES_SUPPRESSED = Counter(
+    "viessmann_bridge_writes_suppressed_total",
+    "Updates dropped by the change filter, because the value didn't change",
+    ["device", "action", "kind"],
+)
+MIDNIGHT_ROLLOVERS = Counter(
+    "viessmann_bridge_midnight_rollovers_total",
+    "New days detected in the consumption data",
+    ["device"],
+)
+TOTAL_CONSUMPTION = Gauge(
+    "viessmann_bridge_total_consumption_kwh",
+    "Current value of the total consumption counter",
+    ["device"],
+)
+LAST_SUCCESSFUL_POLL = Gauge(
+    "viessmann_bridge_last_successful_poll_timestamp_seconds",
+    "Unix time of the last successful read of the device",
+    ["device"],
+)
+OUTBOX_PENDING = Gauge(
+    "viessmann_bridge_outbox_pending_writes",
+    "Writes waiting in the outbox to be accepted by the sink",
+    ["sink"],
+)
+OUTBOX_OLDEST_PENDING = Gauge(
+    "viessmann_bridge_outbox_oldest_pending_timestamp_seconds",
+    "Unix time of the oldest write waiting in the outbox (0 if there's none)",
+    ["sink"],
+)
+OUTBOX_DROPPED = Counter(
+    "viessmann_bridge_outbox_dropped_writes_total",
+    "Writes dropped from the outbox, because they were pending for too long or the sink rejected them",
+    ["sink"],
+)
+TIME_TO_FIRST_PUBLISH = Gauge(
+    "viessmann_bridge_time_to_first_publish_seconds",
+    "Time from the start of the bridge until an action handled the first value of the device",
+    ["device"],
+)
+VIESSMANN_API_CALLS_REMAINING = Gauge(
+    "viessmann_bridge_viessmann_api_calls_remaining",
+    "Calls to the Viessmann API left in the sliding 24 hours window",
+)
+
+# Methods of the actions which are measured
+ACTION_METHODS = (
+    "update_current_total_consumption",
+    "update_current_total_consumption_increasing",
+    "update_daily_consumption_stats",
+    "handle_consumption_midnight_case",
+    "handle_burners_modulations",
+    "handle_boiler_temperature",
+    "end_cycle",
+)
+
+# Getters of the device which are measured
+DEVICE_METHODS = (
+    "get_gas_usage",
+    "get_burners_modulations",
+    "get_boiler_temperature",
+)
+
+
+def _timed_async(
+    method: Callable, histogram: Histogram, labels: dict[str, str]
+) -> Callable:
+    @functools.wraps(method)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        started_at = time.monotonic()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            histogram.observe(time.monotonic() - started_at, **labels)
+
+    return wrapper
+
+
+def _timed(method: Callable, histogram: Histogram, labels: dict[str, str]) -> Callable:
+    @functools.wraps(method)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        started_at = time.monotonic()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            histogram.observe(time.monotonic() - started_at, **labels)
+
+    return wrapper
+
+
+def instrument_action(action: Any, device: str, name: str) -> None:
+    """
+    Measure the duration of the action's methods and count its requests and their errors.
+
+    The methods are wrapped on the instance, so the actions don't need to know about the metrics.
+    The method sending a single request (`_send`) is expected to return whether the request succeeded.
+    """
+    for method_name in ACTION_METHODS:
+        setattr(
+            action,
+            method_name,
+            _timed_async(
+                getattr(action, method_name),
+                ACTION_WRITE_SECONDS,
+                {"device": device, "action": name, "method": method_name},
+            ),
+        )
+
+    send = getattr(action, "_send", None)
+    if send is None or not inspect.iscoroutinefunction(send):
+        return
+
+    @functools.wraps(send)
+    async def counted_send(*args: Any, **kwargs: Any) -> Any:
+        ACTION_REQUESTS.inc(device=device, action=name)
+
+        success = await send(*args, **kwargs)
+        if success is False:
+            ACTION_REQUEST_ERRORS.inc(device=device, action=name)
+
+        return success
+
+    action._send = counted_send
+
+
+def instrument_device(device: Any, name: str) -> None:
+    """
+    Measure the duration of the device's getters and of the Viessmann API fetches
+    """
+    for method_name in DEVICE_METHODS:
+        setattr(
+            device,
+            method_name,
+            _timed(
+                getattr(device, method_name),
+                DEVICE_READ_SECONDS,
+                {"device": name, "method": method_name},
+            ),
+        )
+
+    device.service.fetch_all_features = _timed(
+        device.service.fetch_all_features, VIESSMANN_FETCH_SECONDS, {"device": name}
+    )
+
+
+async def start_metrics_server(config: MetricsConfig) -> Optional["web.AppRunner"]:
+    """
+    Start serving the metrics, if enabled
+
+    Returns:
+        Optional[web.AppRunner]: Runner of the server, to be cleaned up on shutdown
+    """
+    if not config.enabled:
+        return None
+
+    # Imported only when the metrics are served, as it's slow to import
+    from aiohttp import web
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(
+            text=REGISTRY.expose(), content_type="text/plain", charset="utf-8"
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, config.host, config.port).start()
+
+    logger.info(f"Serving metrics at http://{config.host}:{config.port}/metrics")
+    return runner
@@ -0,0 +1,392 @@
+import asyncio
+import json
+from datetime import date, datetime, timedelta
+from typing import Any, Optional
+
+import aiomqtt
+
+from viessmann_bridge.action import Action, MqttActionConfig
+from viessmann_bridge.consumption import ConsumptionContext
+from viessmann_bridge.domoticz import DomoticzCounters, WriteChains
+from viessmann_bridge.logger import logger
+
+
+class MqttMessage:
+    def __init__(self, topic: str, payload: str, retain: bool, collapse: bool) -> None:
+        self.topic = topic
+        self.payload = payload
+        self.retain = retain
+        # Whether a newer message of the chain can replace it while it's pending
+        self.collapse = collapse
+
+
+# Key of the chain (the state's name or the Domoticz device idx) -> its messages,
+# which have to be published in order. The chains are independent
+MessageChains = dict[str, list[MqttMessage]]
+
+
+class Mqtt(Action):
+    """
+    Publishes the values over a single, persistent MQTT connection.
+
+    The states are published to their own topics (announced to Home Assistant with
+    MQTT discovery), and optionally sent to Domoticz as domoticz/in messages.
+    The messages are batched per cycle and published by end_cycle - the messages
+    of a chain one after another, the chains concurrently. The messages which
+    couldn't be published are kept for the next cycle.
+    """
+
+    config: MqttActionConfig
+
+    def __init__(self, config: MqttActionConfig) -> None:
+        self.config = config
+        self._client: Optional[aiomqtt.Client] = None
+        self._connect_lock = asyncio.Lock()
+        self._sink = f"mqtt {config.name or f'{config.host}:{config.port}'}"
+
+        # The states announced to Home Assistant so far
+        self._discovered: set[str] = set()
+        self._node_id = config.base_topic.replace("/", "_")
+
+        # Messages of the current cycle
+        self._pending: MessageChains = {}
+
+        self._domoticz: Optional[DomoticzCounters] = None
+        if config.domoticz is not None:
+            self._domoticz = DomoticzCounters(config.domoticz)
+
+    async def init(self) -> None:
+        await self._connect()
+
+    async def close(self) -> None:
+        await self.end_cycle()
+        await self._disconnect()
+
+    async def _connect(self) -> bool:
+        async with self._connect_lock:
+            if self._client is not None:
+                return True
+
+            client = aiomqtt.Client(
+                self.config.host,
+                self.config.port,
+                username=self.config.username,
+                password=self.config.password,
+                identifier=self.config.client_id,
+                keepalive=self.config.keepalive_seconds,
+                timeout=self.config.timeout_seconds,
+            )
+
+            try:
+                await client.__aenter__()
+            except aiomqtt.MqttError as e:
+                logger.error(
+                    f"Failed to connect to MQTT broker {self.config.host}:{self.config.port}: {e}"
+                )
+                return False
+
+            logger.info(
+                f"Connected to MQTT broker {self.config.host}:{self.config.port}"
+            )
+            self._client = client
+            return True
+
+    async def _disconnect(self) -> None:
+        client, self._client = self._client, None
+        if client is None:
+            return
+
+        try:
+            await client.__aexit__(None, None, None)
+        except aiomqtt.MqttError as e:
+            logger.debug("Failed to disconnect from the MQTT broker cleanly: %s", e)
+
+    async def _publish_chain(
+        self, client: aiomqtt.Client, chain: list[MqttMessage]
+    ) -> int:
+        """
+        Publish the messages of the chain one after another, stopping at the first failure
+
+        Returns:
+            int: How many of the messages have been published
+        """
+        for published, message in enumerate(chain):
+            try:
+                await client.publish(
+                    message.topic,
+                    message.payload,
+                    qos=self.config.qos,
+                    retain=message.retain,
+                )
+            except aiomqtt.MqttError as e:
+                logger.error(f"Failed to publish to the MQTT broker: {e}")
+                return published
+
+        return len(chain)
+
+    async def _send(self, chains: MessageChains) -> bool:
+        """
+        Publish the chains concurrently, reconnecting if the connection has dropped.
+        The messages which couldn't be published are put back in front of the pending ones
+
+        Returns:
+            bool: Whether all the messages have been published
+        """
+        for _ in range(2):
+            if not chains or not await self._connect():
+                break
+
+            assert self._client is not None
+            client = self._client
+            # The chains are in flight together on purpose, don't warn about them
+            client.pending_calls_threshold = max(10, len(chains))
+
+            published = await asyncio.gather(
+                *[self._publish_chain(client, chain) for chain in chains.values()]
+            )
+            chains = {
+                key: chain[count:]
+                for (key, chain), count in zip(chains.items(), published)
+                if count < len(chain)
+            }
+
+            if chains:
+                await self._disconnect()
+
+        for key, chain in chains.items():
+            self._pending[key] = chain + self._pending.get(key, [])
+
+        return not chains
+
+    async def end_cycle(self) -> None:
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, {}
+        if not await self._send(pending):
+            logger.warning(
+                f"{sum(len(chain) for chain in self._pending.values())} MQTT messages couldn't be published, they're kept for the next cycle"
+            )
+
+    def _queue(self, key: str, messages: list[MqttMessage]) -> None:
+        """
+        Add the messages to the chain of the cycle, replacing its collapsing messages
+        """
+        chain = self._pending.setdefault(key, [])
+        if any(message.collapse for message in messages):
+            chain[:] = [message for message in chain if not message.collapse]
+        chain.extend(messages)
+
+    def _queue_state(
+        self,
+        name: str,
+        value: Any,
+        friendly_name: str,
+        unit: str,
+        device_class: Optional[str],
+        state_class: str,
+    ) -> None:
+        """
+        Queue the state message, preceded by the discovery config if the state hasn't been announced yet
+        """
+        state_topic = f"{self.config.base_topic}/{name}"
+        messages: list[MqttMessage] = []
+
+        if self.config.home_assistant_discovery and name not in self._discovered:
+            unique_id = f"{self._node_id}_{name}"
+            discovery: dict[str, Any] = {
+                "name": friendly_name,
+                "unique_id": unique_id,
+                "object_id": unique_id,
+                "state_topic": state_topic,
+                "unit_of_measurement": unit,
+                "state_class": state_class,
+                "device": {
+                    "identifiers": [self._node_id],
+                    "name": self.config.device_name,
+                    "manufacturer": "Viessmann",
+                },
+            }
+            if device_class is not None:
+                discovery["device_class"] = device_class
+
+            messages.append(
+                MqttMessage(
+                    f"{self.config.discovery_prefix}/sensor/{self._node_id}/{name}/config",
+                    json.dumps(discovery),
+                    retain=True,
+                    collapse=False,
+                )
+            )
+            # The discovery stays queued until it's published
+            self._discovered.add(name)
+
+        messages.append(
+            MqttMessage(state_topic, str(value), self.config.retain, collapse=True)
+        )
+        self._queue(name, messages)
+
+    def _queue_domoticz(self, chains: WriteChains) -> None:
+        assert self.config.domoticz is not None
+
+        for idx, chain in chains.items():
+            for write in chain:
+                self._queue(
+                    f"domoticz {idx}",
+                    [
+                        MqttMessage(
+                            self.config.domoticz.topic,
+                            json.dumps(
+                                {
+                                    "command": "udevice",
+                                    "idx": write.params["idx"],
+                                    "nvalue": write.params["nvalue"],
+                                    "svalue": write.params["svalue"],
+                                }
+                            ),
+                            retain=False,
+                            collapse=write.collapse,
+                        )
+                    ],
+                )
+
+    def _queue_total_consumption(self, total_consumption: int, today: int) -> None:
+        self._queue_state(
+            "total_consumption",
+            total_consumption,
+            "Gas consumption",
+            "kWh",
+            "energy",
+            "total_increasing",
+        )
+        self._queue_state(
+            "today_consumption",
+            today,
+            "Gas consumption today",
+            "kWh",
+            "energy",
+            "total_increasing",
+        )
+
+        if self._domoticz is not None:
+            self._queue_domoticz(
+                self._domoticz._plan_total_consumption_writes(total_consumption)
+            )
+
+    def _queue_increasing(self, consumption_increase_offset: int) -> None:
+        if self._domoticz is not None:
+            self._queue_domoticz(
+                self._domoticz._plan_increasing_writes(consumption_increase_offset)
+            )
+
+    def _queue_daily(
+        self, consumption_context: ConsumptionContext, consumption: dict[date, int]
+    ) -> None:
+        self._queue(
+            "daily_consumption",
+            [
+                MqttMessage(
+                    f"{self.config.base_topic}/daily_consumption",
+                    json.dumps(
+                        {
+                            day.isoformat(): value
+                            for day, value in sorted(consumption.items())
+                        }
+                    ),
+                    self.config.retain,
+                    collapse=True,
+                )
+            ],
+        )
+
+        domoticz = self._domoticz
+        if domoticz is not None:
+            counter_values = domoticz._daily_counter_values(
+                consumption_context, consumption
+            )
+            self._queue_domoticz(
+                domoticz._plan_daily_consumption_writes(counter_values)
+            )
+
+    async def update_current_total_consumption(
+        self,
+        consumption_context: ConsumptionContext,
+        total_consumption: int,
+        today: int,
+    ) -> None:
+        logger.debug("Updating current total consumption: %s", total_consumption)
+
+        self._queue_total_consumption(total_consumption, today)
+
+    async def update_current_total_consumption_increasing(
+        self, consumption_context: ConsumptionContext, consumption_increase_offset: int
+    ) -> None:
+        self._queue_increasing(consumption_increase_offset)
+
+    async def update_daily_consumption_stats(
+        self, consumption_context: ConsumptionContext, consumption: dict[date, int]
+    ):
+        logger.debug("Updating daily consumption stats: %s", consumption)
+
+        self._queue_daily(consumption_context, consumption)
+
+    async def handle_consumption_midnight_case(
+        self,
+        consumption_context: ConsumptionContext,
+        previous_day_new_value: int,
+        offset_previous_day: int,
+        current_day_value: int,
+        total_counter: int,
+    ):
+        assert consumption_context.gas_consumption is not None
+
+        daily_values = {
+            consumption_context.gas_consumption.day_readat.date()
+            - timedelta(days=i): consumption_context.gas_consumption.day[i]
+            for i in range(len(consumption_context.gas_consumption.day))
+        }
+
+        self._queue_daily(consumption_context, daily_values)
+        self._queue_total_consumption(total_counter, current_day_value)
+        self._queue_increasing(
+            total_counter - consumption_context.previous_total_consumption
+        )
+
+    async def handle_burners_modulations(
+        self, burners_modulations: list[int], timestamp: Optional[datetime] = None
+    ):
+        logger.debug("Handling burners modulations: %s", burners_modulations)
+
+        for i, modulation in enumerate(burners_modulations):
+            self._queue_state(
+                f"burner_{i}_modulation",
+                modulation,
+                f"Burner {i} modulation",
+                "%",
+                None,
+                "measurement",
+            )
+
+        if self._domoticz is not None:
+            self._queue_domoticz(
+                self._domoticz._plan_burners_writes(burners_modulations)
+            )
+
+    async def handle_boiler_temperature(
+        self, boiler_temperature: float, timestamp: Optional[datetime] = None
+    ):
+        logger.debug("Handling boiler temperature: %s", boiler_temperature)
+
+        self._queue_state(
+            "boiler_temperature",
+            boiler_temperature,
+            "Boiler temperature",
+            "°C",
+            "temperature",
+            "measurement",
+        )
+
+        if self._domoticz is not None:
+            self._queue_domoticz(
+                self._domoticz._plan_boiler_temperature_writes(boiler_temperature)
+            )
@@ -0,0 +1,325 @@
+import asyncio
+import json
+import sqlite3
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from viessmann_bridge.action import OutboxConfig
+from viessmann_bridge.logger import logger
+from viessmann_bridge.metrics import (
+    OUTBOX_DROPPED,
+    OUTBOX_OLDEST_PENDING,
+    OUTBOX_PENDING,
+)
+
+OutboxSend = Callable[[Any], Awaitable[bool]]
+
+
+class WriteRejected(Exception):
+    """
+    The sink rejected the write for good (e.g. with HTTP 4xx), so sending it again wouldn't help
+    """
+
+
+class NotDelivered(Exception):
+    """
+    The action's writes weren't delivered - they're kept in the outbox (if there's one)
+    and sent once the sink is back, so the update mustn't be counted as handled yet
+    """
+
+
+def is_permanent_failure(status: int) -> bool:
+    """
+    Whether the HTTP status means that the write won't ever be accepted - the client errors,
+    except for a timeout and rate limiting
+    """
+    return 400 <= status < 500 and status not in (408, 429)
+
+
+class Outbox:
+    """
+    Durable queue of the writes to a single sink (e.g. a Domoticz server), stored in SQLite.
+
+    Every write is stored before it is sent and removed once the sink accepts it.
+    The writes are grouped into streams (e.g. the Domoticz device idx) - the writes of
+    a stream are always sent in order, while the streams are independent of each other.
+    A write marked as collapsing replaces the pending collapsing writes of its stream,
+    so that only the latest value is sent once the sink is back.
+
+    When a write fails, the sending stops for the whole sink and is retried with
+    an exponential backoff. The writes made in the meantime are only stored.
+    A write the sink rejects for good (the send function raises WriteRejected) is dropped
+    instead, so that it doesn't hold up the other writes.
+    """
+
+    def __init__(self, config: OutboxConfig, sink: str, send: OutboxSend) -> None:
+        assert config.path is not None
+
+        self.config = config
+        self.sink = sink
+        self._send = send
+
+        self._connection = sqlite3.connect(config.path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS outbox (seq INTEGER PRIMARY KEY AUTOINCREMENT, sink TEXT NOT NULL, stream TEXT NOT NULL, collapse INTEGER NOT NULL, created_at REAL NOT NULL, payload TEXT NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS outbox_sink_stream ON outbox (sink, stream, seq)"
+        )
+        self._connection.commit()
+
+        self._stream_locks: dict[str, asyncio.Lock] = {}
+        self._failures = 0
+        self._retry_at = 0.0
+        self._retry_task: Optional[asyncio.Task] = None
+
+        self._update_metrics()
+
+    @property
+    def pending(self) -> int:
+        return self._connection.execute(
+            "SELECT COUNT(*) FROM outbox WHERE sink = ?", (self.sink,)
+        ).fetchone()[0]
+
+    @property
+    def oldest_pending_age(self) -> float:
+        """
+        Age of the oldest pending write in seconds, 0 if there's none
+        """
+        (oldest,) = self._connection.execute(
+            "SELECT MIN(created_at) FROM outbox WHERE sink = ?", (self.sink,)
+        ).fetchone()
+        return time.time() - oldest if oldest is not None else 0.0
+
+    def _update_metrics(self) -> None:
+        pending, oldest = self._connection.execute(
+            "SELECT COUNT(*), MIN(created_at) FROM outbox WHERE sink = ?", (self.sink,)
+        ).fetchone()
+
+        OUTBOX_PENDING.set(pending, sink=self.sink)
+        OUTBOX_OLDEST_PENDING.set(oldest or 0, sink=self.sink)
+
+    def _lock(self, stream: str) -> asyncio.Lock:
+        if stream not in self._stream_locks:
+            self._stream_locks[stream] = asyncio.Lock()
+        return self._stream_locks[stream]
+
+    def _is_pending(self, seq: int) -> bool:
+        return (
+            self._connection.execute(
+                "SELECT 1 FROM outbox WHERE seq = ?", (seq,)
+            ).fetchone()
+            is not None
+        )
+
+    def _delete(self, seq: int) -> None:
+        with self._connection:
+            self._connection.execute("DELETE FROM outbox WHERE seq = ?", (seq,))
+
+    async def put(self, stream: str, payload: Any, collapse: bool = False) -> bool:
+        """
+        Store the write and send it, along with the pending writes of its stream
+
+        Args:
+            stream (str): Writes of the same stream are sent in order
+            payload (Any): JSON-serializable write, passed to the send function
+            collapse (bool): Whether the write replaces the pending collapsing writes of its stream
+
+        Returns:
+            bool: Whether the write has been delivered - if not, it is retried later
+        """
+        with self._connection:
+            if collapse:
+                self._connection.execute(
+                    "DELETE FROM outbox WHERE sink = ? AND stream = ? AND collapse = 1",
+                    (self.sink, stream),
+                )
+            cursor = self._connection.execute(
+                "INSERT INTO outbox (sink, stream, collapse, created_at, payload) VALUES (?, ?, ?, ?, ?)",
+                (self.sink, stream, int(collapse), time.time(), json.dumps(payload)),
+            )
+
+        seq = cursor.lastrowid
+        assert seq is not None
+
+        rejected = await self._drain(stream)
+        self._update_metrics()
+
+        return not self._is_pending(seq) and seq not in rejected
+
+    async def _drain(self, stream: str) -> set[int]:
+        """
+        Send the pending writes of the stream, until they're all sent or one of them fails
+
+        Returns:
+            set[int]: The writes dropped because the sink rejected them
+        """
+        rejected: set[int] = set()
+
+        async with self._lock(stream):
+            while time.monotonic() >= self._retry_at:
+                row = self._connection.execute(
+                    "SELECT seq, created_at, payload FROM outbox WHERE sink = ? AND stream = ? ORDER BY seq LIMIT 1",
+                    (self.sink, stream),
+                ).fetchone()
+                if row is None:
+                    break
+
+                seq, created_at, payload = row
+
+                if time.time() - created_at > self.config.max_age_hours * 60 * 60:
+                    logger.error(
+                        f"Dropping a write to {self.sink} pending for more than {self.config.max_age_hours}h: {payload}"
+                    )
+                    OUTBOX_DROPPED.inc(sink=self.sink)
+                    self._delete(seq)
+                    continue
+
+                try:
+                    delivered = await self._send(json.loads(payload))
+                except WriteRejected as e:
+                    logger.error(
+                        f"Dropping a write rejected by {self.sink} ({e}): {payload}"
+                    )
+                    OUTBOX_DROPPED.inc(sink=self.sink)
+                    rejected.add(seq)
+                    self._delete(seq)
+                    continue
+                except Exception as e:
+                    logger.error(f"Failed to send a write to {self.sink}: {e}")
+                    logger.exception(e)
+                    delivered = False
+
+                if not delivered:
+                    self._schedule_retry()
+                    break
+
+                self._delete(seq)
+
+                if self._failures > 0:
+                    logger.info(
+                        f"{self.sink} is reachable again, replaying {self.pending} pending writes"
+                    )
+                    self._failures = 0
+
+        return rejected
+
+    def _schedule_retry(self) -> None:
+        self._failures += 1
+        delay = min(
+            self.config.max_backoff_seconds,
+            self.config.initial_backoff_seconds * 2 ** (self._failures - 1),
+        )
+        self._retry_at = time.monotonic() + delay
+
+        logger.warning(
+            f"Write to {self.sink} failed, {self.pending} writes pending (oldest: {self.oldest_pending_age:.0f}s ago). Retrying in {delay:.0f}s"
+        )
+
+        if self._retry_task is None or self._retry_task.done():
+            self._retry_task = asyncio.create_task(
+                self._retry_later(delay), name=f"outbox-retry-{self.sink}"
+            )
+
+    async def _retry_later(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+
+        # A failure while flushing schedules the next retry
+        self._retry_task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        """
+        Send the pending writes of all the streams, starting with the stream waiting the longest
+        """
+        streams = [
+            stream
+            for (stream,) in self._connection.execute(
+                "SELECT stream FROM outbox WHERE sink = ? GROUP BY stream ORDER BY MIN(seq)",
+                (self.sink,),
+            ).fetchall()
+        ]
+
+        for stream in streams:
+            if time.monotonic() < self._retry_at:
+                break
+            await self._drain(stream)
+
+        self._update_metrics()
+
+    async def close(self) -> None:
+        if self._retry_task is not None:
+            self._retry_task.cancel()
+            try:
+                await self._retry_task
+            except asyncio.CancelledError:
+                pass
+            self._retry_task = None
+
+        pending = self.pending
+        if pending > 0:
+            logger.warning(
+                f"{pending} writes to {self.sink} are still pending, they will be sent after the restart"
+            )
+
+        self._connection.close()
+
+
+# Sink -> (outbox, send functions of the actions using it)
+_outboxes: dict[str, tuple[Outbox, list[OutboxSend]]] = {}
+
+
+def acquire_outbox(config: OutboxConfig, sink: str, send: OutboxSend) -> Outbox:
+    """
+    Get the outbox of the sink.
+
+    The outbox is shared by all the actions writing to the same sink, so that
+    their writes are kept in one queue. Every call has to be paired with release_outbox.
+
+    Args:
+        config (OutboxConfig): Outbox settings of the action
+        sink (str): Name of the sink, which has to stay the same across restarts
+        send (OutboxSend): Sends a stored write to the sink, returns whether it succeeded.
+            Raises WriteRejected if the sink won't ever accept the write
+
+    Raises:
+        ValueError: If the outbox is already used with different settings
+    """
+    outbox, senders = _outboxes.get(sink, (None, []))
+
+    if outbox is None:
+        outbox = Outbox(config, sink, send)
+
+        pending = outbox.pending
+        if pending > 0:
+            logger.info(
+                f"{pending} writes to {sink} are pending from the previous run (oldest: {outbox.oldest_pending_age:.0f}s ago)"
+            )
+    elif outbox.config != config:
+        raise ValueError(
+            f"The actions writing to {sink} have different outbox settings: {outbox.config} and {config}"
+        )
+
+    _outboxes[sink] = (outbox, [*senders, send])
+    return outbox
+
+
+async def release_outbox(sink: str, send: OutboxSend) -> None:
+    """
+    Release the outbox acquired for the sink, closing it once nobody uses it.
+    The writes are sent by one of the remaining actions from then on
+    """
+    if sink not in _outboxes:
+        return
+
+    outbox, senders = _outboxes[sink]
+    senders = [sender for sender in senders if sender != send]
+
+    if not senders:
+        del _outboxes[sink]
+        await outbox.close()
+    else:
+        outbox._send = senders[0]
+        _outboxes[sink] = (outbox, senders)
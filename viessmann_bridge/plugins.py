@@ -0,0 +1,160 @@
+import importlib
+import time
+from importlib.metadata import entry_points
+from typing import Any, Callable, Optional
+
+from viessmann_bridge.action import (
+    Action,
+    ActionConfig,
+    DomoticzActionConfig,
+    HomeAssistantActionConfig,
+    MqttActionConfig,
+    TimeSeriesActionConfig,
+)
+from viessmann_bridge.logger import logger
+
+# Packages can provide their own actions with an entry point in this group, named after
+# the action_type and pointing at an ActionPlugin (e.g. my_package.plugin:plugin)
+ENTRY_POINT_GROUP = "viessmann_bridge.actions"
+
+
+class ActionPlugin:
+    """
+    An action available to the config, registered by its action_type.
+
+    Only the config model has to be imported to parse the config. The module of the action
+    (and its dependencies, e.g. aiohttp) is imported when the action is first created.
+
+    Args:
+        action_type (str): Value of action_type in the config
+        config_class (type[ActionConfig]): Config model of the action
+        action_path (str): Where the action class is, as "module:ClassName"
+    """
+
+    def __init__(
+        self, action_type: str, config_class: type[ActionConfig], action_path: str
+    ) -> None:
+        self.action_type = action_type
+        self.config_class = config_class
+        self.action_path = action_path
+
+        # The action class, taking its config
+        self._action_class: Optional[Callable[[Any], Action]] = None
+        self.import_seconds: Optional[float] = None
+
+    def load(self) -> Callable[[Any], Action]:
+        """
+        Import the module of the action (once), measuring how long it takes
+        """
+        if self._action_class is None:
+            module_name, class_name = self.action_path.split(":")
+
+            started_at = time.perf_counter()
+            module = importlib.import_module(module_name)
+            self.import_seconds = time.perf_counter() - started_at
+
+            self._action_class = getattr(module, class_name)
+            logger.info(
+                f"Loaded action {self.action_type} from {module_name} in {self.import_seconds * 1000:.0f}ms"
+            )
+
+        assert self._action_class is not None
+        return self._action_class
+
+    def create(self, config: ActionConfig) -> Action:
+        return self.load()(config)
+
+
+# Action type -> plugin
+_plugins: dict[str, ActionPlugin] = {}
+
+
+def register_action(plugin: ActionPlugin) -> None:
+    if plugin.action_type in _plugins:
+        logger.warning(f"Action {plugin.action_type} registered again, replacing it")
+    _plugins[plugin.action_type] = plugin
+
+
+def _resolve(path: str) -> Any:
+    module_name, _, attribute = path.partition(":")
+    module = importlib.import_module(module_name)
+    return getattr(module, attribute) if attribute else module
+
+
+def load_plugins(paths: list[str]) -> None:
+    """
+    Register the plugins given by their paths.
+
+    A path is either "module:attribute" pointing at an ActionPlugin, or a module
+    which registers its actions with register_action when it's imported.
+    """
+    for path in paths:
+        resolved = _resolve(path)
+        if isinstance(resolved, ActionPlugin):
+            register_action(resolved)
+
+
+def get_plugin(action_type: str) -> ActionPlugin:
+    """
+    Get the plugin of the action type, looking into the entry points if it isn't registered yet
+
+    Raises:
+        ValueError: If there's no such action
+    """
+    if action_type not in _plugins:
+        for entry_point in entry_points(group=ENTRY_POINT_GROUP, name=action_type):
+            plugin = entry_point.load()
+            if isinstance(plugin, ActionPlugin):
+                register_action(plugin)
+
+    if action_type not in _plugins:
+        raise ValueError(
+            f"Unknown action type: {action_type} (available: {', '.join(sorted(_plugins))})"
+        )
+
+    return _plugins[action_type]
+
+
+def parse_action_config(raw: Any) -> Any:
+    """
+    Validate a raw action config with the config model of its action type
+    """
+    if not isinstance(raw, dict) or "action_type" not in raw:
+        return raw
+
+    return get_plugin(raw["action_type"]).config_class.model_validate(raw)
+
+
+def create_action(config: ActionConfig) -> Action:
+    return get_plugin(config.action_type).create(config)
+
+
+def import_times() -> dict[str, float]:
+    """
+    How long the module of every loaded action took to import, in seconds
+    """
+    return {
+        action_type: plugin.import_seconds
+        for action_type, plugin in _plugins.items()
+        if plugin.import_seconds is not None
+    }
+
+
+register_action(
+    ActionPlugin("domoticz", DomoticzActionConfig, "viessmann_bridge.domoticz:Domoticz")
+)
+register_action(
+    ActionPlugin(
+        "home_assistant",
+        HomeAssistantActionConfig,
+        "viessmann_bridge.home_assistant:HomeAssistant",
+    )
+)
+register_action(ActionPlugin("mqtt", MqttActionConfig, "viessmann_bridge.mqtt:Mqtt"))
+register_action(
+    ActionPlugin(
+        "timeseries",
+        TimeSeriesActionConfig,
+        "viessmann_bridge.timeseries:TimeSeriesExport",
+    )
+)
@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+from viessmann_bridge.action import RateLimitConfig
+from viessmann_bridge.logger import logger
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket pacing the requests sent to a single target.
+
+    The refill rate is lowered (halved) when a request fails or takes longer than
+    the latency threshold, and recovers gradually back to the configured rate
+    once the target responds normally again.
+
+    Waiters are served in FIFO order, so the requests keep the order they were made in.
+    """
+
+    def __init__(self, config: RateLimitConfig, name: str) -> None:
+        self.config = config
+        self.name = name
+
+        self.rate = config.rate_per_second
+        self._tokens = float(config.burst)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            float(self.config.burst),
+            self._tokens + (now - self._updated_at) * self.rate,
+        )
+        self._updated_at = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            self._refill()
+
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+
+            self._tokens -= 1
+
+    def record(self, latency_seconds: float, success: bool) -> None:
+        """
+        Adjust the rate according to the result of a request
+
+        Args:
+            latency_seconds (float): How long the request took
+            success (bool): Whether the request succeeded
+        """
+        previous_rate = self.rate
+
+        if not success or latency_seconds > self.config.latency_threshold_seconds:
+            self.rate = max(self.config.min_rate_per_second, self.rate / 2)
+        else:
+            self.rate = min(
+                self.config.rate_per_second,
+                self.rate + self.config.rate_per_second * self.config.recovery_step,
+            )
+
+        if self.rate < previous_rate:
+            logger.warning(
+                f"Slowing down requests to {self.name}: {previous_rate:.2f}/s -> {self.rate:.2f}/s (latency: {latency_seconds:.2f}s, success: {success})"
+            )
@@ -0,0 +1,105 @@
+import gzip
+import json
+import threading
+import time
+import zlib
+from typing import Any, Iterator, Optional
+
+from viessmann_bridge.logger import logger
+
+
+class RecordedPayload:
+    """
+    A features response of a device, as it was fetched from the Viessmann API
+
+    Args:
+        recorded_at (float): When it was fetched (time.time())
+        device (str): Key of the device
+        payload (dict): The raw response
+    """
+
+    __slots__ = ("recorded_at", "device", "payload")
+
+    def __init__(self, recorded_at: float, device: str, payload: dict) -> None:
+        self.recorded_at = recorded_at
+        self.device = device
+        self.payload = payload
+
+
+class PayloadRecorder:
+    """
+    Appends the fetched payloads to a file, so that they can be replayed later.
+
+    Every payload is written as a separate gzip member holding a single JSON line - the file
+    can be read with any gzip reader, and a crash can only break the payload being written.
+    The recorder is shared by all the devices, whose fetches run in threads.
+
+    Args:
+        path (str): File the payloads are appended to
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.recorded = 0
+
+        self._lock = threading.Lock()
+        self._file = open(path, "ab")
+
+    def record(self, device: str, payload: dict) -> None:
+        line = json.dumps(
+            {"t": round(time.time(), 3), "device": device, "payload": payload},
+            separators=(",", ":"),
+        )
+        data = gzip.compress(line.encode() + b"\n")
+
+        with self._lock:
+            self._file.write(data)
+            self._file.flush()
+            self.recorded += 1
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+def record_device(device: Any, name: str, recorder: PayloadRecorder) -> None:
+    """
+    Record every features response the device fetches
+    """
+    fetch_all_features = device.service.fetch_all_features
+
+    def recorded_fetch_all_features() -> Any:
+        payload = fetch_all_features()
+
+        try:
+            recorder.record(name, payload)
+        except Exception as e:
+            # The recording must never break the bridge
+            logger.error(f"Failed to record the payload of {name}: {e}")
+
+        return payload
+
+    device.service.fetch_all_features = recorded_fetch_all_features
+
+
+def read_recording(
+    path: str, device: Optional[str] = None
+) -> Iterator[RecordedPayload]:
+    """
+    Read the recorded payloads in the order they were recorded
+
+    Args:
+        path (str): The recording
+        device (Optional[str]): Only read the payloads of this device
+    """
+    with gzip.open(path, "rt") as f:
+        try:
+            for line in f:
+                entry = json.loads(line)
+                if device is not None and entry["device"] != device:
+                    continue
+
+                yield RecordedPayload(entry["t"], entry["device"], entry["payload"])
+        except (EOFError, gzip.BadGzipFile, zlib.error, ValueError) as e:
+            # The bridge was stopped while writing the last payload
+            logger.warning(f"The recording {path} ends with a broken payload: {e}")
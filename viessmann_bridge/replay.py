@@ -0,0 +1,381 @@
+"""
+Replay of the payloads recorded with `recording_file`, through the bridge and its actions.
+
+Usage:
+    python -m viessmann_bridge.replay RECORDING [--speed 3600] [--real] [--outputs outputs.jsonl]
+
+By default the values only go to a stub action, which collects them. With --real they're
+also sent to the actions from config.yaml (the state file isn't used, so the saved state is kept).
+The report (throughput and the outputs produced) is written as JSON to stdout.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import re
+import sys
+import time
+from datetime import date, datetime
+from typing import Any, Optional
+from zoneinfo import ZoneInfo
+
+from PyViCare.PyViCareGazBoiler import GazBoiler
+from PyViCare.PyViCareService import ViCareDeviceAccessor, ViCareService
+
+from viessmann_bridge import config as bridge_config
+from viessmann_bridge.action import Action
+from viessmann_bridge.config import (
+    Config,
+    DeviceConfig,
+    ViessmannCreds,
+    close_actions,
+    get_device_actions,
+    init_actions,
+    load_config,
+)
+from viessmann_bridge.consumption import ConsumptionContext
+from viessmann_bridge.device import Device
+from viessmann_bridge.logger import logger, stop_logging
+from viessmann_bridge.recording import RecordedPayload, read_recording
+from viessmann_bridge.work import ViessmannBridge
+
+BURNER_MODULATION = re.compile(r"^heating\.burners\.(\d+)\.modulation$")
+
+
+class ReplayService(ViCareService):
+    """
+    Serves the recorded payload set last, instead of fetching it from the API
+    """
+
+    def __init__(self) -> None:
+        # Nothing is fetched, so there's no OAuth session
+        super().__init__(
+            None,  # type: ignore[arg-type]
+            ViCareDeviceAccessor(0, "replay", "0"),
+            ["type:boiler"],
+        )
+        self.payload: dict = {"data": []}
+
+    def fetch_all_features(self) -> Any:
+        return self.payload
+
+
+class OutputCollector(Action):
+    """
+    Stub action keeping every value it's given, with the recorded time of the payload
+    it came from
+
+    Args:
+        device (str): Key of the device
+        outputs (Optional[list[dict]]): Where the outputs are kept (all of them, if given)
+    """
+
+    def __init__(self, device: str, outputs: Optional[list[dict]] = None) -> None:
+        self.device = device
+        self.outputs = outputs
+        self.counts: dict[str, int] = {}
+        self.last: dict[str, dict] = {}
+        # Recorded time of the payload being replayed
+        self.recorded_at = 0.0
+
+    async def init(self) -> None:
+        pass
+
+    def _collect(self, kind: str, **values: Any) -> None:
+        output = {"t": self.recorded_at, "device": self.device, "kind": kind, **values}
+
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        self.last[kind] = output
+        if self.outputs is not None:
+            self.outputs.append(output)
+
+    async def update_current_total_consumption(
+        self,
+        consumption_context: ConsumptionContext,
+        total_consumption: int,
+        today: int,
+    ) -> None:
+        self._collect(
+            "current_total_consumption",
+            total_consumption=total_consumption,
+            today=today,
+        )
+
+    async def update_current_total_consumption_increasing(
+        self, consumption_context: ConsumptionContext, consumption_increase_offset: int
+    ) -> None:
+        self._collect(
+            "current_total_consumption_increasing",
+            consumption_increase_offset=consumption_increase_offset,
+        )
+
+    async def update_daily_consumption_stats(
+        self, consumption_context: ConsumptionContext, consumption: dict[date, int]
+    ):
+        self._collect(
+            "daily_consumption_stats",
+            consumption={day.isoformat(): value for day, value in consumption.items()},
+        )
+
+    async def handle_consumption_midnight_case(
+        self,
+        consumption_context: ConsumptionContext,
+        previous_day_new_value: int,
+        offset_previous_day: int,
+        current_day_value: int,
+        total_counter: int,
+    ):
+        self._collect(
+            "consumption_midnight_case",
+            previous_day_new_value=previous_day_new_value,
+            offset_previous_day=offset_previous_day,
+            current_day_value=current_day_value,
+            total_counter=total_counter,
+        )
+
+    async def handle_burners_modulations(
+        self, burners_modulations: list[int], timestamp: Optional[datetime] = None
+    ):
+        self._collect("burners_modulations", burners_modulations=burners_modulations)
+
+    async def handle_boiler_temperature(
+        self, boiler_temperature: float, timestamp: Optional[datetime] = None
+    ):
+        self._collect("boiler_temperature", boiler_temperature=boiler_temperature)
+
+
+def _number_of_burners(payload: dict) -> int:
+    burners = [
+        int(match.group(1))
+        for feature in payload.get("data", [])
+        if (match := BURNER_MODULATION.match(feature.get("feature", "")))
+    ]
+    return max(burners, default=0) + 1
+
+
+class Replay:
+    """
+    Feeds the recorded payloads to a bridge per device, in the order they were recorded
+
+    Args:
+        payloads (list[RecordedPayload]): The recording
+        devices_config (list[DeviceConfig]): The devices to replay (the others are skipped)
+        actions (dict[str, list[Action]]): Device key -> its actions, besides the collector
+        speed (Optional[float]): How many times faster than recorded, or None for as fast as possible
+        keep_outputs (bool): Whether to keep every output, not only the counts
+    """
+
+    def __init__(
+        self,
+        payloads: list[RecordedPayload],
+        devices_config: list[DeviceConfig],
+        actions: dict[str, list[Action]],
+        speed: Optional[float] = None,
+        keep_outputs: bool = False,
+    ) -> None:
+        self.speed = speed
+        self.outputs: Optional[list[dict]] = [] if keep_outputs else None
+
+        self.collectors: dict[str, OutputCollector] = {}
+        self.services: dict[str, ReplayService] = {}
+        self.bridges: dict[str, ViessmannBridge] = {}
+
+        for device_config in devices_config:
+            service = ReplayService()
+            collector = OutputCollector(device_config.key, self.outputs)
+
+            self.services[device_config.key] = service
+            self.collectors[device_config.key] = collector
+            self.bridges[device_config.key] = ViessmannBridge(
+                Device(GazBoiler(service)),
+                device_config,
+                [*actions.get(device_config.key, []), collector],
+            )
+
+        self.payloads = [entry for entry in payloads if entry.device in self.bridges]
+        self.replayed = 0
+        self.errors = 0
+        self.wall_seconds = 0.0
+
+    async def _replay_payload(self, entry: RecordedPayload) -> None:
+        bridge = self.bridges[entry.device]
+        self.services[entry.device].payload = entry.payload
+        self.collectors[entry.device].recorded_at = entry.recorded_at
+        bridge.device.invalidate_snapshot()
+
+        # The same handlers as the scheduler runs, one after another
+        for handler in (
+            bridge.handle_gas_usage,
+            bridge.handle_burners,
+            bridge.handle_boiler_temperature,
+        ):
+            try:
+                await handler()
+            except Exception as e:
+                self.errors += 1
+                logger.error(
+                    f"[{entry.device}] Failed to replay the payload recorded at {entry.recorded_at}: {e}"
+                )
+        bridge.end_cycle()
+
+        # The outputs are attributed to the payload they came from
+        await bridge.dispatcher.join()
+
+    async def run(self) -> None:
+        for bridge in self.bridges.values():
+            bridge.dispatcher.start()
+
+        started_at = time.monotonic()
+
+        try:
+            for entry in self.payloads:
+                if self.speed:
+                    # Wait until the payload is due, keeping the recorded spacing (sped up)
+                    due_in = (
+                        entry.recorded_at - self.payloads[0].recorded_at
+                    ) / self.speed - (time.monotonic() - started_at)
+                    if due_in > 0:
+                        await asyncio.sleep(due_in)
+
+                await self._replay_payload(entry)
+                self.replayed += 1
+        finally:
+            self.wall_seconds = time.monotonic() - started_at
+
+            for bridge in self.bridges.values():
+                await bridge.dispatcher.stop()
+
+    def report(self) -> dict:
+        recorded_seconds = (
+            self.payloads[-1].recorded_at - self.payloads[0].recorded_at
+            if self.payloads
+            else 0
+        )
+
+        return {
+            "snapshots": self.replayed,
+            "errors": self.errors,
+            "wall_seconds": round(self.wall_seconds, 6),
+            "snapshots_per_second": round(self.replayed / self.wall_seconds, 1)
+            if self.wall_seconds
+            else None,
+            "recorded_seconds": round(recorded_seconds, 3),
+            "speed_up": round(recorded_seconds / self.wall_seconds, 1)
+            if self.wall_seconds
+            else None,
+            "devices": {
+                key: {
+                    "total_consumption": self.bridges[
+                        key
+                    ].consumption_context.total_consumption,
+                    "outputs": collector.counts,
+                    "last_outputs": collector.last,
+                }
+                for key, collector in self.collectors.items()
+            },
+        }
+
+
+def _stub_config(payloads: list[RecordedPayload], timezone: str) -> Config:
+    """
+    Config with a device for every device found in the recording, without any actions
+    """
+    burners: dict[str, int] = {}
+    for entry in payloads:
+        burners.setdefault(entry.device, _number_of_burners(entry.payload))
+
+    return Config(
+        timezone=ZoneInfo(timezone),
+        viessmann_creds=ViessmannCreds(username="", password="", client_id=""),
+        state_file=None,
+        devices=[
+            DeviceConfig(name=key, number_of_burners=number_of_burners)
+            for key, number_of_burners in burners.items()
+        ],
+    )
+
+
+async def replay(args: argparse.Namespace) -> dict:
+    payloads = list(read_recording(args.recording))
+    logger.info(f"Read {len(payloads)} payloads from {args.recording}")
+
+    actions: dict[str, list[Action]] = {}
+    if args.real:
+        config = await load_config()
+        # The replayed state must not replace the state saved by the bridge
+        config.state_file = None
+        logger.setLevel(args.log_level.upper())
+        await init_actions()
+        actions = {
+            device.key: get_device_actions(device) for device in config.get_devices()
+        }
+    else:
+        config = _stub_config(payloads, args.timezone)
+        bridge_config.GlobalConfig = config
+
+    # Only the devices in both the config and the recording are replayed
+    recorded_devices = {entry.device for entry in payloads}
+    run = Replay(
+        payloads,
+        [device for device in config.get_devices() if device.key in recorded_devices],
+        actions,
+        args.speed,
+        args.outputs is not None,
+    )
+
+    try:
+        await run.run()
+    finally:
+        if args.real:
+            await close_actions()
+            stop_logging()
+
+    if args.outputs is not None and run.outputs is not None:
+        with open(args.outputs, "w") as f:
+            for output in run.outputs:
+                f.write(json.dumps(output, default=str) + "\n")
+
+    return run.report()
+
+
+def main() -> None:
+    assert __doc__ is not None
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("recording", help="File written with recording_file")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        help="How many times faster than recorded (e.g. 3600 - an hour per second). As fast as possible by default",
+    )
+    parser.add_argument(
+        "--real",
+        action="store_true",
+        help="Also send the values to the actions from config.yaml",
+    )
+    parser.add_argument(
+        "--outputs", help="Write every output (as JSON lines) to the file"
+    )
+    parser.add_argument(
+        "--timezone",
+        default="UTC",
+        help="Timezone of the stub config (config.yaml's is used with --real)",
+    )
+    parser.add_argument(
+        "--log-level", default="WARNING", help="Log level of the bridge"
+    )
+    args = parser.parse_args()
+
+    logger.setLevel(getattr(logging, args.log_level.upper()))
+
+    report = asyncio.run(replay(args))
+    print(json.dumps(report, indent=2, default=str))
+    print(
+        f"Replayed {report['snapshots']} snapshots in {report['wall_seconds']:.3f}s"
+        f" ({report['snapshots_per_second']} snapshots/s)",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
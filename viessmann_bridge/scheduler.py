@@ -0,0 +1,162 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional
+
+from viessmann_bridge.api_budget import ApiBudget
+from viessmann_bridge.logger import logger
+from viessmann_bridge.metrics import (
+    CYCLE_DURATION_SECONDS,
+    JOB_LATENESS_SECONDS,
+    JOB_SKIPPED_TICKS,
+)
+
+# The settling after a run ends this long before the next tick, so that the tick isn't missed
+SETTLE_MARGIN_SECONDS = 1
+
+
+class ScheduledJob:
+    def __init__(
+        self, name: str, interval_seconds: float, run: Callable[[], Awaitable[None]]
+    ) -> None:
+        self.name = name
+        self.interval_seconds = interval_seconds
+        self.run = run
+
+        self.runs = 0
+        self.skipped_ticks = 0
+        self.last_lateness_seconds = 0.0
+        self.max_lateness_seconds = 0.0
+        self.last_duration_seconds = 0.0
+
+
+class Scheduler:
+    """
+    Runs every job on its own cadence, aligned to the wall-clock boundaries
+    of its interval (e.g. every full 5 minutes for a 300 seconds interval).
+
+    The ticks are computed from the boundaries rather than from the end of the
+    previous run, so the schedule doesn't drift. If a run takes longer than the
+    interval, the ticks it overran are skipped instead of being run one after another.
+
+    If an API budget is given, all the intervals are stretched to stay under its
+    daily limit, and the ticks are skipped while the API must not be called.
+
+    If `settle` is given, it's awaited after every run with the time left until the job's
+    next tick (e.g. to wait until the actions handled the values), and counts into the run's duration.
+    """
+
+    def __init__(
+        self,
+        jobs: list[ScheduledJob],
+        budget: Optional[ApiBudget] = None,
+        lateness_warning_seconds: float = 5,
+        name: str = "",
+        settle: Optional[Callable[[float], Awaitable[object]]] = None,
+    ):
+        self.jobs = jobs
+        self.budget = budget
+        self.settle = settle
+        # Name of the device the jobs belong to, used in the metrics
+        self.name = name
+        self.lateness_warning_seconds = lateness_warning_seconds
+
+        self.interval_scale = 1.0
+
+    def _interval(self, job: ScheduledJob) -> float:
+        if self.budget is not None:
+            scale = self.budget.interval_scale(self.interval_scale)
+
+            if abs(scale - self.interval_scale) >= 0.05:
+                logger.warning(
+                    f"Stretching the poll intervals by {scale:.2f}x to stay within the API budget ({self.budget.remaining} calls remaining)"
+                    if scale > 1
+                    else "The poll intervals are back to normal"
+                )
+                self.interval_scale = scale
+
+        return job.interval_seconds * self.interval_scale
+
+    @staticmethod
+    def _next_boundary(now: float, interval_seconds: float) -> float:
+        return (now // interval_seconds + 1) * interval_seconds
+
+    def _skip_ticks(self, job: ScheduledJob, skipped: int) -> None:
+        job.skipped_ticks += skipped
+        JOB_SKIPPED_TICKS.inc(skipped, device=self.name, job=job.name)
+
+    async def run_forever(self) -> None:
+        await asyncio.gather(*[self._run_job(job) for job in self.jobs])
+
+    async def _run_once(self, job: ScheduledJob, deadline: float) -> None:
+        """
+        Run the job, and settle until the deadline (wall-clock time of the next tick)
+        """
+        started_at = time.monotonic()
+
+        try:
+            await job.run()
+        except Exception as e:
+            logger.error(f"Job {job.name} failed: {e}")
+            logger.exception(e)
+
+        if self.settle is not None:
+            await self.settle(max(0.0, deadline - time.time() - SETTLE_MARGIN_SECONDS))
+
+        job.runs += 1
+        job.last_duration_seconds = time.monotonic() - started_at
+        CYCLE_DURATION_SECONDS.observe(
+            job.last_duration_seconds, device=self.name, job=job.name
+        )
+
+    async def _run_job(self, job: ScheduledJob) -> None:
+        # Run right away on start, and from then on at the interval's boundaries
+        next_tick = self._next_boundary(time.time(), self._interval(job))
+        await self._run_once(job, next_tick)
+        interval = self._interval(job)
+        next_tick = self._next_boundary(time.time(), interval)
+
+        while True:
+            await asyncio.sleep(max(0.0, next_tick - time.time()))
+
+            lateness = max(0.0, time.time() - next_tick)
+            job.last_lateness_seconds = lateness
+            job.max_lateness_seconds = max(job.max_lateness_seconds, lateness)
+            JOB_LATENESS_SECONDS.set(lateness, device=self.name, job=job.name)
+
+            if lateness > self.lateness_warning_seconds:
+                logger.warning(f"Job {job.name} started {lateness:.2f}s late")
+
+            blocked_for = self.budget.blocked_for() if self.budget is not None else 0
+            if blocked_for > 0:
+                self._skip_ticks(job, 1)
+                logger.warning(
+                    f"Skipping job {job.name}, the Viessmann API can't be called for {blocked_for:.0f}s"
+                )
+            else:
+                await self._run_once(job, next_tick + interval)
+
+                logger.debug(
+                    "Job %s done in %.2fs (lateness: %.3fs, max: %.3fs)",
+                    job.name,
+                    job.last_duration_seconds,
+                    lateness,
+                    job.max_lateness_seconds,
+                )
+
+            new_interval = self._interval(job)
+            if new_interval != interval:
+                # The intervals were rescaled - the tick is moved to the new grid, so that
+                # the ticks aren't counted as skipped just because they're further apart
+                interval = new_interval
+                next_tick = next_tick // interval * interval
+
+            following_tick = self._next_boundary(max(time.time(), next_tick), interval)
+
+            skipped = round((following_tick - next_tick) / interval) - 1
+            if skipped > 0:
+                self._skip_ticks(job, skipped)
+                logger.warning(
+                    f"Job {job.name} overran its interval ({job.last_duration_seconds:.2f}s), skipping {skipped} tick(s)"
+                )
+
+            next_tick = following_tick
@@ -0,0 +1,169 @@
+import json
+import sqlite3
+import time
+from datetime import date
+from typing import Any, Optional
+
+from pydantic import BaseModel
+
+from viessmann_bridge.consumption import ConsumptionContext
+from viessmann_bridge.logger import logger
+
+
+class ConsumptionState(BaseModel):
+    total_consumption: int = 0
+    previous_total_consumption: int = 0
+    previous_consumption_daily: list[int] = []
+    previous_consumption_date: Optional[date] = None
+
+    # Sink name -> the last total counter value the sink acknowledged
+    acknowledged: dict[str, int] = {}
+
+
+class StateJournal:
+    """
+    Durable, append-only journal of the consumption state, stored in SQLite.
+
+    Every change is appended as a new entry, and the entries are periodically
+    folded into a single snapshot, so that restoring the state only has to
+    read the snapshot and a handful of entries.
+
+    Multiple devices can share the same file, each one having its own state.
+    """
+
+    def __init__(self, path: str, device: str, snapshot_every: int = 100) -> None:
+        self.path = path
+        self.device = device
+        self.snapshot_every = snapshot_every
+
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS snapshot (device TEXT PRIMARY KEY, state TEXT NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS journal (seq INTEGER PRIMARY KEY AUTOINCREMENT, device TEXT NOT NULL, recorded_at REAL NOT NULL, entry TEXT NOT NULL)"
+        )
+        self._connection.commit()
+
+        self._state = self._read_state()
+        self._entries_since_snapshot = self._connection.execute(
+            "SELECT COUNT(*) FROM journal WHERE device = ?", (device,)
+        ).fetchone()[0]
+
+    def _read_state(self) -> Optional[ConsumptionState]:
+        row = self._connection.execute(
+            "SELECT state FROM snapshot WHERE device = ?", (self.device,)
+        ).fetchone()
+        state: Optional[dict[str, Any]] = json.loads(row[0]) if row else None
+
+        for (entry,) in self._connection.execute(
+            "SELECT entry FROM journal WHERE device = ? ORDER BY seq", (self.device,)
+        ):
+            state = self._apply(state or {}, json.loads(entry))
+
+        if state is None:
+            return None
+
+        return ConsumptionState.model_validate(state)
+
+    @staticmethod
+    def _apply(state: dict[str, Any], entry: dict[str, Any]) -> dict[str, Any]:
+        acknowledged = {
+            **state.get("acknowledged", {}),
+            **entry.pop("acknowledged", {}),
+        }
+        return {**state, **entry, "acknowledged": acknowledged}
+
+    @property
+    def state(self) -> Optional[ConsumptionState]:
+        """
+        The restored (and since then updated) state, None if nothing has been recorded yet
+        """
+        return self._state
+
+    def _append(self, entry: dict[str, Any]) -> None:
+        serialized = json.dumps(entry, default=str)
+
+        self._state = ConsumptionState.model_validate(
+            self._apply(
+                self._state.model_dump(mode="json") if self._state else {},
+                json.loads(serialized),
+            )
+        )
+
+        with self._connection:
+            self._connection.execute(
+                "INSERT INTO journal (device, recorded_at, entry) VALUES (?, ?, ?)",
+                (self.device, time.time(), serialized),
+            )
+        self._entries_since_snapshot += 1
+
+        if self._entries_since_snapshot >= self.snapshot_every:
+            self.compact()
+
+    def compact(self) -> None:
+        """
+        Fold the journal entries into the snapshot
+        """
+        if self._state is None:
+            return
+
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO snapshot (device, state) VALUES (?, ?)",
+                (self.device, self._state.model_dump_json()),
+            )
+            self._connection.execute(
+                "DELETE FROM journal WHERE device = ?", (self.device,)
+            )
+
+        logger.debug(
+            "Compacted the state journal (%s entries)", self._entries_since_snapshot
+        )
+        self._entries_since_snapshot = 0
+
+    def record_context(self, ctx: ConsumptionContext) -> None:
+        self._append(
+            {
+                "total_consumption": ctx.total_consumption,
+                "previous_total_consumption": ctx.previous_total_consumption,
+                "previous_consumption_daily": ctx.previous_consumption_daily,
+                "previous_consumption_date": ctx.previous_consumption_date,
+            }
+        )
+
+    def acknowledge(self, sink: str, total_consumption: int) -> None:
+        """
+        Record the last total counter value the sink has handled
+        """
+        if self._state is not None and (
+            self._state.acknowledged.get(sink) == total_consumption
+        ):
+            return
+
+        self._append({"acknowledged": {sink: total_consumption}})
+
+    def restore_context(self, ctx: ConsumptionContext) -> bool:
+        """
+        Restore the consumption context from the journal
+
+        Returns:
+            bool: Whether there was any state to restore
+        """
+        if self._state is None or self._state.previous_consumption_date is None:
+            return False
+
+        ctx.total_consumption = self._state.total_consumption
+        ctx.previous_total_consumption = self._state.previous_total_consumption
+        ctx.history.restore(
+            self._state.previous_consumption_date,
+            self._state.previous_consumption_daily,
+        )
+
+        return True
+
+    def close(self) -> None:
+        self.compact()
+        self._connection.close()
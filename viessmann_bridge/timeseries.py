@@ -0,0 +1,314 @@
+import asyncio
+import gzip
+import json
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+import aiohttp
+
+from viessmann_bridge.action import Action, TimeSeriesActionConfig
+from viessmann_bridge.consumption import ConsumptionContext
+from viessmann_bridge.http_session import acquire_session, release_session
+from viessmann_bridge.logger import logger
+from viessmann_bridge.outbox import (
+    Outbox,
+    WriteRejected,
+    acquire_outbox,
+    is_permanent_failure,
+    release_outbox,
+)
+
+
+def _escape(value: str, characters: str) -> str:
+    for character in "\\" + characters:
+        value = value.replace(character, f"\\{character}")
+    return value
+
+
+class TimeSeriesExport(Action):
+    """
+    Exports every reading as a time series point, with the timestamp given by Viessmann.
+
+    The points are buffered and sent in batches (InfluxDB line protocol or newline-delimited JSON),
+    when the batch is full or the flush interval passes. The batches go through the outbox,
+    so they're kept until the server accepts them.
+    """
+
+    config: TimeSeriesActionConfig
+
+    def __init__(self, config: TimeSeriesActionConfig) -> None:
+        self.config = config
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._outbox: Optional[Outbox] = None
+        self._sink = f"timeseries {config.name or config.url}"
+        self._timezone = config.timezone or ZoneInfo("UTC")
+
+        # Serialized points waiting for the next batch
+        self._buffer: list[str] = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+        # The session might be shared with other actions, so the headers are sent with each request
+        self._headers = {
+            **config.headers,
+            "Content-Type": "text/plain; charset=utf-8"
+            if config.format == "line_protocol"
+            else "application/x-ndjson",
+        }
+        if config.gzip:
+            self._headers["Content-Encoding"] = "gzip"
+
+    async def init(self) -> None:
+        self._get_session()
+
+        if self.config.outbox.path is not None:
+            self._outbox = acquire_outbox(self.config.outbox, self._sink, self._send)
+            # Replay the batches which couldn't be sent before the restart
+            await self._outbox.flush()
+
+        self._flush_task = asyncio.create_task(
+            self._flush_periodically(), name=f"timeseries-flush-{self.config.url}"
+        )
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+
+        # Don't lose the points buffered since the last flush
+        await self.flush()
+
+        if self._outbox is not None:
+            await release_outbox(self._sink, self._send)
+            self._outbox = None
+
+        if self._session is not None:
+            await release_session(self.config.url)
+            self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Acquired only once - the shared session stays open until every action released it
+        if self._session is None:
+            self._session = acquire_session(self.config.url, self.config.http)
+        return self._session
+
+    def _serialize(
+        self,
+        fields: dict[str, float],
+        timestamp: datetime,
+        tags: Optional[dict[str, str]] = None,
+    ) -> str:
+        """
+        Serialize a single point in the configured format.
+
+        All the values are sent as floats, so that the type of a field never changes
+        (InfluxDB rejects e.g. a float written to a field holding integers).
+        """
+        tags = {**self.config.tags, **(tags or {})}
+        seconds = int(timestamp.timestamp())
+
+        if self.config.format == "ndjson":
+            return json.dumps(
+                {
+                    "measurement": self.config.measurement,
+                    "tags": tags,
+                    "fields": {name: float(value) for name, value in fields.items()},
+                    "timestamp": seconds,
+                }
+            )
+
+        series = _escape(self.config.measurement, ", ") + "".join(
+            f",{_escape(key, ',= ')}={_escape(value, ',= ')}"
+            for key, value in sorted(tags.items())
+        )
+        field_set = ",".join(
+            f"{_escape(name, ',= ')}={float(value)!r}" for name, value in fields.items()
+        )
+
+        return f"{series} {field_set} {seconds}"
+
+    async def _add(self, points: list[str]) -> None:
+        self._buffer.extend(points)
+
+        if len(self._buffer) >= self.config.batch_size:
+            await self.flush()
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.config.flush_interval_seconds)
+
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush the points to {self.config.url}: {e}")
+                logger.exception(e)
+
+    async def flush(self) -> None:
+        """
+        Send the buffered points, in batches of at most batch_size points
+        """
+        async with self._flush_lock:
+            while self._buffer:
+                batch = self._buffer[: self.config.batch_size]
+                del self._buffer[: self.config.batch_size]
+
+                body = "\n".join(batch) + "\n"
+                if self._outbox is None:
+                    try:
+                        await self._send(body)
+                    except WriteRejected:
+                        pass
+                else:
+                    await self._outbox.put("batch", body)
+
+    async def _send(self, body: str) -> bool:
+        """
+        Send a batch of points
+
+        Returns:
+            bool: Whether the server accepted the batch
+
+        Raises:
+            WriteRejected: If the server refused the batch (HTTP 4xx, e.g. malformed points)
+        """
+        data = body.encode()
+        if self.config.gzip:
+            data = gzip.compress(data)
+
+        points = body.count("\n")
+        status: Optional[int] = None
+        logger.debug(
+            "Sending %s points to %s (%s bytes)", points, self.config.url, len(data)
+        )
+
+        try:
+            async with self._get_session().post(
+                self.config.url, data=data, headers=self._headers
+            ) as response:
+                if 200 <= response.status < 300:
+                    return True
+
+                status = response.status
+                logger.error(
+                    f"Failed to send the points to {self.config.url}: {response.status} {await response.text()}"
+                )
+        except Exception as e:
+            logger.error(f"Failed to send the points to {self.config.url}: {e}")
+            logger.exception(e)
+
+        if status is not None and is_permanent_failure(status):
+            raise WriteRejected(f"HTTP {status}")
+
+        return False
+
+    def _day_timestamp(self, day: date) -> datetime:
+        return datetime.combine(day, time(), self._timezone)
+
+    def _reading_timestamp(self, consumption_context: ConsumptionContext) -> datetime:
+        if consumption_context.gas_consumption is not None:
+            return consumption_context.gas_consumption.timestamp
+
+        return datetime.now(timezone.utc)
+
+    async def update_current_total_consumption(
+        self,
+        consumption_context: ConsumptionContext,
+        total_consumption: int,
+        today: int,
+    ) -> None:
+        logger.debug("Updating current total consumption: %s", total_consumption)
+
+        await self._add(
+            [
+                self._serialize(
+                    {
+                        "total_consumption_kwh": total_consumption,
+                        "today_consumption_kwh": today,
+                    },
+                    self._reading_timestamp(consumption_context),
+                )
+            ]
+        )
+
+    async def update_current_total_consumption_increasing(
+        self, consumption_context: ConsumptionContext, consumption_increase_offset: int
+    ) -> None:
+        await self._add(
+            [
+                self._serialize(
+                    {"consumption_increase_kwh": consumption_increase_offset},
+                    self._reading_timestamp(consumption_context),
+                )
+            ]
+        )
+
+    async def update_daily_consumption_stats(
+        self, consumption_context: ConsumptionContext, consumption: dict[date, int]
+    ):
+        logger.debug("Updating daily consumption stats: %s", consumption)
+
+        # Every day is a point at its start, so a day sent again just overwrites its previous value
+        await self._add(
+            [
+                self._serialize(
+                    {"daily_consumption_kwh": value}, self._day_timestamp(day)
+                )
+                for day, value in sorted(consumption.items())
+            ]
+        )
+
+    async def handle_consumption_midnight_case(
+        self,
+        consumption_context: ConsumptionContext,
+        previous_day_new_value: int,
+        offset_previous_day: int,
+        current_day_value: int,
+        total_counter: int,
+    ):
+        assert consumption_context.gas_consumption is not None
+
+        today = consumption_context.gas_consumption.day_readat.date()
+        daily_values = {
+            today - timedelta(days=i): consumption_context.gas_consumption.day[i]
+            for i in range(len(consumption_context.gas_consumption.day))
+        }
+
+        await self.update_daily_consumption_stats(consumption_context, daily_values)
+        await self.update_current_total_consumption(
+            consumption_context, total_counter, current_day_value
+        )
+
+    async def handle_burners_modulations(
+        self, burners_modulations: list[int], timestamp: Optional[datetime] = None
+    ):
+        logger.debug("Handling burners modulations: %s", burners_modulations)
+
+        await self._add(
+            [
+                self._serialize(
+                    {"modulation_percent": modulation},
+                    timestamp or datetime.now(timezone.utc),
+                    {"burner": str(i)},
+                )
+                for i, modulation in enumerate(burners_modulations)
+            ]
+        )
+
+    async def handle_boiler_temperature(
+        self, boiler_temperature: float, timestamp: Optional[datetime] = None
+    ):
+        logger.debug("Handling boiler temperature: %s", boiler_temperature)
+
+        await self._add(
+            [
+                self._serialize(
+                    {"boiler_temperature_celsius": boiler_temperature},
+                    timestamp or datetime.now(timezone.utc),
+                )
+            ]
+        )
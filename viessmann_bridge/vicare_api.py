@@ -1,30 +1,161 @@
+import json
+from typing import Optional
+
 from PyViCare.PyViCare import PyViCare
+from PyViCare.PyViCareAbstractOAuthManager import AbstractViCareOAuthManager
+from PyViCare.PyViCareDeviceConfig import PyViCareDeviceConfig
 from PyViCare.PyViCareGazBoiler import GazBoiler
+from PyViCare.PyViCareOAuthManager import ViCareOAuthManager
+from PyViCare.PyViCareService import ViCareDeviceAccessor, ViCareService
 
+from viessmann_bridge.api_budget import ApiBudget, count_api_calls
 from viessmann_bridge.logger import logger
-from viessmann_bridge.config import Config
+from viessmann_bridge.config import Config, DeviceConfig
 from viessmann_bridge.device import Device
+from viessmann_bridge.metrics import instrument_device
+from viessmann_bridge.recording import PayloadRecorder, record_device
 
 
-def init_vicare_device(config: Config) -> Device:
-    client = PyViCare()
-    client.initWithCredentials(
+def init_vicare_oauth(
+    config: Config, budget: Optional[ApiBudget] = None
+) -> AbstractViCareOAuthManager:
+    """
+    Log in to the Viessmann API once - the session is shared by all the devices.
+
+    The token is saved to token.save, so a restart reuses it instead of logging in again.
+    """
+    oauth_manager = ViCareOAuthManager(
         config.viessmann_creds.username,
         config.viessmann_creds.password,
         config.viessmann_creds.client_id,
         "token.save",
     )
+    if budget is not None:
+        count_api_calls(oauth_manager, budget)
+
+    return oauth_manager
+
+
+def _load_device_cache(path: Optional[str]) -> dict[str, dict]:
+    if path is None:
+        return {}
+
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Couldn't read the device cache: {e}")
+        return {}
+
+
+def _save_device_cache(path: Optional[str], cache: dict[str, dict]) -> None:
+    if path is None:
+        return
+
+    try:
+        with open(path, "w") as f:
+            json.dump(cache, f, indent=2)
+    except OSError as e:
+        logger.warning(f"Couldn't save the device cache: {e}")
+
+
+def _detect_devices(
+    oauth_manager: AbstractViCareOAuthManager, cache: dict[str, dict]
+) -> None:
+    """
+    List the installations (a single API call) and put all the devices found into the cache
+    """
+    client = PyViCare()
+    # The features are cached by the Device's snapshot instead, so that
+    # every poll cycle uses a single API call
+    client.setCacheDuration(0)
+    client.initWithExternalOAuth(oauth_manager)
 
-    device_obj = client.devices[config.device_index]
-    logger.info(
-        f"Connected to device {device_obj.getModel()}. It's currently {'online' if device_obj.isOnline() else 'offline'}"
+    for index, device_obj in enumerate(client.devices):
+        accessor = device_obj.service.accessor
+        cache[str(index)] = {
+            "installation_id": accessor.id,
+            "gateway_serial": accessor.serial,
+            "device_id": accessor.device_id,
+            "model": device_obj.getModel(),
+            "roles": device_obj.service.roles,
+        }
+
+        logger.info(
+            f"Found device {index} ({device_obj.getModel()}). It's currently {'online' if device_obj.isOnline() else 'offline'}"
+        )
+
+
+def init_vicare_devices(
+    oauth_manager: AbstractViCareOAuthManager, config: Config
+) -> dict[str, Device]:
+    """
+    Set up all the configured devices.
+
+    The detected devices are kept in the device cache, so that the next start
+    doesn't need to list the installations again. Delete the cache file if the devices change.
+
+    Returns:
+        dict[str, Device]: Device key -> the device
+    """
+    cache = _load_device_cache(config.device_cache_file)
+    devices_config = config.get_devices()
+
+    if any(str(device.device_index) not in cache for device in devices_config):
+        _detect_devices(oauth_manager, cache)
+        _save_device_cache(config.device_cache_file, cache)
+    else:
+        logger.info(f"Using the devices cached in {config.device_cache_file}")
+
+    recorder: Optional[PayloadRecorder] = None
+    if config.recording_file is not None:
+        recorder = PayloadRecorder(config.recording_file)
+        logger.info(f"Recording the fetched payloads to {config.recording_file}")
+
+    return {
+        device_config.key: init_vicare_device(
+            oauth_manager, config, device_config, cache, recorder
+        )
+        for device_config in devices_config
+    }
+
+
+def init_vicare_device(
+    oauth_manager: AbstractViCareOAuthManager,
+    config: Config,
+    device_config: DeviceConfig,
+    cache: dict[str, dict],
+    recorder: Optional[PayloadRecorder] = None,
+) -> Device:
+    cached = cache.get(str(device_config.device_index))
+    if cached is None:
+        raise ValueError(
+            f"Device {device_config.key} (index {device_config.device_index}) not found"
+        )
+
+    service = ViCareService(
+        oauth_manager,
+        ViCareDeviceAccessor(
+            cached["installation_id"], cached["gateway_serial"], cached["device_id"]
+        ),
+        cached["roles"],
+    )
+    # The type is detected from the model and the roles, without calling the API
+    device_obj = PyViCareDeviceConfig(
+        service, cached["device_id"], cached["model"], None
     )
+    logger.info(f"Connected to device {device_config.key} ({device_obj.getModel()})")
 
     # Ensure it's a gas boiler as we only support gas boilers for now
     auto_device = device_obj.asAutoDetectDevice()
 
     if not isinstance(auto_device, GazBoiler):
-        raise ValueError("Device is not a Gas Boiler")
+        raise ValueError(f"Device {device_config.key} is not a Gas Boiler")
 
-    device = Device(auto_device)
+    device = Device(auto_device, config.features_cache_ttl_seconds)
+    instrument_device(device, device_config.key)
+    if recorder is not None:
+        record_device(device, device_config.key, recorder)
     return device
@@ -1,122 +1,327 @@
 import asyncio
-from datetime import datetime, timedelta
-from viessmann_bridge.config import get_actions, get_config
-from viessmann_bridge.consumption import ConsumptionContext
+import copy
+import time
+from datetime import timedelta
+from typing import Awaitable, Callable, Optional
+from viessmann_bridge.action import Action
+from viessmann_bridge.config import DeviceConfig, get_config
+from viessmann_bridge.consumption import ConsumptionContext, ConsumptionSnapshot
+from viessmann_bridge.api_budget import ApiBudget
+from viessmann_bridge.change_filter import ChangeFilter
 from viessmann_bridge.device import Device
+from viessmann_bridge.dispatcher import END_CYCLE, ActionDispatcher
+from viessmann_bridge.local_api import SNAPSHOTS
 from viessmann_bridge.logger import logger
+from viessmann_bridge.metrics import (
+    LAST_SUCCESSFUL_POLL,
+    MIDNIGHT_ROLLOVERS,
+    TIME_TO_FIRST_PUBLISH,
+    TOTAL_CONSUMPTION,
+)
+from viessmann_bridge.scheduler import ScheduledJob, Scheduler
+from viessmann_bridge.state_journal import StateJournal
 
 
 class ViessmannBridge:
-    consumption_context: ConsumptionContext = ConsumptionContext()
-
-    def __init__(self, device: Device):
+    """
+    Polls a single heating device and passes its data to the device's actions
+    """
+
+    def __init__(
+        self,
+        device: Device,
+        device_config: DeviceConfig,
+        actions: list[Action],
+        budget: Optional[ApiBudget] = None,
+        started_at: Optional[float] = None,
+    ):
         self.device = device
+        self.device_config = device_config
+        self.name = device_config.key
+        self.budget = budget
+        self.consumption_context = ConsumptionContext()
+        self.scheduler: Optional[Scheduler] = None
+
+        # When the bridge started (time.monotonic()), to report how long the first value took
+        self.started_at = started_at if started_at is not None else time.monotonic()
+        self.time_to_first_publish: Optional[float] = None
+
+        config = get_config()
+
+        self.change_filter: Optional[ChangeFilter] = None
+        if config.change_suppression.enabled:
+            self.change_filter = ChangeFilter(
+                {
+                    "boiler_temperature": config.change_suppression.boiler_temperature_deadband,
+                    "burners_modulations": config.change_suppression.burner_modulation_deadband,
+                    "current_total_consumption": config.change_suppression.total_consumption_deadband,
+                },
+                config.change_suppression.heartbeat_minutes * 60,
+                self.name,
+            )
+
+        self.dispatcher = ActionDispatcher(
+            actions, self.change_filter, self._report_first_publish
+        )
+        self.journal: Optional[StateJournal] = None
+        # Action's worker name -> increase it missed before the restart
+        self._missed: dict[str, int] = {}
+        if config.state_file is not None:
+            self.journal = StateJournal(config.state_file, self.name)
+            self._restore_state(self.journal)
+
+    def _report_first_publish(self) -> None:
+        self.time_to_first_publish = time.monotonic() - self.started_at
+        TIME_TO_FIRST_PUBLISH.set(self.time_to_first_publish, device=self.name)
+        logger.info(
+            f"[{self.name}] First value published {self.time_to_first_publish:.2f}s after the start"
+        )
+
+    async def wait_until_ready(
+        self, initial_delay_seconds: float = 1, max_delay_seconds: float = 60
+    ) -> None:
+        """
+        Wait until the device can be read, retrying with an exponential backoff.
+
+        The features fetched here are reused by the first poll of every metric.
+        """
+        delay = initial_delay_seconds
+
+        while True:
+            try:
+                await asyncio.to_thread(self.device.get_snapshot)
+                return
+            except Exception as e:
+                logger.error(
+                    f"[{self.name}] The device can't be read yet: {e}. Retrying in {delay:.0f}s"
+                )
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_delay_seconds)
+
+    def _restore_state(self, journal: StateJournal) -> None:
+        if not journal.restore_context(self.consumption_context):
+            logger.info(f"[{self.name}] No saved state found, a full sync will be done")
+            return
+
+        ctx = self.consumption_context
+        logger.info(
+            f"[{self.name}] Restored state from {journal.path}: total consumption {ctx.total_consumption}, last day {ctx.previous_consumption_date}"
+        )
+
+        assert journal.state is not None
+        for sink, acknowledged in journal.state.acknowledged.items():
+            if acknowledged != ctx.total_consumption:
+                logger.info(
+                    f"Action {sink} is behind: last acknowledged total {acknowledged}, current {ctx.total_consumption}"
+                )
+                self._missed[sink] = ctx.total_consumption - acknowledged
+
+    def _catch_up_actions(self) -> None:
+        """
+        Send the actions the increase they missed before the restart (the last updates they
+        didn't handle) - the current total is sent to every action by the first poll anyway
+        """
+        ctx_now = copy.copy(self.consumption_context)
+        total_consumption = ctx_now.total_consumption
+
+        for worker in self.dispatcher.workers:
+            missed = self._missed.pop(worker.name, 0)
+            if not missed:
+                continue
+
+            logger.info(f"[{self.name}] Sending the missed {missed} to {worker.name}")
+
+            async def send_missed(action: Action, missed: int = missed) -> None:
+                await action.update_current_total_consumption_increasing(
+                    ctx_now, missed
+                )
+
+            future, _ = worker.submit(
+                "current_total_consumption_increasing", send_missed, coalesce=False
+            )
+            self._acknowledge_worker(worker.name, future, total_consumption)
+
+    def _save_state(self) -> None:
+        TOTAL_CONSUMPTION.set(
+            self.consumption_context.total_consumption, device=self.name
+        )
+
+        gas_consumption = self.consumption_context.gas_consumption
+        SNAPSHOTS.update(
+            self.name,
+            gas_consumption=gas_consumption.model_dump(mode="json")
+            if gas_consumption is not None
+            else None,
+            total_consumption=self.consumption_context.total_consumption,
+        )
+
+        if self.journal is not None:
+            self.journal.record_context(self.consumption_context)
+
+    def _acknowledge(
+        self, futures: list[asyncio.Future], total_consumption: int
+    ) -> None:
+        """
+        Record the total counter in the journal for each action, once it handles the update
+        """
+        for worker, future in zip(self.dispatcher.workers, futures):
+            self._acknowledge_worker(worker.name, future, total_consumption)
+
+    def _acknowledge_worker(
+        self, sink: str, future: asyncio.Future, total_consumption: int
+    ) -> None:
+        journal = self.journal
+        if journal is None:
+            return
+
+        def on_done(future: asyncio.Future) -> None:
+            if not future.cancelled() and future.result():
+                journal.acknowledge(sink, total_consumption)
+
+        future.add_done_callback(on_done)
 
     async def handle_gas_usage(self):
         ctx = self.consumption_context
         ctx.previous_total_consumption = ctx.total_consumption
 
-        ctx.gas_consumption = self.device.get_gas_usage()
+        # The device is read in a thread, so that the actions can keep working meanwhile
+        ctx.gas_consumption = await asyncio.to_thread(self.device.get_gas_usage)
+        LAST_SUCCESSFUL_POLL.set(time.time(), device=self.name)
+        snapshot = ConsumptionSnapshot.from_consumption(ctx.gas_consumption)
 
-        # Bugfix: sometimes the daily values are not updated and the data is nonsense (happened to me once)
-        # Check if either:
-        # - the daily values are not the same as the previous daily values (excluding the first value)
-        # - the daily values are not the same as the previous daily values but with offset of 1 (a new day can appear in new values)
-        #
+        # If more than one day has passed since the last known state (e.g. the bridge was
+        # stopped for a while), the missed days can't be handled incrementally - do a full sync,
+        # keeping the known total counter along with the consumption of the missed days
+        missed = None
         if (
-            ctx.previous_consumption_daily is not None
-            and len(ctx.previous_consumption_daily) > 1
-            and ctx.previous_consumption_daily[1:] != ctx.gas_consumption.day[1:]
-            and ctx.previous_consumption_daily[1:-1] != ctx.gas_consumption.day[2:]
+            ctx.previous_consumption_date is not None
+            and (
+                ctx.gas_consumption.day_readat.date() - ctx.previous_consumption_date
+            ).days
+            > 1
         ):
+            missed = ctx.history.missed_consumption(snapshot)
+            logger.warning(
+                f"The last known state is from {ctx.previous_consumption_date}, adding the {missed} consumed since and doing a full sync"
+            )
+            ctx.history.clear()
+
+        diff = ctx.history.diff(snapshot)
+
+        # Bugfix: sometimes the daily values are not updated and the data is nonsense (happened to me once)
+        # The past days have to be either the same as before, or moved by one place (a new day can appear in new values)
+        if diff is not None and not diff.consistent:
             logger.error(
                 f"Daily values are weird: previous: {ctx.previous_consumption_daily}, current: {ctx.gas_consumption.day}. Skipping updating gas..."
             )
             return
 
         # If it's the first run, let's just update the daily values
-        if ctx.previous_consumption_date is None:
-            ctx.previous_consumption_date = ctx.gas_consumption.day_readat.date()
-            ctx.previous_consumption_daily = ctx.gas_consumption.day
-            ctx.total_consumption = sum(ctx.gas_consumption.year)
-
-            # TODO: Maybe fetch the previous total consumption from the action (Domoticz/Home Assistant) instead?
-            ctx.previous_total_consumption = ctx.total_consumption
-
-            for action in get_actions():
-                # Convert the array of daily values to a dictionary with dates
-                # The day_readat is the date of the last value in the array
-                # The next values are for previous days (day_readat - 1, day_readat - 2, etc.)
-                daily_values = {
-                    ctx.gas_consumption.day_readat.date()
-                    - timedelta(days=i): ctx.gas_consumption.day[i]
-                    for i in range(len(ctx.gas_consumption.day))
-                }
-
-                logger.debug(f"Daily values: {daily_values}")
-
-                await action.update_daily_consumption_stats(ctx, daily_values)
-
-                await action.update_current_total_consumption(
-                    ctx, ctx.total_consumption, ctx.gas_consumption.day[0]
-                )
-                await action.update_current_total_consumption_increasing(ctx, 0)
+        if diff is None:
+            ctx.history.append(snapshot)
+
+            if missed is None:
+                ctx.total_consumption = snapshot.year_total
+
+                # TODO: Maybe fetch the previous total consumption from the action (Domoticz/Home Assistant) instead?
+                ctx.previous_total_consumption = ctx.total_consumption
+            else:
+                # The actions' counters go on from the restored total
+                ctx.total_consumption += missed
+            self._save_state()
+
+            # Convert the array of daily values to a dictionary with dates
+            # The day_readat is the date of the last value in the array
+            # The next values are for previous days (day_readat - 1, day_readat - 2, etc.)
+            daily_values = {
+                ctx.gas_consumption.day_readat.date()
+                - timedelta(days=i): ctx.gas_consumption.day[i]
+                for i in range(len(ctx.gas_consumption.day))
+            }
+
+            logger.debug("Daily values: %s", daily_values)
+
+            # The actions might handle the updates later, so give them the state from now
+            ctx_now = copy.copy(ctx)
+            total_consumption = ctx.total_consumption
+            today = ctx.gas_consumption.day[0]
+            consumption_increase_offset = (
+                ctx.total_consumption - ctx.previous_total_consumption
+            )
+
+            self.dispatcher.submit(
+                "daily_consumption_stats",
+                lambda action: action.update_daily_consumption_stats(
+                    ctx_now, daily_values
+                ),
+            )
+            futures = self.dispatcher.submit(
+                "current_total_consumption",
+                lambda action: action.update_current_total_consumption(
+                    ctx_now, total_consumption, today
+                ),
+                coalesce=True,
+                value=total_consumption,
+            )
+            self._acknowledge(futures, total_consumption)
+            self.dispatcher.submit(
+                "current_total_consumption_increasing",
+                lambda action: action.update_current_total_consumption_increasing(
+                    ctx_now, consumption_increase_offset
+                ),
+            )
 
             return
 
         # If a new day didn't start, we just update the current value
-        if (
-            ctx.previous_consumption_date == ctx.gas_consumption.day_readat.date()
-            and ctx.previous_consumption_daily[-6:-1] == ctx.gas_consumption.day[-6:-1]
-        ):
-            logger.debug(
-                f"{ctx.previous_consumption_date=}, {ctx.gas_consumption.day_readat.date()=}, {ctx.previous_consumption_daily[-1]=}, {ctx.gas_consumption.day[-1]=}"
-            )
+        if not diff.shifted:
+            logger.debug("Consumption changed: %s", diff)
 
-            previous_total_daily = sum(ctx.previous_consumption_daily)
-            current_total_daily = sum(ctx.gas_consumption.day)
-
-            counter_offset = current_total_daily - previous_total_daily
+            counter_offset = diff.delta
             ctx.total_consumption += counter_offset
 
-            logger.debug(
-                f"Previous daily array: {ctx.previous_consumption_daily}, current daily array: {ctx.gas_consumption.day}"
-            )
+            ctx.history.append(snapshot)
+            self._save_state()
 
-            ctx.previous_consumption_daily = ctx.gas_consumption.day
-
-            await asyncio.gather(
-                *[
-                    action.update_current_total_consumption(
-                        ctx, ctx.total_consumption, ctx.gas_consumption.day[0]
-                    )
-                    for action in get_actions()
-                ]
+            ctx_now = copy.copy(ctx)
+            total_consumption = ctx.total_consumption
+            today = ctx.gas_consumption.day[0]
+            consumption_increase_offset = (
+                ctx.total_consumption - ctx.previous_total_consumption
             )
 
-            await asyncio.gather(
-                *[
-                    action.update_current_total_consumption_increasing(
-                        ctx, ctx.total_consumption - ctx.previous_total_consumption
-                    )
-                    for action in get_actions()
-                ]
+            futures = self.dispatcher.submit(
+                "current_total_consumption",
+                lambda action: action.update_current_total_consumption(
+                    ctx_now, total_consumption, today
+                ),
+                coalesce=True,
+                value=total_consumption,
+            )
+            self._acknowledge(futures, total_consumption)
+            self.dispatcher.submit(
+                "current_total_consumption_increasing",
+                lambda action: action.update_current_total_consumption_increasing(
+                    ctx_now, consumption_increase_offset
+                ),
             )
 
             logger.info(
-                f"Total consumption: {ctx.total_consumption} m3 (offset: {counter_offset} m3). Sum of daily: {ctx.gas_consumption.day} m3"
+                f"[{self.name}] Total consumption: {ctx.total_consumption} m3 (offset: {counter_offset} m3). Sum of daily: {ctx.gas_consumption.day} m3"
             )
 
             return
         else:
             # If a new day started
-            logger.info("New day started")
+            logger.info(f"[{self.name}] New day started")
+            MIDNIGHT_ROLLOVERS.inc(device=self.name)
 
             # Update the historical value for the previous day
             current_previous_day = ctx.gas_consumption.day[1]
             previous_previous_day = ctx.previous_consumption_daily[0]
 
-            counter_offset = current_previous_day - previous_previous_day
+            counter_offset = diff.previous_day_delta
 
             if counter_offset < 0:
                 logger.warning(
@@ -130,58 +335,163 @@ class ViessmannBridge:
                 f"The previous day's consumption - previous: {previous_previous_day} m3, current: {current_previous_day} m3, offset: {counter_offset} m3"
             )
 
-            ctx.previous_consumption_date = ctx.gas_consumption.day_readat.date()
-            ctx.previous_consumption_daily = ctx.gas_consumption.day
+            ctx.history.append(snapshot)
 
             # Since the current day value didn't exist before, we just add the current day's value to the total (which is equal to the offset)
             new_offset = ctx.gas_consumption.day[0]
             ctx.total_consumption += new_offset
             logger.info(f"New day's consumption: {new_offset} m3")
-
-            await asyncio.gather(
-                *[
-                    action.handle_consumption_midnight_case(
-                        ctx,
-                        counter_offset,
-                        current_previous_day,
-                        ctx.gas_consumption.day[0],
-                        ctx.total_consumption,
-                    )
-                    for action in get_actions()
-                ]
+            self._save_state()
+
+            ctx_now = copy.copy(ctx)
+            today = ctx.gas_consumption.day[0]
+            total_consumption = ctx.total_consumption
+
+            futures = self.dispatcher.submit(
+                "consumption_midnight_case",
+                lambda action: action.handle_consumption_midnight_case(
+                    ctx_now,
+                    counter_offset,
+                    current_previous_day,
+                    today,
+                    total_consumption,
+                ),
             )
+            self._acknowledge(futures, total_consumption)
 
     async def handle_burners(self):
-        config = get_config()
-        burners_modulations = self.device.get_burners_modulations(
-            config.number_of_burners
+        burners_modulations = await asyncio.to_thread(
+            self.device.get_burners_modulations, self.device_config.number_of_burners
+        )
+        timestamp = await asyncio.to_thread(
+            self.device.get_feature_timestamp,
+            *[
+                f"heating.burners.{i}.modulation"
+                for i in range(self.device_config.number_of_burners)
+            ],
+        )
+        LAST_SUCCESSFUL_POLL.set(time.time(), device=self.name)
+        logger.info(f"[{self.name}] Burners modulations: {burners_modulations}%")
+        SNAPSHOTS.update(
+            self.name,
+            burners_modulations=burners_modulations,
+            burners_modulations_timestamp=timestamp.isoformat() if timestamp else None,
         )
-        logger.info(f"Burners modulations: {burners_modulations}%")
 
-        for action in get_actions():
-            await action.handle_burners_modulations(burners_modulations)
+        self.dispatcher.submit(
+            "burners_modulations",
+            lambda action: action.handle_burners_modulations(
+                burners_modulations, timestamp
+            ),
+            coalesce=True,
+            value=burners_modulations,
+        )
 
     async def handle_boiler_temperature(self):
-        boiler_temperature = self.device.get_boiler_temperature()
-        logger.info(f"Boiler temperature: {boiler_temperature}°C")
+        boiler_temperature = await asyncio.to_thread(self.device.get_boiler_temperature)
+        timestamp = await asyncio.to_thread(
+            self.device.get_feature_timestamp, "heating.boiler.sensors.temperature.main"
+        )
+        LAST_SUCCESSFUL_POLL.set(time.time(), device=self.name)
+        logger.info(f"[{self.name}] Boiler temperature: {boiler_temperature}°C")
+        SNAPSHOTS.update(
+            self.name,
+            boiler_temperature=boiler_temperature,
+            boiler_temperature_timestamp=timestamp.isoformat() if timestamp else None,
+        )
 
-        for action in get_actions():
-            await action.handle_boiler_temperature(boiler_temperature)
+        self.dispatcher.submit(
+            "boiler_temperature",
+            lambda action: action.handle_boiler_temperature(
+                boiler_temperature, timestamp
+            ),
+            coalesce=True,
+            value=boiler_temperature,
+        )
+
+    def end_cycle(self) -> None:
+        """
+        Let the actions send what they batched during the poll, once they handled its updates
+        """
+        # Not coalesced - the updates queued after a pending end of a cycle belong to the next one
+        self.dispatcher.submit(END_CYCLE, lambda action: action.end_cycle())
+
+    def _log_stats(self) -> None:
+        logger.info(
+            f"[{self.name}] Features snapshot hits: {self.device.snapshot_hits}, misses: {self.device.snapshot_misses}"
+        )
+        if self.change_filter is not None:
+            logger.info(
+                f"[{self.name}] Writes sent: {self.change_filter.sent}, suppressed: {self.change_filter.suppressed}"
+            )
+        if self.budget is not None:
+            logger.info(
+                f"[{self.name}] Viessmann API calls in the last 24h: {self.budget.used}, remaining: {self.budget.remaining}"
+                + (
+                    f", intervals stretched by {self.scheduler.interval_scale:.2f}x"
+                    if self.scheduler is not None and self.scheduler.interval_scale > 1
+                    else ""
+                )
+            )
 
     async def main_loop(self):
-        logger.info("Starting working")
+        logger.info(f"[{self.name}] Starting working")
         config = get_config()
+        intervals = config.poll_intervals
 
-        logger.debug("Sleeping 10 seconds before start")
-        await asyncio.sleep(10)
+        await self.wait_until_ready()
 
-        while True:
-            logger.info(f"-- Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} --")
+        def poll(
+            handler: Callable[[], Awaitable[None]],
+        ) -> Callable[[], Awaitable[None]]:
+            async def job() -> None:
+                try:
+                    await handler()
+                finally:
+                    self.end_cycle()
 
-            # No concurrent calls because some of the actions might not be thread-safe
+            return job
+
+        async def gas_usage_job() -> None:
             await self.handle_gas_usage()
-            await self.handle_burners()
-            await self.handle_boiler_temperature()
+            self._log_stats()
+
+        # Every metric is polled on its own cadence. The handlers only queue the updates -
+        # every action has its own worker, which keeps the updates ordered for that action,
+        # and the actions handle them concurrently
+        self.scheduler = Scheduler(
+            [
+                ScheduledJob(
+                    "gas_usage",
+                    intervals.gas_usage_seconds or config.sleep_interval_seconds,
+                    poll(gas_usage_job),
+                ),
+                ScheduledJob(
+                    "burners",
+                    intervals.burners_seconds or config.sleep_interval_seconds,
+                    poll(self.handle_burners),
+                ),
+                ScheduledJob(
+                    "boiler_temperature",
+                    intervals.boiler_temperature_seconds
+                    or config.sleep_interval_seconds,
+                    poll(self.handle_boiler_temperature),
+                ),
+            ],
+            self.budget,
+            name=self.name,
+            # A cycle lasts until the slowest action handled its values, up to the next tick
+            settle=self.dispatcher.join,
+        )
 
-            logger.info("All tasks done")
-            await asyncio.sleep(config.sleep_interval_seconds)
+        self._catch_up_actions()
+        self.dispatcher.start()
+        try:
+            await self.scheduler.run_forever()
+        finally:
+            # Give the actions a moment to finish what's already queued
+            await self.dispatcher.join(timeout=10)
+            await self.dispatcher.stop()
+
+            if self.journal is not None:
+                self.journal.close()